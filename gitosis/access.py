@@ -1,5 +1,5 @@
-import os, logging
-from fnmatch import fnmatch
+import os, logging, re
+from fnmatch import fnmatch, translate
 
 from gitosis import group
 from gitosis import util
@@ -94,28 +94,85 @@ def haveAccess(config, user, mode, path):
             return (prefix, mapping)
 
 
+_WILDCARDS = '*?['
+
+def literalPrefix(pattern):
+    """
+    The text of ``pattern`` before its first wildcard, or ``None``
+    if it has none.
+    """
+    for (i, c) in enumerate(pattern):
+        if c in _WILDCARDS:
+            return pattern[:i]
+    return None
+
+class AccessTable(object):
+    """
+    Who is given access to which repositories, indexed for looking
+    up many repositories.
+
+    Literal repository names are found with one dict lookup.
+    Patterns are filed under the text before their first wildcard,
+    so a path only tries the patterns filed under one of its
+    prefixes, not every pattern in the configuration.
+    """
+
+    def __init__(self, expansion):
+        self.expansion = expansion
+        self._literal = {}
+        self._patterns = {}
+
+    def add(self, mode, path, idx, name):
+        """
+        Record that the user (``idx`` 0) or group (``idx`` 1)
+        ``name`` has ``mode`` access to ``path``, which may be a
+        pattern.
+        """
+        prefix = literalPrefix(path)
+        if prefix is None:
+            entry = self._literal.get((mode, path))
+            if entry is None:
+                entry = self._literal[mode, path] = (set(), set())
+        else:
+            bucket = self._patterns.setdefault((mode, prefix), {})
+            if path not in bucket:
+                bucket[path] = (re.compile(translate(path)), (set(), set()))
+            (regex, entry) = bucket[path]
+        entry[idx].add(name)
+
+    def lookup(self, mode, path, users, groups):
+        """
+        Add the users and groups with ``mode`` access to ``path``
+        to the sets ``users`` and ``groups``.
+        """
+        entry = self._literal.get((mode, path))
+        if entry is not None:
+            users.update(entry[0])
+            groups.update(entry[1])
+        for i in range(len(path) + 1):
+            bucket = self._patterns.get((mode, path[:i]))
+            if bucket is None:
+                continue
+            for (regex, entry) in bucket.itervalues():
+                if regex.match(path):
+                    users.update(entry[0])
+                    groups.update(entry[1])
+
+
 def cacheAccess(config, mode, cache):
     """
-    Computes access lists for all repositories in one pass.
+    Computes access lists for all repositories in one pass, into the
+    ``AccessTable`` ``cache``.
     """
     for sectname in config.sections():
         GROUP_PREFIX = 'group '
         USER_PREFIX  = 'user '
-        REPO_PREFIX  = 'repo '
         if sectname.startswith(USER_PREFIX):
             idx = 0
             name = sectname[len(USER_PREFIX):]
         elif sectname.startswith(GROUP_PREFIX):
             idx = 1
             name = sectname[len(GROUP_PREFIX):]
-        elif sectname.startswith(REPO_PREFIX):
-            # Single repository: handle owner
-            name = sectname[len(REPO_PREFIX):]
-            if (mode,name) not in cache:
-                cache[mode,name] = (set(),set())
-
-            continue
-
         else:
             continue
 
@@ -125,15 +182,13 @@ def cacheAccess(config, mode, cache):
                 repos.append(ivalue)
 
         for path in repos:
-            if (mode,path) not in cache:
-                cache[mode,path] = (set(),set())
-
-            cache[mode,path][idx].add(name)
+            cache.add(mode, path, idx, name)
 
 
 def listAccess(config, table, mode, path, users, groups):
     """
-    List users and groups who can access the path.
+    List users and groups who can access the path, whether it is
+    named literally or matched by a pattern.
 
     Note for read-only access, the caller should check for write
     access too.
@@ -143,23 +198,21 @@ def listAccess(config, table, mode, path, users, groups):
     if ext == '.git':
         path = basename
 
-    if (mode,path) in table:
-        (cusers, cgroups) = table[mode,path]
-        users.update(cusers)
-        groups.update(cgroups)
+    table.lookup(mode, path, users, groups)
 
-    if (mode,None) in table:
-        (cusers, cgroups) = table[mode,None]
-        users.update(cusers)
-        groups.update(cgroups)
 
-
-def getAccessTable(config,modes=['readonly','writable','writeable']):
+def getAccessTable(config,modes=['readonly','writable','writeable'],
+                   expansion=None):
     """
     A trivial helper that builds ACL table for all repositories
     and given set of modes.
+
+    Group members are looked up in ``expansion``, a
+    ``group.Expansion`` of ``config``, if given.
     """
-    table = dict()
+    if expansion is None:
+        expansion = group.Expansion(config)
+    table = AccessTable(expansion)
     for mode in modes:
         cacheAccess(config,mode,table)
 
@@ -177,6 +230,6 @@ def getAllAccess(config,table,path,modes=['readonly','writable','writeable']):
 
     all_refs = set(['@'+item for item in groups])
     for grp in groups:
-        group.listMembers(config,grp,all_refs)
+        all_refs.update(table.expansion.members(grp))
 
     return (users, groups, all_refs)
@@ -0,0 +1,136 @@
+"""
+Record repository accesses made through ``gitosis-serve``.
+
+With ``access-log`` set in the ``gitosis`` section, every served
+request appends one line to that file::
+
+	<unix time> <TAB> <user> <TAB> <verb> <TAB> <repository path>
+
+``<repository path>`` is relative to the repositories directory and
+includes the ``.git`` extension. Lines are short and written with a
+single ``O_APPEND`` write, so concurrent ``gitosis-serve`` processes
+do not interleave.
+"""
+
+import errno
+import logging
+import os
+import time
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.accesslog')
+
+def getAccessLogPath(config):
+    path = util.getConfigDefault(config, 'gitosis', 'access-log', None)
+    if path is None:
+        return None
+    return os.path.expanduser(path)
+
+def record(config, user, verb, repopath, _now=None):
+    """
+    Append an access to the log, if enabled.
+
+    Failing to log never fails the request.
+    """
+    path = getAccessLogPath(config)
+    if path is None:
+        return
+    if _now is None:
+        _now = time.time()
+    line = '%d\t%s\t%s\t%s\n' % (_now, user, verb, repopath)
+    try:
+        fd = os.open(path, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError, e:
+        log.warning('Cannot write access log %r: %s', path, e)
+
+def _parse(line):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 4:
+        return None
+    try:
+        when = int(fields[0])
+    except ValueError:
+        return None
+    return (when, fields[1], fields[2], fields[3])
+
+def read(config, since=None):
+    """
+    Generate ``(time, user, verb, repopath)`` for logged accesses.
+    """
+    path = getAccessLogPath(config)
+    if path is None:
+        return
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    try:
+        for line in f:
+            entry = _parse(line)
+            if entry is None:
+                continue
+            if since is not None and entry[0] < since:
+                continue
+            yield entry
+    finally:
+        f.close()
+
+def last_access(config):
+    """
+    Map repository paths to the time they were last accessed.
+    """
+    last = {}
+    for (when, user, verb, repopath) in read(config):
+        if when > last.get(repopath, 0):
+            last[repopath] = when
+    return last
+
+class LastAccess(object):
+    """
+    Like ``last_access``, kept up to date: each lookup only reads
+    what was appended to the log since the one before.
+    """
+
+    def __init__(self, config):
+        self.path = getAccessLogPath(config)
+        self.offset = 0
+        self.last = {}
+
+    def refresh(self):
+        if self.path is None:
+            return
+        try:
+            f = file(self.path)
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        try:
+            if os.fstat(f.fileno()).st_size < self.offset:
+                # started over
+                self.offset = 0
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    # still being written
+                    break
+                self.offset += len(line)
+                entry = _parse(line)
+                if entry is None:
+                    continue
+                (when, user, verb, repopath) = entry
+                if when > self.last.get(repopath, 0):
+                    self.last[repopath] = when
+        finally:
+            f.close()
+
+    def get(self, repopath):
+        self.refresh()
+        return self.last.get(repopath, 0)
@@ -0,0 +1,228 @@
+"""
+Run configured actions after every push.
+
+An action is a shell command, defined in an ``action`` section::
+
+	[action mirror]
+	command = git push --mirror --quiet backup:$GITOSIS_REPO
+	timeout = 300
+	detach = yes
+
+and run by the ``post-receive`` hook for the repositories that list
+it in ``actions``: either in their ``repo`` section, or in a ``group``
+section that has them in ``writable``. The actions of a push run side
+by side on up to ``action-workers`` threads (default 4), in the
+repository, with the pushed ref updates on standard input and
+``GITOSIS_REPO``, ``GITOSIS_USER`` and ``GITOSIS_ACTION`` in the
+environment.
+
+An action running longer than its ``timeout`` (default
+``action-timeout`` in the ``gitosis`` section, or 60 seconds) is
+killed. The push waits for its actions, and sees their output,
+unless they are ``detach``-ed: those run after the hook has
+returned, with their output discarded. Either way, failing actions
+are logged, and never fail the push.
+"""
+
+import errno
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from gitosis import access
+from gitosis import parallel
+from gitosis import util
+
+log = logging.getLogger('gitosis.actions')
+
+class Action(object):
+    def __init__(self, name, command, timeout, detach):
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self.detach = detach
+
+def getWorkers(config):
+    workers = util.getConfigDefault(config, 'gitosis', 'action-workers', '4')
+    return max(1, int(workers))
+
+def haveActions(config):
+    for section in config.sections():
+        if section.startswith('action '):
+            return True
+    return False
+
+def getAction(config, name):
+    """
+    Read the action ``name``, or return ``None`` if it is not
+    defined.
+    """
+    section = 'action %s' % name
+    command = util.getConfigDefault(config, section, 'command', None)
+    if command is None:
+        return None
+    timeout = util.getConfigDefault(config, section, 'timeout', None)
+    if timeout is None:
+        timeout = util.getConfigDefault(config, 'gitosis', 'action-timeout',
+                                        '60')
+    return Action(
+        name=name,
+        command=command,
+        timeout=float(timeout),
+        detach=util.getConfigDefaultBoolean(config, section, 'detach', False),
+        )
+
+def forRepo(config, repopath):
+    """
+    List the actions to run for a push to ``repopath``.
+    """
+    if repopath.endswith('.git'):
+        repopath = repopath[:-len('.git')]
+    names = util.getConfigList(config, 'repo %s' % repopath, 'actions')
+    for section in sorted(config.sections()):
+        if not section.startswith('group '):
+            continue
+        if not config.has_option(section, 'actions'):
+            continue
+        repos = (util.getConfigList(config, section, 'writable')
+                 + util.getConfigList(config, section, 'writeable'))
+        if access.pathMatchPatterns(repopath, repos):
+            names.extend(util.getConfigList(config, section, 'actions'))
+    found = []
+    for name in names:
+        if name in [action.name for action in found]:
+            continue
+        action = getAction(config, name)
+        if action is None:
+            log.warning('Ignoring undefined action %r for %r',
+                        name, repopath)
+            continue
+        found.append(action)
+    return found
+
+def _stop(child):
+    """
+    Kill the process group of ``child``, politely first.
+    """
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(child.pid, sig)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+        for i in range(20):
+            if child.poll() is not None:
+                return
+            time.sleep(0.05)
+    child.wait()
+
+def run_action(action, git_dir, data, env, stdout=None, _interval=0.05):
+    """
+    Run ``action`` with ``data`` on its standard input.
+
+    Returns ``'ok'``, ``'failed'`` or ``'timeout'``.
+    """
+    if stdout is None:
+        stdout = sys.stderr
+    env = dict(env)
+    env['GITOSIS_ACTION'] = action.name
+    # a file, so an action not reading it cannot block us
+    stdin = tempfile.TemporaryFile()
+    try:
+        stdin.write(data)
+        stdin.seek(0)
+        start = time.time()
+        child = subprocess.Popen(
+            args=['/bin/sh', '-c', action.command],
+            cwd=git_dir,
+            env=env,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stdout,
+            close_fds=True,
+            # its own process group, to kill whatever it started
+            preexec_fn=os.setsid,
+            )
+    finally:
+        stdin.close()
+    while child.poll() is None:
+        if time.time() - start >= action.timeout:
+            _stop(child)
+            log.warning('Action %s timed out after %ds',
+                        action.name, action.timeout)
+            return 'timeout'
+        time.sleep(_interval)
+    if child.returncode != 0:
+        log.warning('Action %s failed with exit status %d',
+                    action.name, child.returncode)
+        return 'failed'
+    log.info('Action %s done in %.1fs', action.name, time.time() - start)
+    return 'ok'
+
+def run_all(config, todo, git_dir, data, env, stdout=None):
+    """
+    Run the actions ``todo`` side by side.
+
+    Returns a list of ``(name, status)``, in the order of ``todo``.
+    """
+    statuses = parallel.map(
+        config,
+        lambda action: run_action(action, git_dir, data, env, stdout),
+        todo,
+        workers=getWorkers(config),
+        )
+    return [(action.name, status)
+            for (action, status) in zip(todo, statuses)]
+
+def _detach(fn):
+    """
+    Call ``fn`` in a process of its own, not waiting for it.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            # leave the grandchild to init
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in [0, 1, 2]:
+            os.dup2(devnull, fd)
+        fn()
+    finally:
+        os._exit(0)
+
+def run(config, git_dir, fp, env=None):
+    """
+    Run the actions for a push, reading the ref updates from ``fp``.
+
+    Returns the ``(name, status)`` of the actions waited for.
+    """
+    if not haveActions(config):
+        return []
+    if env is None:
+        env = os.environ
+    repopath = env.get('GITOSIS_REPO')
+    if repopath is None:
+        log.warning('No GITOSIS_REPO in environment, not running actions')
+        return []
+    todo = forRepo(config, repopath)
+    if not todo:
+        return []
+    data = fp.read()
+    detached = [action for action in todo if action.detach]
+    if detached:
+        devnull = file(os.devnull, 'w')
+        try:
+            _detach(lambda: run_all(config, detached, git_dir, data, env,
+                                    devnull))
+        finally:
+            devnull.close()
+    return run_all(config, [action for action in todo if not action.detach],
+                   git_dir, data, env)
@@ -0,0 +1,50 @@
+"""
+Look up SSH keys for ``sshd``'s ``AuthorizedKeysCommand``.
+
+Instead of having ``sshd`` scan one huge ``authorized_keys`` file on
+every login, point it at this helper::
+
+	AuthorizedKeysCommand /usr/bin/gitosis-authorized-keys %t %k
+	AuthorizedKeysCommandUser git
+
+and set ``ssh-key-index-path`` in the ``gitosis`` section. The index
+is rebuilt from ``keydir`` on every push to ``gitosis-admin``; the
+helper prints only the ``authorized_keys`` lines matching the
+presented key.
+"""
+
+import logging
+import sys
+
+from gitosis import app
+from gitosis import ssh
+from gitosis import util
+
+log = logging.getLogger('gitosis.authorized_keys')
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] KEYTYPE KEY')
+        parser.set_description(
+            'Print authorized_keys lines for an SSH key')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        try:
+            (keytype, key) = args
+        except ValueError:
+            parser.error('Missing argument KEYTYPE or KEY.')
+
+        path = util.getSSHKeyIndexPath(config=cfg)
+        if path is None:
+            log.error('No ssh-key-index-path configured.')
+            sys.exit(1)
+
+        try:
+            lines = list(ssh.lookupKeyIndex(path, keytype, key))
+        except (IOError, OSError), e:
+            log.error('Cannot read key index: %s', e)
+            sys.exit(1)
+        for line in lines:
+            print line
@@ -0,0 +1,417 @@
+"""
+Make many changes to ``gitosis-admin`` in one commit.
+
+``gitosis-admin-batch CHANGES`` reads a change set, one change per
+line (``#`` starts a comment)::
+
+	add-key jdoe keys/jdoe.pub
+	remove-user olduser
+	add-members web-devs jdoe asmith
+	remove-members web-devs olduser
+	add-repos web-devs writable web/site web/blog
+	add-repos everyone readonly web/site
+	remove-repos web-devs web/old
+
+``add-key`` makes ``keydir/USER.pub`` a copy of the file.
+``remove-user`` removes the keys of the user and takes them out of
+the ``members`` of every group. ``add-repos`` takes ``writable`` or
+``readonly``; ``remove-repos`` removes from both.
+
+The changes are applied to the tip of ``gitosis-admin`` as one
+commit, made with ``git fast-import`` (key files are streamed to it,
+not read into memory), and the ``post-update`` hook of the
+repository is run once, as if the commit had been pushed. Edits to
+``gitosis.conf`` keep its comments and layout; groups must be in
+``gitosis.conf``, not in ``conf.d``. The same is available from
+Python as ``ChangeSet`` and ``commit``.
+"""
+
+import getpass
+import hashlib
+import itertools
+import logging
+import os
+import socket
+import subprocess
+import sys
+from cStringIO import StringIO
+from ConfigParser import RawConfigParser
+
+from gitosis import app
+from gitosis import repository
+from gitosis import ssh
+from gitosis import util
+
+log = logging.getLogger('gitosis.batch')
+
+ACCESS_MODES = ['writable', 'readonly']
+
+class BatchError(Exception):
+    """Cannot apply changes"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+def _checkUser(user):
+    if not ssh.isSafeUsername(user):
+        raise BatchError('unsafe username', repr(user))
+
+def _add(value, words):
+    have = value.split()
+    return ' '.join(have + [w for w in words if w not in have])
+
+def _remove(value, words):
+    return ' '.join(w for w in value.split() if w not in words)
+
+class ChangeSet(object):
+    """
+    Changes to make to ``gitosis-admin``, in order.
+    """
+
+    def __init__(self):
+        self.changes = []
+
+    def add_key(self, user, path):
+        """
+        Make the file ``path`` the keys of ``user``.
+        """
+        _checkUser(user)
+        self.changes.append(('add-key', user, path))
+
+    def remove_user(self, user):
+        _checkUser(user)
+        self.changes.append(('remove-user', user))
+
+    def add_members(self, group, users):
+        for user in users:
+            if not user.startswith('@'):
+                _checkUser(user)
+        self.changes.append(('add-members', group, list(users)))
+
+    def remove_members(self, group, users):
+        self.changes.append(('remove-members', group, list(users)))
+
+    def add_repos(self, group, mode, repos):
+        if mode not in ACCESS_MODES:
+            raise BatchError('unknown access mode', repr(mode))
+        self.changes.append(('add-repos', group, mode, list(repos)))
+
+    def remove_repos(self, group, repos):
+        self.changes.append(('remove-repos', group, list(repos)))
+
+    def apply_config(self, cfg):
+        """
+        Make the configuration changes to ``cfg``, a
+        ``RawConfigParser``.
+        """
+        for change in self.changes:
+            kind = change[0]
+            if kind == 'remove-user':
+                for section in cfg.sections():
+                    if (section.startswith('group ')
+                        and cfg.has_option(section, 'members')):
+                        cfg.set(section, 'members', _remove(
+                                cfg.get(section, 'members'), [change[1]]))
+                continue
+            if kind == 'add-key':
+                continue
+            section = 'group %s' % change[1]
+            if not cfg.has_section(section):
+                if kind.startswith('remove-'):
+                    continue
+                cfg.add_section(section)
+            if kind == 'add-members':
+                options = ['members']
+            elif kind == 'add-repos':
+                options = [change[2]]
+            elif kind == 'remove-members':
+                options = ['members']
+            else:
+                options = ['writable', 'writeable', 'readonly']
+            for option in options:
+                value = util.getConfigDefault(cfg, section, option, '')
+                if kind.startswith('add-'):
+                    value = _add(value, change[-1])
+                else:
+                    value = _remove(value, change[-1])
+                cfg.set(section, option, value)
+
+    def apply_keys(self, existing):
+        """
+        Work out the key files to write and delete, given the paths
+        of the key files there are now.
+
+        Returns ``(files, deletions)``: a dict mapping paths in the
+        repository to the files to copy there, and a list of paths.
+        """
+        files = {}
+        deletions = set()
+        for change in self.changes:
+            if change[0] == 'add-key':
+                path = 'keydir/%s.pub' % change[1]
+                files[path] = change[2]
+                deletions.discard(path)
+            elif change[0] == 'remove-user':
+                for path in existing + files.keys():
+                    if os.path.basename(path) == '%s.pub' % change[1]:
+                        files.pop(path, None)
+                        if path in existing:
+                            deletions.add(path)
+        return (files, sorted(deletions))
+
+def parse(fp, name='<changes>'):
+    """
+    Read a change set, in the format described above.
+    """
+    changes = ChangeSet()
+    for (lineno, line) in enumerate(fp):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        where = '%s:%d' % (name, lineno + 1)
+        (kind, args) = (words[0], words[1:])
+        try:
+            if kind == 'add-key' and len(args) == 2:
+                changes.add_key(*args)
+            elif kind == 'remove-user' and len(args) == 1:
+                changes.remove_user(*args)
+            elif kind == 'add-members' and len(args) >= 2:
+                changes.add_members(args[0], args[1:])
+            elif kind == 'remove-members' and len(args) >= 2:
+                changes.remove_members(args[0], args[1:])
+            elif kind == 'add-repos' and len(args) >= 3:
+                changes.add_repos(args[0], args[1], args[2:])
+            elif kind == 'remove-repos' and len(args) >= 2:
+                changes.remove_repos(args[0], args[1:])
+            else:
+                raise BatchError('cannot parse', line.strip())
+        except BatchError, e:
+            raise BatchError(where, *e.args)
+    return changes
+
+def edit_config(data, section, option, value):
+    """
+    Set ``option`` in ``section`` of the configuration text
+    ``data``, touching no other line. A ``value`` of ``None`` or
+    ``''`` removes the option.
+    """
+    lines = data.splitlines(True)
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    start = None
+    end = len(lines)
+    for (i, line) in enumerate(lines):
+        m = RawConfigParser.SECTCRE.match(line)
+        if m is None:
+            continue
+        if start is not None:
+            end = i
+            break
+        if m.group('header') == section:
+            start = i
+    if start is None:
+        if not value:
+            return ''.join(lines)
+        if lines and lines[-1].strip():
+            lines.append('\n')
+        lines.append('[%s]\n' % section)
+        lines.append('%s = %s\n' % (option, value))
+        return ''.join(lines)
+
+    # where a new option goes: after the last one in the section
+    last = start + 1
+    i = start + 1
+    while i < end:
+        line = lines[i]
+        m = RawConfigParser.OPTCRE.match(line)
+        if (m is None or line[0].isspace()
+            or line.strip().startswith(('#', ';'))):
+            i += 1
+            continue
+        # continuation lines belong to the option
+        j = i + 1
+        while j < end and lines[j][0].isspace() and lines[j].strip():
+            j += 1
+        if m.group('option').strip().lower() == option:
+            if value:
+                lines[i:j] = ['%s = %s\n' % (option, value)]
+            else:
+                del lines[i:j]
+            return ''.join(lines)
+        last = j
+        i = j
+    if value:
+        lines.insert(last, '%s = %s\n' % (option, value))
+    return ''.join(lines)
+
+def _changedOptions(old, new):
+    for section in new.sections():
+        for (option, value) in new.items(section):
+            if not old.has_section(section):
+                was = ''
+            else:
+                was = util.getConfigDefault(old, section, option, '')
+            # lists, however they were spread over lines
+            if was.split() != value.split():
+                yield (section, option, value)
+
+def _blob_id(f):
+    """
+    The object ID git gives the contents of the file ``f``.
+    """
+    h = hashlib.sha1('blob %d\0' % os.fstat(f.fileno()).st_size)
+    while True:
+        data = f.read(65536)
+        if not data:
+            return h.hexdigest()
+        h.update(data)
+
+def _open(files):
+    for path in sorted(files):
+        try:
+            f = file(files[path], 'rb')
+        except IOError, e:
+            raise BatchError('cannot read key file', files[path],
+                             e.strerror)
+        try:
+            yield (path, f)
+        finally:
+            f.close()
+
+def commit(git_dir, changes, committer, message):
+    """
+    Commit the ``ChangeSet`` to the admin repository ``git_dir``.
+
+    Returns the new commit ID, or ``None`` if nothing changed.
+    """
+    for change in changes.changes:
+        if change[0] == 'add-key' and not os.path.isfile(change[2]):
+            raise BatchError('no such key file', change[2])
+    parent = repository.rev_parse(git_dir, 'refs/heads/master')
+    head = repository.ls_tree(git_dir, ['gitosis.conf', 'keydir'],
+                              rev=parent, recursive=True)
+    data = ''
+    if 'gitosis.conf' in head:
+        data = repository.cat_blob(git_dir, head['gitosis.conf'])
+    old = RawConfigParser()
+    old.readfp(StringIO(data), 'gitosis.conf')
+    new = RawConfigParser()
+    new.readfp(StringIO(data), 'gitosis.conf')
+    changes.apply_config(new)
+    edited = data
+    for (section, option, value) in _changedOptions(old, new):
+        edited = edit_config(edited, section, option, value)
+
+    existing = [path for path in head if path.startswith('keydir/')]
+    (files, deletions) = changes.apply_keys(existing)
+    unchanged = []
+    for path in files:
+        if path in head:
+            f = file(files[path], 'rb')
+            try:
+                if _blob_id(f) == head[path]:
+                    unchanged.append(path)
+            finally:
+                f.close()
+    for path in unchanged:
+        del files[path]
+
+    if edited == data and not files and not deletions:
+        log.info('Nothing to change.')
+        return None
+    config = []
+    if edited != data:
+        config = [('gitosis.conf', edited)]
+    repository.fast_import(
+        git_dir=git_dir,
+        commit_msg=message,
+        committer=committer,
+        # each key file is open only while it is copied
+        files=itertools.chain(config, _open(files)),
+        parent=parent,
+        deletions=deletions,
+        )
+    return repository.rev_parse(git_dir, 'refs/heads/master')
+
+def run_hook(git_dir):
+    """
+    Run the ``post-update`` hook of the admin repository, as a push
+    would.
+    """
+    hook = os.path.join(git_dir, 'hooks', 'post-update')
+    if not os.access(hook, os.X_OK):
+        log.warning('No post-update hook in %r, not running it', git_dir)
+        return
+    env = dict(os.environ)
+    env['GIT_DIR'] = '.'
+    returncode = subprocess.call(
+        args=[hook, 'refs/heads/master'],
+        cwd=git_dir,
+        env=env,
+        close_fds=True,
+        )
+    if returncode != 0:
+        raise BatchError('post-update hook failed',
+                         'exit status %d' % returncode)
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] CHANGES')
+        parser.set_description(
+            'Apply a change set to gitosis-admin as one commit')
+        parser.set_defaults(
+            message='Batch update by gitosis-admin-batch.',
+            committer=None,
+            hook=True,
+            )
+        parser.add_option('-m', '--message',
+                          help='commit message',
+                          )
+        parser.add_option('--committer',
+                          metavar='"NAME <EMAIL>"',
+                          help='committer of the commit'
+                          +' (default: the current user)',
+                          )
+        parser.add_option('--no-hook',
+                          dest='hook',
+                          action='store_false',
+                          help='do not run the post-update hook',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        try:
+            (path,) = args
+        except ValueError:
+            parser.error('Missing argument CHANGES.')
+        os.umask(0022)
+
+        committer = options.committer
+        if committer is None:
+            user = getpass.getuser()
+            committer = '%s <%s@%s>' % (user, user, socket.getfqdn())
+        git_dir = os.path.join(util.getRepositoryDir(cfg), 'gitosis-admin.git')
+
+        try:
+            if path == '-':
+                changes = parse(sys.stdin, '<stdin>')
+            else:
+                f = file(path)
+                try:
+                    changes = parse(f, path)
+                finally:
+                    f.close()
+            rev = commit(git_dir, changes, committer, options.message)
+            if rev is None:
+                return
+            log.info('Committed %s', rev)
+            if options.hook:
+                run_hook(git_dir)
+        except BatchError, e:
+            log.error('%s', e)
+            sys.exit(1)
+        except repository.GitFastImportError, e:
+            # most likely a push moved the branch meanwhile
+            log.error('%s; run again to apply the changes', e)
+            sys.exit(1)
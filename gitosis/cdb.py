@@ -0,0 +1,111 @@
+"""
+Read and write constant databases.
+
+This is the ``cdb`` file format by D. J. Bernstein: a single file
+built once and then replaced atomically, where looking up a key
+costs two reads no matter how many records there are. A key may
+have several values.
+"""
+
+import os
+import struct
+
+_PAIR = struct.Struct('<LL')
+_HEADER_SIZE = 256 * _PAIR.size
+
+def cdb_hash(s):
+    h = 5381
+    for c in s:
+        h = (((h << 5) + h) & 0xffffffff) ^ ord(c)
+    return h
+
+class CdbMaker(object):
+    """
+    Build a database at ``path``.
+
+    Records go to a temporary file that replaces ``path`` on
+    ``finish()``; readers never see a partial database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = '%s.%d.tmp' % (path, os.getpid())
+        self.fp = file(self.tmp, 'wb')
+        self.fp.write('\0' * _HEADER_SIZE)
+        self.pos = _HEADER_SIZE
+        self.tables = [[] for i in range(256)]
+
+    def add(self, key, data):
+        h = cdb_hash(key)
+        self.tables[h & 0xff].append((h, self.pos))
+        self.fp.write(_PAIR.pack(len(key), len(data)))
+        self.fp.write(key)
+        self.fp.write(data)
+        self.pos += _PAIR.size + len(key) + len(data)
+
+    def finish(self):
+        header = []
+        for table in self.tables:
+            nslots = 2 * len(table)
+            slots = [(0, 0)] * nslots
+            for (h, pos) in table:
+                i = (h >> 8) % nslots
+                while slots[i][1]:
+                    i = (i + 1) % nslots
+                slots[i] = (h, pos)
+            header.append((self.pos, nslots))
+            for slot in slots:
+                self.fp.write(_PAIR.pack(*slot))
+            self.pos += nslots * _PAIR.size
+        self.fp.seek(0)
+        for pair in header:
+            self.fp.write(_PAIR.pack(*pair))
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+        os.rename(self.tmp, self.path)
+
+    def abort(self):
+        self.fp.close()
+        os.unlink(self.tmp)
+
+class Cdb(object):
+    """
+    Look up keys in a database written by ``CdbMaker``.
+    """
+
+    def __init__(self, path):
+        self.fp = file(path, 'rb')
+
+    def close(self):
+        self.fp.close()
+
+    def _read(self, pos, size):
+        self.fp.seek(pos)
+        return self.fp.read(size)
+
+    def getall(self, key):
+        """
+        Generate all values stored under ``key``.
+        """
+        h = cdb_hash(key)
+        (tpos, nslots) = _PAIR.unpack(
+            self._read((h & 0xff) * _PAIR.size, _PAIR.size))
+        if not nslots:
+            return
+        i = (h >> 8) % nslots
+        for n in range(nslots):
+            (sh, pos) = _PAIR.unpack(
+                self._read(tpos + i * _PAIR.size, _PAIR.size))
+            if not pos:
+                return
+            if sh == h:
+                (klen, dlen) = _PAIR.unpack(self._read(pos, _PAIR.size))
+                if klen == len(key) and self.fp.read(klen) == key:
+                    yield self.fp.read(dlen)
+            i = (i + 1) % nslots
+
+    def get(self, key, default=None):
+        for data in self.getall(key):
+            return data
+        return default
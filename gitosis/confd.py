@@ -0,0 +1,255 @@
+"""
+Read ``gitosis.conf`` together with the fragments in ``conf.d``.
+
+Besides ``gitosis.conf``, the admin repository may have a
+``conf.d`` directory of ``*.conf`` fragments. They are read after
+``gitosis.conf``, in the order of their names, as if they all were
+one file: a fragment can add options to a section another file
+has. Setting an option that an earlier file set to a different
+value is a conflict; it is reported with both file names, and the
+later value wins.
+
+Each file is parsed once. The result is kept in ``gitosis-confcache``
+in the admin repository under the blob ID, so a push that changes
+one fragment only parses that fragment. ``gitosis-run-hook`` exports
+the merged configuration as ``gitosis.conf``, which is what
+``~/.gitosis.conf`` points to.
+"""
+
+import errno
+import logging
+import marshal
+import os
+from cStringIO import StringIO
+from ConfigParser import RawConfigParser
+
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.confd')
+
+CONF_DIR = 'conf.d'
+CACHE_DIR = 'gitosis-confcache'
+
+class ConfigConflict(object):
+    """
+    An option set to different values by two files.
+    """
+
+    def __init__(self, section, option, first, second):
+        self.section = section
+        self.option = option
+        self.first = first
+        self.second = second
+
+    def __str__(self):
+        return ('[%s] %s in %s overrides %s'
+                % (self.section, self.option, self.second, self.first))
+
+def is_fragment(path):
+    """
+    Whether ``path``, relative to ``conf.d``, is a fragment.
+    """
+    return ('/' not in path
+            and path.endswith('.conf')
+            and not path.startswith('.'))
+
+def files(git_dir, config, confd):
+    """
+    List ``(name, sha1)`` of the files making up the configuration,
+    in the order they are read, given the object IDs of
+    ``gitosis.conf`` and the ``conf.d`` tree (either may be
+    ``None``).
+    """
+    found = []
+    if config is not None:
+        found.append(('gitosis.conf', config))
+    if confd is not None:
+        entries = repository.ls_tree(git_dir, [], rev=confd)
+        for path in sorted(entries):
+            if is_fragment(path):
+                found.append(('%s/%s' % (CONF_DIR, path), entries[path]))
+    return found
+
+def parse(data, name):
+    """
+    Parse one file into a list of ``(section, [(option, value)])``.
+    """
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(data), name)
+    return [(section, cfg.items(section)) for section in cfg.sections()]
+
+def _cache_path(git_dir, sha1):
+    return os.path.join(git_dir, CACHE_DIR, sha1)
+
+def cached(git_dir, sha1):
+    """
+    Return the parsed contents of blob ``sha1`` if they are in the
+    cache, or ``None``.
+    """
+    try:
+        f = file(_cache_path(git_dir, sha1), 'rb')
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        try:
+            return marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            log.warning('Ignoring broken config cache entry %s', sha1)
+            return None
+    finally:
+        f.close()
+
+def _store(git_dir, sha1, parsed):
+    util.mkdir(os.path.join(git_dir, CACHE_DIR), 0755)
+    path = _cache_path(git_dir, sha1)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'wb')
+    try:
+        marshal.dump(parsed, f)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def load(git_dir, name, sha1, catfile, store=True):
+    """
+    Return the parsed contents of blob ``sha1``, from the cache if
+    it is there.
+    """
+    parsed = cached(git_dir, sha1)
+    if parsed is not None:
+        return parsed
+    (type_, data) = catfile.get(sha1)
+    log.debug('Parsing %s (%s)', name, sha1)
+    parsed = parse(data, name)
+    if store:
+        _store(git_dir, sha1, parsed)
+    return parsed
+
+class Merged(object):
+    """
+    A configuration merged from parsed files, added in order.
+    """
+
+    def __init__(self):
+        self.cfg = RawConfigParser()
+        self.conflicts = []
+        self.blobs = set()
+        self._origin = {}
+
+    def add(self, name, parsed, sha1=None, override=True):
+        """
+        Add the parsed file ``name``. Unless ``override``, options
+        an earlier file set keep their value.
+        """
+        for (section, items) in parsed:
+            if not self.cfg.has_section(section):
+                self.cfg.add_section(section)
+            for (option, value) in items:
+                key = (section, option)
+                if key in self._origin and not override:
+                    if self.cfg.get(section, option) != value:
+                        log.warning('%s: [%s] %s is set in %s, ignored',
+                                    name, section, option,
+                                    self._origin[key])
+                    continue
+                if (key in self._origin
+                    and self.cfg.get(section, option) != value):
+                    self.conflicts.append(ConfigConflict(
+                            section, option, self._origin[key], name))
+                self.cfg.set(section, option, value)
+                self._origin[key] = name
+        if sha1 is not None:
+            self.blobs.add(sha1)
+
+def merge(parts):
+    """
+    Merge ``parts``, a list of ``(name, parsed)``, in order.
+
+    Returns ``(cfg, conflicts)``.
+    """
+    merged = Merged()
+    for (name, parsed) in parts:
+        merged.add(name, parsed)
+    return (merged.cfg, merged.conflicts)
+
+def read(git_dir, config, confd, catfile, store=True):
+    """
+    Read the configuration made of the ``gitosis.conf`` blob
+    ``config`` and the ``conf.d`` tree ``confd``.
+
+    Returns a ``Merged``, whose ``blobs`` are the object IDs of the
+    files read.
+    """
+    merged = Merged()
+    for (name, sha1) in files(git_dir, config, confd):
+        merged.add(name, load(git_dir, name, sha1, catfile, store), sha1)
+    return merged
+
+def update(cfg, new):
+    """
+    Apply the settings of ``new`` over those in ``cfg``.
+    """
+    for section in new.sections():
+        if not cfg.has_section(section):
+            cfg.add_section(section)
+        for (option, value) in new.items(section):
+            cfg.set(section, option, value)
+
+def replace(cfg, new):
+    """
+    Make ``cfg`` hold the settings of ``new``, so options removed
+    from the configuration stop applying.
+
+    Options of the ``gitosis`` section that only ``cfg`` has, such
+    as local paths, are kept.
+    """
+    local = []
+    if cfg.has_section('gitosis'):
+        local = cfg.items('gitosis')
+    for section in cfg.sections():
+        cfg.remove_section(section)
+    update(cfg, new)
+    for (option, value) in local:
+        if not cfg.has_section('gitosis'):
+            cfg.add_section('gitosis')
+        if not cfg.has_option('gitosis', option):
+            cfg.set('gitosis', option, value)
+
+def export(merged, config, catfile):
+    """
+    Return the text of the ``Merged`` configuration.
+
+    If it is only the ``gitosis.conf`` blob ``config``, that is
+    returned as is, comments and all.
+    """
+    if merged.blobs == set([config]):
+        (type_, data) = catfile.get(config)
+        return data
+    f = StringIO()
+    print >>f, '# generated by gitosis, edit gitosis.conf and conf.d'
+    print >>f, '# in gitosis-admin instead'
+    print >>f
+    merged.cfg.write(f)
+    return f.getvalue()
+
+def prune(git_dir, keep):
+    """
+    Drop cache entries for blobs not in ``keep``.
+    """
+    path = os.path.join(git_dir, CACHE_DIR)
+    try:
+        names = os.listdir(path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    for name in names:
+        if name not in keep:
+            try:
+                os.unlink(os.path.join(path, name))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
@@ -0,0 +1,236 @@
+"""
+Hand parts of the configuration to other admin repositories.
+
+A ``delegate`` section in ``gitosis.conf`` lets another repository
+configure a set of repositories and groups::
+
+	[delegate web]
+	admin = web-admin
+	repos = web/* www
+	groups = web-devs web-ops
+
+	[group web-leads]
+	members = jdoe
+	writable = web-admin
+
+The ``gitosis.conf`` in ``web-admin`` may then have ``repo``
+sections for repositories matching ``repos``, and ``group`` sections
+for the groups in ``groups``, granting access only to those
+repositories. Everything else in it is ignored, with a warning, as
+are groups the main configuration defines itself and options the
+main configuration sets in a ``repo`` section.
+
+Pushing to ``web-admin`` runs the ``post-update`` of
+``gitosis-admin``, which merges the slices of all delegations after
+its own files (see ``gitosis.confd``) and, as for any push, only
+regenerates what the changed sections affect: the repositories of
+the delegation. The slice applied last is recorded in
+``gitosis-state`` as ``delegate.NAME``. Keys are still only read
+from ``gitosis-admin``.
+"""
+
+import logging
+import os
+
+from gitosis import access
+from gitosis import confd
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.delegate')
+
+POST_UPDATE_HOOK = """\
+#!/bin/sh
+# installed by gitosis, will be overwritten
+exec gitosis-run-hook post-update
+"""
+
+ACCESS_OPTIONS = ['writable', 'writeable', 'readonly']
+
+class Delegation(object):
+    def __init__(self, name, admin, repos, groups):
+        self.name = name
+        self.admin = admin
+        self.repos = repos
+        self.groups = groups
+
+    def key(self):
+        """
+        The ``gitosis-state`` entry for the applied slice.
+        """
+        return 'delegate.%s' % self.name
+
+    def owns(self, path):
+        """
+        Whether the repository ``path`` is in this delegation.
+        """
+        if path.endswith('.git'):
+            path = path[:-len('.git')]
+        return access.pathMatchPatterns(path, self.repos)
+
+    def covers(self, pattern):
+        """
+        Whether every repository ``pattern`` can match is in this
+        delegation.
+
+        A pattern is only trusted if it is one of the delegated ones,
+        or starts with the text of a delegated pattern whose only
+        wildcard is a final ``*``; matching one pattern against
+        another proves nothing.
+        """
+        prefix = access.literalPrefix(pattern)
+        if prefix is None:
+            return self.owns(pattern)
+        if pattern in self.repos:
+            return True
+        for repo in self.repos:
+            literal = access.literalPrefix(repo)
+            if (literal is not None and repo == literal + '*'
+                and prefix.startswith(literal)):
+                return True
+        return False
+
+def getDelegations(config):
+    """
+    List the delegations in ``config``, by name.
+    """
+    found = []
+    for section in sorted(config.sections()):
+        l = section.split(None, 1)
+        if len(l) != 2 or l[0] != 'delegate':
+            continue
+        name = l[1]
+        admin = util.getConfigDefault(config, section, 'admin', None)
+        if admin is None or len(name.split()) != 1:
+            log.warning('Ignoring incomplete [%s]', section)
+            continue
+        if admin.endswith('.git'):
+            admin = admin[:-len('.git')]
+        found.append(Delegation(
+                name=name,
+                admin=admin,
+                repos=util.getConfigList(config, section, 'repos'),
+                groups=util.getConfigList(config, section, 'groups'),
+                ))
+    return found
+
+def admin_path(config, delegation):
+    return os.path.join(util.getRepositoryDir(config),
+                        '%s.git' % delegation.admin)
+
+def lookup(config, git_dir):
+    """
+    Find the delegation whose admin repository is ``git_dir``, or
+    return ``None``.
+    """
+    git_dir = os.path.realpath(git_dir)
+    for delegation in getDelegations(config):
+        if os.path.realpath(admin_path(config, delegation)) == git_dir:
+            return delegation
+    return None
+
+def is_admin(config, repopath):
+    """
+    Whether ``repopath``, relative to the repositories directory, is
+    the admin repository of a delegation.
+    """
+    if repopath.endswith('.git'):
+        repopath = repopath[:-len('.git')]
+    for delegation in getDelegations(config):
+        if delegation.admin == repopath:
+            return True
+    return False
+
+def heads(config, delegations):
+    """
+    Map the ``gitosis-state`` key of each of ``delegations`` to the
+    blob ID of the ``gitosis.conf`` its admin repository has now.
+    """
+    found = {}
+    for delegation in delegations:
+        path = admin_path(config, delegation)
+        if not os.path.isdir(path) or not repository.has_initial_commit(path):
+            continue
+        got = repository.ls_tree(path, ['gitosis.conf'])
+        if 'gitosis.conf' in got:
+            found[delegation.key()] = got['gitosis.conf']
+    return found
+
+def restrict(delegation, parsed, main_groups):
+    """
+    Keep only what ``delegation`` may configure from ``parsed``, a
+    parsed file as ``confd.parse`` returns it.
+    """
+    where = '%s:gitosis.conf' % delegation.admin
+    kept = []
+    for (section, items) in parsed:
+        l = section.split(None, 1)
+        if len(l) == 2 and l[0] == 'repo' and delegation.covers(l[1]):
+            kept.append((section, items))
+            continue
+        if (len(l) != 2 or l[0] != 'group'
+            or l[1] not in delegation.groups):
+            log.warning('%s: [%s] is not delegated to %s, ignored',
+                        where, section, delegation.name)
+            continue
+        if section in main_groups:
+            log.warning('%s: [%s] is defined in gitosis.conf, ignored',
+                        where, section)
+            continue
+        allowed = []
+        for (option, value) in items:
+            if option in ACCESS_OPTIONS:
+                repos = value.split()
+                value = ' '.join(r for r in repos if delegation.covers(r))
+                if len(value.split()) != len(repos):
+                    log.warning('%s: [%s] %s names repositories not'
+                                ' delegated to %s, ignored',
+                                where, section, option, delegation.name)
+            elif option.startswith('map '):
+                if not delegation.covers(value):
+                    log.warning('%s: [%s] %s is not delegated to %s,'
+                                ' ignored',
+                                where, section, option, delegation.name)
+                    continue
+            elif option != 'members':
+                log.warning('%s: [%s] %s cannot be delegated, ignored',
+                            where, section, option)
+                continue
+            allowed.append((option, value))
+        kept.append((section, allowed))
+    return kept
+
+def load(git_dir, config, delegation, sha1, main_groups, store=True):
+    """
+    Return ``(name, parsed)`` for the slice ``sha1`` of
+    ``delegation``, restricted to what it may configure.
+
+    Parses are cached in the admin repository ``git_dir``, like
+    those of its own files.
+    """
+    name = '%s:gitosis.conf' % delegation.admin
+    parsed = confd.cached(git_dir, sha1)
+    if parsed is None:
+        catfile = repository.CatFile(admin_path(config, delegation))
+        try:
+            parsed = confd.load(git_dir, name, sha1, catfile, store)
+        finally:
+            catfile.close()
+    return (name, restrict(delegation, parsed, main_groups))
+
+def install_hook(git_dir, writer=None):
+    """
+    Make pushes to the delegated admin repository ``git_dir`` run
+    ``gitosis-run-hook``.
+    """
+    repository.install_hook(git_dir, 'post-update', POST_UPDATE_HOOK,
+                            writer)
+
+def install_hooks(config, writer=None):
+    """
+    Install the hook in the admin repositories of all delegations.
+    """
+    for delegation in getDelegations(config):
+        path = admin_path(config, delegation)
+        if os.path.isdir(path):
+            install_hook(path, writer)
@@ -0,0 +1,171 @@
+"""
+Work out what an admin push changed since the last applied one.
+
+``gitosis-run-hook`` remembers the object IDs of ``gitosis.conf``,
+``conf.d`` and ``keydir`` it last applied in ``gitosis-state`` inside
+the admin repository. On the next push, the old and new
+configurations are compared section by section, and the changes are
+traced through group membership to the repositories whose generated
+files can be affected.
+"""
+
+import errno
+import logging
+import os
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.delta')
+
+STATE_FILE = 'gitosis-state'
+
+# sections whose settings apply to every repository
+GLOBAL_SECTIONS = ['gitosis', 'defaults']
+
+ACCESS_MODES = ['writable', 'writeable', 'readonly']
+
+def readState(git_dir):
+    """
+    Read the object IDs applied by the previous run.
+
+    Returns a dict, empty if there was no previous run.
+    """
+    state = {}
+    try:
+        f = file(os.path.join(git_dir, STATE_FILE))
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return state
+        raise
+    try:
+        for line in f:
+            words = line.split()
+            if len(words) == 2:
+                state[words[0]] = words[1]
+    finally:
+        f.close()
+    return state
+
+def writeState(git_dir, state):
+    path = os.path.join(git_dir, STATE_FILE)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        for key in sorted(state):
+            print >>f, '%s %s' % (key, state[key])
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def _items(cfg, section):
+    if not cfg.has_section(section):
+        return None
+    return sorted(cfg.items(section))
+
+def changedSections(old, new):
+    """
+    Names of sections added, removed or modified between two configs.
+    """
+    changed = set()
+    for section in set(old.sections()) | set(new.sections()):
+        if _items(old, section) != _items(new, section):
+            changed.add(section)
+    return changed
+
+def _accessList(cfg, section):
+    repos = []
+    if not cfg.has_section(section):
+        return repos
+    for mode in ACCESS_MODES:
+        repos.extend(util.getConfigList(cfg, section, mode))
+    for (name, value) in cfg.items(section):
+        if name.startswith('map '):
+            repos.append(value)
+    return repos
+
+def _containingGroups(cfg, group):
+    """
+    Names of groups that have ``group`` as a member, directly or
+    through other groups.
+    """
+    found = set()
+    todo = [group]
+    while todo:
+        member = '@%s' % todo.pop()
+        for section in cfg.sections():
+            if not section.startswith('group '):
+                continue
+            name = section[len('group '):]
+            if name in found:
+                continue
+            if member in util.getConfigList(cfg, section, 'members'):
+                found.add(name)
+                todo.append(name)
+    return found
+
+class Delta(object):
+    """
+    What to regenerate.
+
+    ``repos`` is the set of repository names whose per-repository
+    files may have changed, or ``None`` for all of them.
+    """
+
+    def __init__(self, config=True, keys=True, repos=None, groups=True,
+                 new_repos=None):
+        self.config = config
+        self.keys = keys
+        self.repos = repos
+        self.groups = groups
+        self.new_repos = new_repos
+
+    def is_empty(self):
+        return not (self.config or self.keys)
+
+    def __repr__(self):
+        return ('Delta(config=%r, keys=%r, repos=%r, groups=%r)'
+                % (self.config, self.keys, self.repos, self.groups))
+
+def compute(old, new, keys_changed=True):
+    """
+    Compare two parsed configurations.
+    """
+    changed = changedSections(old, new)
+    if not changed:
+        return Delta(config=False, keys=keys_changed, repos=set(),
+                     groups=False, new_repos=set())
+
+    for section in GLOBAL_SECTIONS:
+        if section in changed:
+            log.debug('Section %r changed, regenerating all', section)
+            return Delta(keys=True)
+
+    repos = set()
+    groups = False
+    new_repos = set()
+    for section in changed:
+        l = section.split(None, 1)
+        if len(l) != 2:
+            continue
+        (type_, name) = l
+        if type_ == 'repo':
+            repos.add(name)
+            if not old.has_section(section):
+                new_repos.add(name)
+        elif type_ in ['user', 'group']:
+            sections = [section]
+            if type_ == 'group':
+                groups = True
+                for cfg in [old, new]:
+                    sections.extend('group %s' % g for g in
+                                    _containingGroups(cfg, name))
+            for cfg in [old, new]:
+                for s in sections:
+                    repos.update(_accessList(cfg, s))
+
+    for name in repos:
+        if name != name.translate(None, '*?['):
+            log.debug('Pattern %r affected, regenerating all', name)
+            return Delta(keys=keys_changed, groups=groups)
+    return Delta(keys=keys_changed, repos=repos, groups=groups,
+                 new_repos=new_repos)
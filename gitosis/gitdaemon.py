@@ -8,24 +8,23 @@ log = logging.getLogger('gitosis.gitdaemon')
 
 from gitosis import util
 from gitosis import access
+from gitosis import parallel
+from gitosis import repoindex
+from gitosis.writer import Writer
 
 def export_ok_path(repopath):
     p = os.path.join(repopath, 'git-daemon-export-ok')
     return p
 
-def allow_export(repopath):
-    p = export_ok_path(repopath)
-    file(p, 'a').close()
+def allow_export(repopath, writer=None):
+    if writer is None:
+        writer = Writer()
+    writer.touch(export_ok_path(repopath))
 
-def deny_export(repopath):
-    p = export_ok_path(repopath)
-    try:
-        os.unlink(p)
-    except OSError, e:
-        if e.errno == errno.ENOENT:
-            pass
-        else:
-            raise
+def deny_export(repopath, writer=None):
+    if writer is None:
+        writer = Writer()
+    writer.remove(export_ok_path(repopath))
 
 def _extract_reldir(topdir, dirpath):
     if topdir == dirpath:
@@ -36,6 +35,20 @@ def _extract_reldir(topdir, dirpath):
     return reldir
 
 def walk_repos(config):
+    """
+    Generate ``(dirpath, repo, name)`` for all repositories, from the
+    ``repository-index`` if there is one, otherwise by walking the
+    repositories directory.
+    """
+    found = repoindex.walk(config)
+    if found is not None:
+        return iter(found)
+    return walk_tree(config)
+
+def walk_tree(config):
+    """
+    Like ``walk_repos``, always walking the repositories directory.
+    """
     repositories = util.getRepositoryDir(config)
 
     def _error(e):
@@ -58,6 +71,9 @@ def walk_repos(config):
         to_recurse = []
         repos = []
         for dirname in dirnames:
+            if dirname.startswith('.'):
+                # gitosis housekeeping, never a valid repository name
+                continue
             if dirname.endswith('.git'):
                 repos.append(dirname)
             else:
@@ -72,22 +88,58 @@ def walk_repos(config):
             yield (dirpath, repo, name)
 
 
-def set_export_ok(config):
+def find_repos(config, names):
+    """
+    Like ``walk_repos``, but only for the named repositories, and
+    without walking the tree.
+    """
+    repositories = util.getRepositoryDir(config)
+    for name in sorted(names):
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        (reldir, basename) = os.path.split(name)
+        if reldir:
+            dirpath = os.path.join(repositories, reldir)
+        else:
+            dirpath = repositories
+        repo = '%s.git' % basename
+        if os.path.isdir(os.path.join(dirpath, repo)):
+            yield (dirpath, repo, name)
+
+def select_repos(config, names=None, inventory=None):
+    """
+    All repositories if ``names`` is ``None``, otherwise only the
+    named ones.
+
+    :param inventory: ``inventory.Inventory`` to look in, instead of
+        the filesystem
+    """
+    if inventory is not None:
+        return inventory.select(names)
+    if names is None:
+        return walk_repos(config)
+    return find_repos(config, names)
+
+def set_export_ok(config, names=None, inventory=None, writer=None,
+                  expansion=None):
     global_enable = util.getConfigDefaultBoolean(config, 'defaults', 'daemon', False)
     log.debug(
         'Global default is %r',
         {True: 'allow', False: 'deny'}.get(global_enable),
         )
 
+    if writer is None:
+        writer = Writer()
+
     enable_if_all = util.getConfigDefaultBoolean(config, 'defaults', 'daemon-if-all', False)
     if enable_if_all:
-        access_table = access.getAccessTable(config)
+        access_table = access.getAccessTable(config, expansion=expansion)
     log.debug(
         'If accessible to @all: %r',
         {True: 'allow', False: 'unchanged'}.get(enable_if_all),
         )
 
-    for (dirpath, repo, name) in walk_repos(config):
+    def _set((dirpath, repo, name)):
         try:
             enable = config.getboolean('repo %s' % name, 'daemon')
         except (NoSectionError, NoOptionError):
@@ -98,7 +150,9 @@ def set_export_ok(config):
 
         if enable:
             log.debug('Allow %r', name)
-            allow_export(os.path.join(dirpath, repo))
+            allow_export(os.path.join(dirpath, repo), writer)
         else:
             log.debug('Deny %r', name)
-            deny_export(os.path.join(dirpath, repo))
+            deny_export(os.path.join(dirpath, repo), writer)
+
+    parallel.map(config, _set, select_repos(config, names, inventory))
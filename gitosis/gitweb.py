@@ -26,8 +26,11 @@ To plug this into ``gitweb``, you have two choices.
 """
 
 import os, urllib, logging
+from cStringIO import StringIO
 
 from gitosis import util
+from gitosis import parallel
+from gitosis.writer import Writer
 
 def _escape_filename(s):
     s = s.replace('\\', '\\\\')
@@ -35,11 +38,23 @@ def _escape_filename(s):
     s = s.replace('"', '\\"')
     return s
 
-def enum_cfg_repos(config):
+def _exists(config, inventory):
+    if inventory is not None:
+        return inventory.exists
+    repositories = util.getRepositoryDir(config)
+    return lambda subpath: os.path.exists(os.path.join(repositories, subpath))
+
+def enum_cfg_repos(config, inventory=None, names=None):
     """
     Enumerates all repositories that have repo sections in the config.
+
+    :param names: only these repositories, default all
+
+    :param inventory: ``inventory.Inventory`` to look in, instead of
+        the filesystem
     """
     repositories = util.getRepositoryDir(config)
+    exists = _exists(config, inventory)
 
     for section in config.sections():
         l = section.split(None, 1)
@@ -50,8 +65,10 @@ def enum_cfg_repos(config):
             continue
 
         name, = l
+        if names is not None and name not in names:
+            continue
 
-        if not os.path.exists(os.path.join(repositories, name)):
+        if not exists(name):
             subpath = '%s.git' % name
         else:
             subpath = name
@@ -59,7 +76,7 @@ def enum_cfg_repos(config):
         yield (section, name, repositories, subpath)
 
 
-def generate_project_list_fp(config, fp):
+def generate_project_list_fp(config, fp, inventory=None):
     """
     Generate projects list for ``gitweb``.
 
@@ -72,13 +89,14 @@ def generate_project_list_fp(config, fp):
     log = logging.getLogger('gitosis.gitweb.generate_projects_list')
 
     global_enable = util.getConfigDefaultBoolean(config, 'defaults', 'gitweb', False)
+    exists = _exists(config, inventory)
 
-    for (section, name, topdir, subpath) in enum_cfg_repos(config):
+    for (section, name, topdir, subpath) in enum_cfg_repos(config, inventory):
         enable = util.getConfigDefaultBoolean(config, section, 'gitweb', global_enable)
         if not enable:
             continue
 
-        if not os.path.exists(os.path.join(topdir,subpath)):
+        if not exists(subpath):
             log.warning(
                 'Cannot find %(name)r in %(topdir)r'
                 % dict(name=name,topdir=topdir))
@@ -98,7 +116,7 @@ def generate_project_list_fp(config, fp):
         line = ' '.join([urllib.quote_plus(s) for s in response])
         print >>fp, line
 
-def generate_project_list(config, path):
+def generate_project_list(config, path, inventory=None, writer=None):
     """
     Generate projects list for ``gitweb``.
 
@@ -108,29 +126,32 @@ def generate_project_list(config, path):
     :param path: path to write projects list to
     :type path: str
     """
-    tmp = '%s.%d.tmp' % (path, os.getpid())
-
-    f = file(tmp, 'w')
-    try:
-        generate_project_list_fp(config=config, fp=f)
-    finally:
-        f.close()
+    if writer is None:
+        writer = Writer()
+    f = StringIO()
+    generate_project_list_fp(config=config, fp=f, inventory=inventory)
+    writer.write(path, f.getvalue())
 
-    os.rename(tmp, path)
 
-
-def set_descriptions(config):
+def set_descriptions(config, names=None, inventory=None, writer=None):
     """
     Set descriptions for gitweb use.
+
+    :param names: only set these repositories, default all
     """
     log = logging.getLogger('gitosis.gitweb.set_descriptions')
 
-    for (section, name, topdir, subpath) in enum_cfg_repos(config):
+    exists = _exists(config, inventory)
+
+    # one writer per file, the last section for a path wins
+    todo = {}
+    for (section, name, topdir, subpath) in enum_cfg_repos(
+        config, inventory, names):
         description = util.getConfigDefault(config, section, 'description', None)
         if not description:
             continue
 
-        if not os.path.exists(os.path.join(topdir,subpath)):
+        if not exists(subpath):
             log.warning(
                 'Cannot find %(name)r in %(topdir)r'
                 % dict(name=name,topdir=topdir))
@@ -141,10 +162,12 @@ def set_descriptions(config):
             subpath,
             'description',
             )
-        tmp = '%s.%d.tmp' % (path, os.getpid())
-        f = file(tmp, 'w')
-        try:
-            print >>f, description
-        finally:
-            f.close()
-        os.rename(tmp, path)
+        todo[path] = description
+
+    if writer is None:
+        writer = Writer()
+
+    def _write((path, description)):
+        writer.write(path, '%s\n' % description)
+
+    parallel.map(config, _write, sorted(todo.items()))
@@ -1,5 +1,9 @@
-import os, logging
+import logging
+import threading
+from cStringIO import StringIO
+
 from gitosis import util
+from gitosis.writer import Writer
 
 def _getMembership(config, user, seen):
     log = logging.getLogger('gitosis.group.getMembership')
@@ -49,7 +53,7 @@ def getMembership(config, user):
     yield 'all'
 
 
-def listMembers(config, group, mset):
+def listMembers(config, group, mset, _seen=None):
     """
     Generate a list of members of a group
 
@@ -58,16 +62,120 @@ def listMembers(config, group, mset):
     :param mset: Set of members to amend
     """
 
-    if group <> 'all':
+    if _seen is None:
+        _seen = set()
+    if group <> 'all' and group not in _seen:
+        # expand each group once, so groups that include each
+        # other do not recurse forever
+        _seen.add(group)
         members = util.getConfigList(config, 'group %s' % group, 'members')
 
         for user in members:
             mset.add(user)
             if user.startswith('@'):
-                listMembers(config, user[1:], mset)
+                listMembers(config, user[1:], mset, _seen)
+
 
+class Expansion(object):
+    """
+    The members of every group, nested groups included, worked out
+    once for all the repositories a generator goes through.
+
+    Groups that are members of each other, directly or not, all end
+    up with the same members. Safe to share between threads.
+    """
 
-def generate_group_list_fp(config, fp):
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._closure = None
+
+    def _direct(self):
+        direct = {}
+        for section in self.config.sections():
+            GROUP_PREFIX = 'group '
+            if section.startswith(GROUP_PREFIX):
+                direct[section[len(GROUP_PREFIX):]] = util.getConfigList(
+                    self.config, section, 'members')
+        # like listMembers, never expand "all"
+        direct['all'] = []
+        return direct
+
+    def _expand(self):
+        """
+        Find the strongly connected components of the group graph
+        (Tarjan), without recursion so nesting depth does not
+        matter, and give each the members of its own groups and of
+        the components below it, which are always done first.
+        """
+        direct = self._direct()
+        def nested(group):
+            return [m[1:] for m in direct.get(group, []) if m.startswith('@')]
+
+        closure = {}
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        for root in sorted(direct):
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(nested(root)))]
+            while work:
+                (node, children) = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(nested(child))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] != index[node]:
+                        continue
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    members = set()
+                    for group in component:
+                        for member in direct.get(group, []):
+                            members.add(member)
+                            sub = member[1:]
+                            if member.startswith('@') and sub not in component:
+                                members.update(closure[sub])
+                    members = frozenset(members)
+                    for group in component:
+                        closure[group] = members
+        return closure
+
+    def members(self, group):
+        """
+        All members of ``group``: users, and nested groups as
+        ``@name`` along with their members.
+        """
+        self._lock.acquire()
+        try:
+            if self._closure is None:
+                self._closure = self._expand()
+        finally:
+            self._lock.release()
+        return self._closure.get(group, frozenset())
+
+
+def generate_group_list_fp(config, fp, expansion=None):
     """
     Generate group list for ``gitweb``.
 
@@ -76,7 +184,11 @@ def generate_group_list_fp(config, fp):
 
     :param fp: file to write group list to
     :type fp: file
+
+    :param expansion: ``Expansion`` of ``config`` to share
     """
+    if expansion is None:
+        expansion = Expansion(config)
     for section in config.sections():
         GROUP_PREFIX = 'group '
         if not section.startswith(GROUP_PREFIX):
@@ -85,15 +197,14 @@ def generate_group_list_fp(config, fp):
         if group == 'all':
             continue
 
-        items = set()
-        listMembers(config, group, items)
+        items = expansion.members(group)
 
         users = filter(lambda u: not u.startswith('@'), items)
         line = group + ': ' + ' '.join(sorted(users))
         print >>fp, line
 
 
-def generate_group_list(config, path):
+def generate_group_list(config, path, writer=None, expansion=None):
     """
     Generate group list for ``gitweb``.
 
@@ -102,13 +213,11 @@ def generate_group_list(config, path):
 
     :param path: path to write group list to
     :type path: str
-    """
-    tmp = '%s.%d.tmp' % (path, os.getpid())
 
-    f = file(tmp, 'w')
-    try:
-        generate_group_list_fp(config=config, fp=f)
-    finally:
-        f.close()
-
-    os.rename(tmp, path)
+    :param expansion: ``Expansion`` of ``config`` to share
+    """
+    if writer is None:
+        writer = Writer()
+    f = StringIO()
+    generate_group_list_fp(config=config, fp=f, expansion=expansion)
+    writer.write(path, f.getvalue())
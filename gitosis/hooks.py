@@ -0,0 +1,213 @@
+"""
+Share one hooks directory between all managed repositories.
+
+With ``shared-hooks`` set in the ``gitosis`` section to a directory,
+``gitosis-run-hook`` keeps the hooks gitosis needs in that directory,
+and repositories are pointed at it with ``core.hooksPath``: new ones
+when they are created, existing ones on their next push or the next
+``gitosis-run-hook post-update``. Changing what the hooks do is then
+one file write instead of one per repository, and creating a
+repository no longer copies the default template hooks.
+
+Each shared hook only exists while it has work to do:
+
+- ``pre-receive`` while push limits are configured
+- ``post-receive`` while ``repository-index`` is set or there are
+  push actions
+- ``post-update`` while there are delegations; it only runs
+  ``gitosis-run-hook`` for their admin repositories
+
+``gitosis-admin`` keeps its own hooks, and so do repositories with
+hooks of their own, which gitosis does not replace.
+"""
+
+import errno
+import logging
+import os
+
+from gitosis import actions
+from gitosis import delegate
+from gitosis import gitdaemon
+from gitosis import limits
+from gitosis import parallel
+from gitosis import repoindex
+from gitosis import repository
+from gitosis import util
+from gitosis.writer import Writer
+
+log = logging.getLogger('gitosis.hooks')
+
+HOOKS = ['pre-receive', 'post-receive', 'post-update']
+
+POST_UPDATE_HOOK = """\
+#!/bin/sh
+# installed by gitosis, will be overwritten
+case "$(cd "$GIT_DIR" && pwd -P)" in
+%(cases)s) exec gitosis-run-hook post-update ;;
+esac
+"""
+
+def getSharedHooksDir(config):
+    path = util.getConfigDefault(config, 'gitosis', 'shared-hooks', None)
+    if path is None:
+        return None
+    return os.path.abspath(os.path.expanduser(path))
+
+def _quote(s):
+    return "'%s'" % s.replace("'", "'\\''")
+
+def scripts(config):
+    """
+    Map each of ``HOOKS`` to the script the shared directory should
+    have for it, or ``None`` if it has nothing to do.
+    """
+    found = dict((name, None) for name in HOOKS)
+    if limits.haveLimits(config):
+        found['pre-receive'] = limits.PRE_RECEIVE_HOOK
+    if (repoindex.getIndexPath(config) is not None
+        or actions.haveActions(config)):
+        found['post-receive'] = repoindex.POST_RECEIVE_HOOK
+    admins = sorted(set(
+            os.path.realpath(delegate.admin_path(config, delegation))
+            for delegation in delegate.getDelegations(config)))
+    if admins:
+        found['post-update'] = POST_UPDATE_HOOK % dict(
+            cases='|'.join(_quote(path) for path in admins),
+            )
+    return found
+
+def install(config, writer=None):
+    """
+    Bring the shared hooks directory up to date.
+    """
+    if writer is None:
+        writer = Writer()
+    path = getSharedHooksDir(config)
+    if not writer.dry_run:
+        util.mkdir(path, 0755)
+    for (name, script) in sorted(scripts(config).items()):
+        hook = os.path.join(path, name)
+        if script is None:
+            writer.remove(hook)
+        else:
+            writer.write(hook, script, mode=0755)
+
+def _is_admin(config, git_dir):
+    admin = os.path.join(util.getRepositoryDir(config), 'gitosis-admin.git')
+    return os.path.realpath(git_dir) == os.path.realpath(admin)
+
+def _hooks_path(git_dir):
+    """
+    Return ``core.hooksPath`` of the repository, or ``None``.
+
+    Reads the file instead of running ``git config``; this is done
+    for every push.
+    """
+    try:
+        f = file(os.path.join(git_dir, 'config'))
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        section = None
+        found = None
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                section = line[1:].split(']', 1)[0].strip().lower()
+            elif section == 'core' and '=' in line:
+                (key, value) = line.split('=', 1)
+                if key.strip().lower() == 'hookspath':
+                    found = value.strip()
+        return found
+    finally:
+        f.close()
+
+def _custom_hooks(git_dir):
+    """
+    List the hooks of the repository not installed by gitosis.
+    """
+    path = os.path.join(git_dir, 'hooks')
+    try:
+        names = os.listdir(path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    custom = []
+    for name in sorted(names):
+        hook = os.path.join(path, name)
+        if name.endswith('.sample') or not os.access(hook, os.X_OK):
+            continue
+        f = file(hook)
+        try:
+            if 'installed by gitosis' not in f.read():
+                custom.append(name)
+        finally:
+            f.close()
+    return custom
+
+def use(config, git_dir, writer=None):
+    """
+    Point the repository ``git_dir`` at the shared hooks directory.
+
+    Returns whether it uses the shared hooks; if not, it needs hooks
+    of its own, as without ``shared-hooks``.
+    """
+    path = getSharedHooksDir(config)
+    if path is None or _is_admin(config, git_dir):
+        return False
+    if writer is None:
+        writer = Writer()
+    current = _hooks_path(git_dir)
+    if current == path:
+        writer.unchanged(os.path.join(git_dir, 'config'))
+        return True
+    if current is not None:
+        log.warning('Not sharing hooks with %r, it has core.hooksPath %r',
+                    git_dir, current)
+        return False
+    custom = _custom_hooks(git_dir)
+    if custom:
+        log.warning('Not sharing hooks with %r, it has custom hooks: %s',
+                    git_dir, ' '.join(custom))
+        return False
+    if not writer.dry_run:
+        repository.set_config(git_dir, 'core.hooksPath', path)
+    writer.changed(os.path.join(git_dir, 'config'))
+    return True
+
+def init(config, path, mode):
+    """
+    Create a repository at ``path``, from ``init-template`` if set.
+
+    It shares the hooks unless the template gave it hooks of its
+    own, which ``core.hooksPath`` would silently disable.
+    """
+    template = util.getConfigDefault(config, 'gitosis', 'init-template',
+                                     None)
+    if template is None:
+        repository.init(path=path, mode=mode,
+                        hooks_path=getSharedHooksDir(config))
+    else:
+        repository.init(path=path, template=template, mode=mode)
+        repository.init(path=path, mode=mode)
+        use(config, path)
+
+def use_all(config, names=None, inventory=None, writer=None):
+    """
+    Point all (or the named) repositories at the shared hooks.
+
+    Returns the names of those that need hooks of their own.
+    """
+    def _use((dirpath, repo, name)):
+        if use(config, os.path.join(dirpath, repo), writer):
+            return None
+        return name
+    own = parallel.map(
+        config,
+        _use,
+        gitdaemon.select_repos(config, names, inventory),
+        )
+    return [name for name in own if name is not None]
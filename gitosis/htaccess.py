@@ -1,6 +1,6 @@
-import errno
 import logging
 import os
+from cStringIO import StringIO
 
 log = logging.getLogger('gitosis.htaccess')
 
@@ -8,60 +8,60 @@ from gitosis import util
 from gitosis import access
 from gitosis import group
 from gitosis import gitdaemon
+from gitosis import parallel
+from gitosis.writer import Writer
 
 def htaccess_path(repopath):
     p = os.path.join(repopath, '.htaccess')
     return p
 
-def remove_htaccess(repopath):
-    p = htaccess_path(repopath)
-    try:
-        os.unlink(p)
-    except OSError, e:
-        if e.errno == errno.ENOENT:
-            pass
-        else:
-            raise
+def remove_htaccess(repopath, writer=None):
+    if writer is None:
+        writer = Writer()
+    writer.remove(htaccess_path(repopath))
 
-def write_htaccess(repopath, users, groups):
-    path = htaccess_path(repopath)
-    tmp  = '%s.%d.tmp' % (path, os.getpid())
+def write_htaccess(repopath, users, groups, writer=None):
+    if writer is None:
+        writer = Writer()
 
-    f = file(tmp, 'w')
-    try:
-        ulist = sorted(users)
-        if ulist <> []:
-            print >>f, 'Require user '+' '.join(ulist)
-        glist = sorted(groups)
-        if glist <> []:
-            print >>f, 'Require group '+' '.join(glist)
-        if ulist == [] and glist == []:
-            print >>f, 'Order allow,deny'
-            print >>f, 'Deny from all'
-    finally:
-        f.close()
+    f = StringIO()
+    ulist = sorted(users)
+    if ulist <> []:
+        print >>f, 'Require user '+' '.join(ulist)
+    glist = sorted(groups)
+    if glist <> []:
+        print >>f, 'Require group '+' '.join(glist)
+    if ulist == [] and glist == []:
+        print >>f, 'Order allow,deny'
+        print >>f, 'Deny from all'
 
-    os.rename(tmp, path)
+    writer.write(htaccess_path(repopath), f.getvalue())
 
 
-def gen_htaccess(config):
-    table = access.getAccessTable(config)
+def gen_htaccess(config, names=None, inventory=None, writer=None,
+                 expansion=None):
+    table = access.getAccessTable(config, expansion=expansion)
+    if writer is None:
+        writer = Writer()
 
-    for (dirpath, repo, name) in gitdaemon.walk_repos(config):
+    def _gen((dirpath, repo, name)):
         (users, groups, all_refs) = access.getAllAccess(config,table,name)
 
         if '@all' in all_refs:
             log.debug('Allow all for %r', name)
-            remove_htaccess(os.path.join(dirpath, repo))
+            remove_htaccess(os.path.join(dirpath, repo), writer)
         else:
-            write_htaccess(os.path.join(dirpath, repo), users, groups)
+            write_htaccess(os.path.join(dirpath, repo), users, groups, writer)
+
+    parallel.map(config, _gen, gitdaemon.select_repos(config, names, inventory))
 
 
-def gen_htaccess_if_enabled(config):
+def gen_htaccess_if_enabled(config, names=None, inventory=None,
+                            writer=None, expansion=None):
     do_htaccess = util.getConfigDefaultBoolean(config, 'gitosis', 'htaccess', False)
 
     if do_htaccess:
-        gen_htaccess(config)
+        gen_htaccess(config, names, inventory, writer, expansion)
 
     return do_htaccess
 
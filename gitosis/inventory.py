@@ -0,0 +1,247 @@
+"""
+Know what is in the repositories directory, looking only once.
+
+``gitosis-run-hook`` used to walk the whole repositories directory
+once per generated file type, and check each configured repository
+with ``os.path.exists`` in every generator. An ``Inventory`` is
+shared by all of them during one run:
+
+- the first ``walk()`` reads the ``repository-index`` if there is
+  one, or lists the tree with ``scandir`` where available, which
+  tells directories from files without a ``stat`` call, and never
+  looks inside ``.git`` directories; later walks are answered from
+  memory
+- ``exists()`` and ``is_repo()`` are answered from the listing once
+  there is one, otherwise each path is checked once and remembered
+
+Repositories created or removed while an inventory is in use are not
+noticed, so build it after creating repositories.
+"""
+
+import errno
+import logging
+import os
+import stat
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from gitosis import repoindex
+from gitosis import util
+
+log = logging.getLogger('gitosis.inventory')
+
+def _listdir(path):
+    """
+    Return ``(entries, syscalls)``, where ``entries`` is a list of
+    ``(name, is_dir, is_symlink)``.
+    """
+    entries = []
+    if scandir is not None:
+        syscalls = 1
+        for entry in scandir(path):
+            is_symlink = entry.is_symlink()
+            if is_symlink:
+                syscalls += 1
+            entries.append((entry.name, entry.is_dir(), is_symlink))
+        return (entries, syscalls)
+
+    names = os.listdir(path)
+    syscalls = 1 + len(names)
+    for name in names:
+        full = os.path.join(path, name)
+        try:
+            st = os.lstat(full)
+        except OSError:
+            continue
+        is_symlink = stat.S_ISLNK(st.st_mode)
+        if is_symlink:
+            syscalls += 1
+            is_dir = os.path.isdir(full)
+        else:
+            is_dir = stat.S_ISDIR(st.st_mode)
+        entries.append((name, is_dir, is_symlink))
+    return (entries, syscalls)
+
+class Inventory(object):
+    """
+    The repositories under the repositories directory of ``config``.
+
+    Paths given to and returned from the methods are relative to the
+    repositories directory. Safe to use from several threads.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self.topdir = util.getRepositoryDir(config)
+        self._lock = threading.Lock()
+        # set once the tree has been listed
+        self._repos = None
+        self._repo_set = None
+        self._dirs = None
+        self._entries = None
+        self._walk_cost = 0
+        self._checked = {}
+        # what was done, and what callers would have done without us
+        self.syscalls = 0
+        self.without = 0
+
+    def scan(self):
+        """
+        List the tree now, rather than on the first ``walk()``.
+        """
+        self._lock.acquire()
+        try:
+            if self._repos is not None:
+                return
+            if self._from_index():
+                return
+            repos = []
+            dirs = set()
+            entries = set()
+            todo = ['']
+            while todo:
+                reldir = todo.pop()
+                try:
+                    (listing, syscalls) = _listdir(
+                        os.path.join(self.topdir, reldir))
+                except OSError, e:
+                    if e.errno in [errno.ENOENT, errno.ENOTDIR]:
+                        continue
+                    raise
+                self.syscalls += syscalls
+                # what os.walk pays: a listing and an isdir per entry
+                self._walk_cost += 1 + len(listing)
+                dirs.add(reldir)
+                for (name, is_dir, is_symlink) in listing:
+                    relpath = os.path.join(reldir, name)
+                    entries.add(relpath)
+                    if name.startswith('.') or not is_dir:
+                        continue
+                    if name.endswith('.git'):
+                        repos.append(relpath)
+                    elif not is_symlink:
+                        todo.append(relpath)
+            repos.sort()
+            self._dirs = dirs
+            self._entries = entries
+            self._repo_set = set(repos)
+            self._repos = repos
+            log.debug('Listed %d directories, found %d repositories',
+                      len(dirs), len(repos))
+        finally:
+            self._lock.release()
+
+    def _from_index(self):
+        indexed = repoindex.read(self._config)
+        if indexed is None:
+            return False
+        self.syscalls += 1
+        repos = sorted('%s.git' % name for name in indexed)
+        dirs = set([''])
+        for relpath in repos:
+            reldir = os.path.dirname(relpath)
+            while reldir not in dirs:
+                dirs.add(reldir)
+                reldir = os.path.dirname(reldir)
+        self._dirs = dirs
+        self._entries = set(repos) | dirs
+        self._repo_set = set(repos)
+        self._repos = repos
+        # the walk it replaces
+        self._walk_cost = len(dirs) + len(repos)
+        log.debug('Read %d repositories from the index', len(repos))
+        return True
+
+    def walk(self):
+        """
+        Generate ``(dirpath, repo, name)`` for all repositories, like
+        ``gitdaemon.walk_repos``, sorted by name.
+        """
+        self.scan()
+        self._count(0, self._walk_cost)
+        for relpath in self._repos:
+            (reldir, repo) = os.path.split(relpath)
+            name = relpath[:-len('.git')]
+            yield (os.path.join(self.topdir, reldir).rstrip('/'), repo, name)
+
+    def _count(self, syscalls, without):
+        self._lock.acquire()
+        try:
+            self.syscalls += syscalls
+            self.without += without
+        finally:
+            self._lock.release()
+
+    def _listed(self, relpath):
+        """
+        Whether the directory ``relpath`` is in was listed.
+        """
+        return (self._dirs is not None
+                and os.path.dirname(relpath) in self._dirs)
+
+    def _check(self, kind, relpath, fn):
+        key = (kind, relpath)
+        self._lock.acquire()
+        try:
+            got = self._checked.get(key)
+        finally:
+            self._lock.release()
+        if got is None:
+            got = fn(os.path.join(self.topdir, relpath))
+            self._lock.acquire()
+            try:
+                self._checked[key] = got
+            finally:
+                self._lock.release()
+            self._count(1, 1)
+        else:
+            self._count(0, 1)
+        return got
+
+    def exists(self, relpath):
+        relpath = os.path.normpath(relpath)
+        if self._listed(relpath):
+            self._count(0, 1)
+            return relpath in self._entries
+        return self._check('exists', relpath, os.path.exists)
+
+    def is_repo(self, relpath):
+        """
+        Whether ``relpath`` is a directory named ``*.git``.
+        """
+        relpath = os.path.normpath(relpath)
+        if not relpath.endswith('.git'):
+            return False
+        if self._listed(relpath):
+            self._count(0, 1)
+            return relpath in self._repo_set
+        return self._check('isdir', relpath, os.path.isdir)
+
+    def select(self, names=None):
+        """
+        Like ``gitdaemon.select_repos``: all repositories if
+        ``names`` is ``None``, otherwise only the named ones.
+        """
+        if names is None:
+            return self.walk()
+        return self._find(names)
+
+    def _find(self, names):
+        for name in sorted(names):
+            if name.endswith('.git'):
+                name = name[:-len('.git')]
+            (reldir, basename) = os.path.split(name)
+            repo = '%s.git' % basename
+            if self.is_repo(os.path.join(reldir, repo)):
+                yield (os.path.join(self.topdir, reldir).rstrip('/'),
+                       repo, name)
+
+    def saved(self):
+        return max(0, self.without - self.syscalls)
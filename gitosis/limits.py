@@ -0,0 +1,244 @@
+"""
+Admission limits for pushes.
+
+Limits are read from the ``repo`` section of the repository being
+pushed to, then from the ``user`` and ``group`` sections of the
+pushing user (the smallest value wins), then from ``defaults``:
+
+- ``max-pack-size``: largest pack accepted, enforced by
+  ``git receive-pack`` itself through ``receive.maxInputSize`` while
+  the pack is still arriving
+- ``max-blob-size``: largest single blob accepted
+- ``max-ref-updates``: most refs changed by one push
+
+Sizes take an optional ``k``, ``m`` or ``g`` suffix. The latter two
+are checked by a ``pre-receive`` hook that ``gitosis-serve`` and
+``gitosis-run-hook`` install, which rejects the push before any ref
+is updated and records the rejection in the ``access-log``.
+"""
+
+import logging
+import os
+import subprocess
+
+from gitosis import accesslog
+from gitosis import gitdaemon
+from gitosis import group
+from gitosis import parallel
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.limits')
+
+LIMITS = ['max-pack-size', 'max-blob-size', 'max-ref-updates']
+
+PRE_RECEIVE_HOOK = """\
+#!/bin/sh
+# installed by gitosis, will be overwritten
+set -e
+exec gitosis-run-hook pre-receive
+"""
+
+_SUFFIXES = dict(k=1024, m=1024**2, g=1024**3)
+
+def parseSize(s):
+    s = s.strip().lower()
+    factor = _SUFFIXES.get(s[-1:])
+    if factor is not None:
+        s = s[:-1]
+    else:
+        factor = 1
+    return int(s) * factor
+
+def _envName(limit):
+    return 'GITOSIS_%s' % limit.upper().replace('-', '_')
+
+def _getLimit(config, section, limit):
+    """
+    Read one limit, or ``None`` if it is not set or is not a size.
+    """
+    value = util.getConfigDefault(config, section, limit, None)
+    if value is None:
+        return None
+    try:
+        return parseSize(value)
+    except ValueError:
+        log.warning('Ignoring bad %s %r in [%s]', limit, value, section)
+        return None
+
+def getLimits(config, user, name):
+    """
+    Resolve the limits for ``user`` pushing to repository ``name``.
+
+    Returns a dict with an entry for each configured limit; badly
+    written values are logged and ignored.
+    """
+    sections = ['user %s' % user]
+    sections.extend('group %s' % g for g in
+                    group.getMembership(config=config, user=user))
+    limits = {}
+    for limit in LIMITS:
+        value = _getLimit(config, 'repo %s' % name, limit)
+        if value is None:
+            found = [v for v in
+                     [_getLimit(config, s, limit) for s in sections]
+                     if v is not None]
+            if found:
+                value = min(found)
+        if value is None:
+            value = _getLimit(config, 'defaults', limit)
+        if value is not None:
+            limits[limit] = value
+    return limits
+
+def haveLimits(config):
+    for section in config.sections():
+        for limit in LIMITS:
+            if config.has_option(section, limit):
+                return True
+    return False
+
+def environment(user, repopath, limits):
+    """
+    Environment for ``git receive-pack`` to enforce ``limits`` and
+    for the ``pre-receive`` hook to find them.
+    """
+    env = dict(GITOSIS_USER=user, GITOSIS_REPO=repopath)
+    for (limit, value) in limits.items():
+        env[_envName(limit)] = str(value)
+    if 'max-pack-size' in limits:
+        params = os.environ.get('GIT_CONFIG_PARAMETERS', '')
+        env['GIT_CONFIG_PARAMETERS'] = (
+            "%s 'receive.maxinputsize=%d'"
+            % (params, limits['max-pack-size'])).strip()
+    return env
+
+def limitsFromEnvironment(env):
+    limits = {}
+    for limit in LIMITS:
+        value = env.get(_envName(limit))
+        if value is not None:
+            limits[limit] = int(value)
+    return limits
+
+class PushRejected(Exception):
+    """Push rejected"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+NULL_SHA1 = '0' * 40
+
+def read_updates(fp):
+    updates = []
+    for line in fp:
+        words = line.split()
+        if len(words) != 3:
+            continue
+        updates.append(tuple(words))
+    return updates
+
+def find_large_blob(git_dir, new_revs, max_size):
+    """
+    Return ``(sha1, size)`` of a blob bigger than ``max_size`` that
+    is reachable from ``new_revs`` but not from any existing ref, or
+    ``None``.
+    """
+    if not new_revs:
+        return None
+    revlist = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'rev-list', '--objects',
+              '--stdin', '--not', '--all'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    check = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'cat-file',
+              # %(rest) makes it split off the paths rev-list adds
+              '--batch-check=%(objecttype) %(objectsize) %(objectname) %(rest)'],
+        stdin=revlist.stdout,
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    revlist.stdout.close()
+    for rev in new_revs:
+        revlist.stdin.write('%s\n' % rev)
+    revlist.stdin.close()
+    found = None
+    for line in check.stdout:
+        words = line.split(None, 3)
+        if len(words) < 3 or words[0] != 'blob':
+            continue
+        size = int(words[1])
+        if found is None and size > max_size:
+            found = (words[2], size)
+    check.wait()
+    revlist.wait()
+    return found
+
+def check_push(git_dir, updates, limits):
+    """
+    Raise ``PushRejected`` if ``updates`` break ``limits``.
+    """
+    max_refs = limits.get('max-ref-updates')
+    if max_refs is not None and len(updates) > max_refs:
+        raise PushRejected(
+            'max-ref-updates',
+            '%d refs updated, at most %d allowed' % (len(updates), max_refs))
+
+    max_blob = limits.get('max-blob-size')
+    if max_blob is not None:
+        new_revs = [new for (old, new, ref) in updates if new != NULL_SHA1]
+        found = find_large_blob(git_dir, new_revs, max_blob)
+        if found is not None:
+            (sha1, size) = found
+            raise PushRejected(
+                'max-blob-size',
+                'blob %s is %d bytes, at most %d allowed'
+                % (sha1, size, max_blob))
+
+def pre_receive(cfg, git_dir, fp, env=None):
+    """
+    Check a push against the limits ``gitosis-serve`` put in the
+    environment. Returns whether the push is accepted.
+    """
+    if env is None:
+        env = os.environ
+    limits = limitsFromEnvironment(env)
+    if not limits:
+        return True
+    updates = read_updates(fp)
+    try:
+        check_push(git_dir, updates, limits)
+    except PushRejected, e:
+        log.error('%s', e)
+        accesslog.record(
+            cfg,
+            env.get('GITOSIS_USER', '-'),
+            'rejected-%s' % e.args[0],
+            env.get('GITOSIS_REPO', '-'),
+            )
+        return False
+    return True
+
+def install_hook(git_dir, writer=None):
+    """
+    Install the ``pre-receive`` hook, unless the repository has a
+    hook of its own.
+    """
+    repository.install_hook(git_dir, 'pre-receive', PRE_RECEIVE_HOOK, writer)
+
+def install_hooks(config, names=None, inventory=None, writer=None):
+    """
+    Install the ``pre-receive`` hook in all (or the named)
+    repositories, if any limits are configured.
+    """
+    if not haveLimits(config):
+        return
+    parallel.map(
+        config,
+        lambda (dirpath, repo, name): install_hook(
+            os.path.join(dirpath, repo), writer),
+        gitdaemon.select_repos(config, names, inventory),
+        )
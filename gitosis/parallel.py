@@ -0,0 +1,157 @@
+"""
+Run independent pieces of work on a few threads.
+
+The work ``gitosis-run-hook`` does is mostly waiting for the
+filesystem: stat, write and rename of small files in every
+repository. On a network filesystem those calls are slow but can
+overlap, so stages that do not depend on each other run side by side,
+and per-repository work within a stage is spread over the same
+``workers`` threads (default 4, 1 runs everything in order).
+
+Every file is still written to a temporary name and renamed, and
+each file has exactly one writer, so results do not depend on the
+order the threads run in.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.parallel')
+
+def getWorkers(config):
+    workers = int(util.getConfigDefault(config, 'gitosis', 'workers', '4'))
+    return max(1, workers)
+
+_local = threading.local()
+
+def _run(fn, items, workers):
+    """
+    Call ``fn`` for each of ``items`` on up to ``workers`` threads.
+
+    Calls made from within ``fn`` share the same ``workers`` slots
+    rather than getting their own, so however deeply the work is
+    nested, no more than ``workers`` calls run at once.
+
+    Returns a list of ``(result, exc_info)``, in the order of
+    ``items``. Every item is tried, even after a failure.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    slots = getattr(_local, 'slots', None)
+    owned = slots is None
+    if owned:
+        # the calling thread holds one slot, through the whole run
+        slots = threading.Semaphore(workers - 1)
+        _local.slots = slots
+
+    lock = threading.Lock()
+    todo = iter(enumerate(items))
+
+    def take():
+        lock.acquire()
+        try:
+            try:
+                return todo.next()
+            except StopIteration:
+                return None
+        finally:
+            lock.release()
+
+    def call((i, item)):
+        try:
+            results[i] = (fn(item), None)
+        except Exception:
+            results[i] = (None, sys.exc_info())
+
+    def help():
+        _local.slots = slots
+        while True:
+            slots.acquire()
+            try:
+                got = take()
+                if got is None:
+                    return
+                call(got)
+            finally:
+                slots.release()
+
+    threads = [threading.Thread(target=help)
+               for n in range(min(workers, len(items)) - 1)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            got = take()
+            if got is None:
+                break
+            call(got)
+    finally:
+        if owned:
+            for thread in threads:
+                thread.join()
+            _local.slots = None
+        else:
+            # let our helpers, and those of others waiting for us,
+            # have our slot while we wait for them
+            slots.release()
+            for thread in threads:
+                thread.join()
+            slots.acquire()
+    return results
+
+def map(config, fn, items, workers=None):
+    """
+    Like the builtin ``map``, with the calls spread over the
+    configured number of threads, or ``workers`` if given.
+
+    If any call fails, the first failure (in the order of ``items``)
+    is raised once all calls are done.
+    """
+    if workers is None:
+        workers = getWorkers(config)
+    results = _run(fn, items, workers)
+    for (result, exc_info) in results:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return [result for (result, exc_info) in results]
+
+class StageError(Exception):
+    """Stages failed"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ', '.join(self.args))
+
+def run_stages(config, stages, timings=None):
+    """
+    Run ``stages``, a list of ``(name, fn)``, side by side.
+
+    Each failure is logged under the name of its stage; if any stage
+    failed, ``StageError`` naming them is raised once all stages are
+    done. Returns a dict mapping stage names to the results of their
+    ``fn``. If given, ``timings`` is filled with the seconds each
+    stage took, failed or not.
+    """
+    def run((name, fn)):
+        start = time.time()
+        try:
+            return fn()
+        finally:
+            if timings is not None:
+                timings[name] = time.time() - start
+    results = _run(run, stages, getWorkers(config))
+    done = {}
+    failed = []
+    for ((name, fn), (result, exc_info)) in zip(stages, results):
+        if exc_info is not None:
+            log.error('Stage %s failed: %s', name, exc_info[1],
+                      exc_info=exc_info)
+            failed.append(name)
+        else:
+            done[name] = result
+    if failed:
+        raise StageError(*failed)
+    return done
@@ -0,0 +1,339 @@
+"""
+Place new repositories across several storage roots.
+
+With ``repository-roots`` set in the ``gitosis`` section, a newly
+created repository is put on the root with the best score, and a
+symlink to it is left at its usual place under the repositories
+directory. The symlink is the record of the placement: looking a
+repository up stays a single path resolution, and everything that
+walks the repositories directory keeps working unchanged.
+
+The score of a root combines its free space, free inodes and the
+number of I/Os currently in flight on its block device, weighted by
+``placement-space-weight``, ``placement-inode-weight`` and
+``placement-load-weight``.
+"""
+
+import errno
+import logging
+import os
+import shutil
+
+from gitosis import app
+from gitosis import gitdaemon
+from gitosis import repoindex
+from gitosis import util
+
+log = logging.getLogger('gitosis.placement')
+
+DISKSTATS = '/proc/diskstats'
+
+def getRoots(config):
+    """
+    List configured repository roots, or ``[]`` if placement is off.
+    """
+    return [os.path.expanduser(root) for root in
+            util.getConfigList(config, 'gitosis', 'repository-roots')]
+
+def _getWeight(config, entry, default):
+    value = util.getConfigDefault(config, 'gitosis', entry, None)
+    if value is None:
+        return default
+    return float(value)
+
+def getWeights(config):
+    return dict(
+        space=_getWeight(config, 'placement-space-weight', 1.0),
+        inodes=_getWeight(config, 'placement-inode-weight', 0.5),
+        load=_getWeight(config, 'placement-load-weight', 0.5),
+        )
+
+def read_inflight(path=None):
+    """
+    Read the number of I/Os in flight per device from ``/proc/diskstats``.
+
+    Returns a dict keyed by ``(major, minor)``; empty if unavailable.
+    """
+    if path is None:
+        path = DISKSTATS
+    inflight = {}
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return inflight
+        raise
+    try:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 12:
+                continue
+            try:
+                key = (int(fields[0]), int(fields[1]))
+                inflight[key] = int(fields[11])
+            except ValueError:
+                continue
+    finally:
+        f.close()
+    return inflight
+
+def root_stats(root, inflight):
+    """
+    Describe a root as fractions of free space and free inodes, and
+    a load figure in ``[0, 1)``.
+    """
+    st = os.statvfs(root)
+    if st.f_blocks:
+        space = float(st.f_bavail) / st.f_blocks
+    else:
+        space = 0.0
+    if st.f_files:
+        inodes = float(st.f_favail) / st.f_files
+    else:
+        # some filesystems have no fixed inode table
+        inodes = 1.0
+    dev = os.stat(root).st_dev
+    ios = inflight.get((os.major(dev), os.minor(dev)), 0)
+    load = float(ios) / (1 + ios)
+    return dict(space=space, inodes=inodes, load=load)
+
+def score(stats, weights):
+    return (weights['space'] * stats['space']
+            + weights['inodes'] * stats['inodes']
+            - weights['load'] * stats['load'])
+
+def rank_roots(config, _inflight=None):
+    """
+    Return ``(score, root)`` pairs for all usable roots, best first.
+    """
+    if _inflight is None:
+        _inflight = read_inflight()
+    weights = getWeights(config)
+    ranked = []
+    for root in getRoots(config):
+        try:
+            stats = root_stats(root, _inflight)
+        except OSError, e:
+            log.warning('Ignoring unusable root %r: %s', root, e)
+            continue
+        ranked.append((score(stats, weights), root))
+    ranked.sort(reverse=True)
+    return ranked
+
+def choose_root(config, _inflight=None):
+    """
+    Pick the root a new repository should live on.
+
+    Returns ``None`` when placement is not configured.
+    """
+    ranked = rank_roots(config, _inflight=_inflight)
+    if not ranked:
+        return None
+    (best_score, best) = ranked[0]
+    log.debug('Placing on %r (score %.3f)', best, best_score)
+    return best
+
+def find_root(config, fullpath):
+    """
+    Return the root ``fullpath`` has been placed on, or ``None``.
+    """
+    if not os.path.islink(fullpath):
+        return None
+    target = os.path.realpath(fullpath)
+    for root in getRoots(config):
+        root = os.path.realpath(root)
+        if target.startswith(root + os.sep):
+            return root
+    return None
+
+def _link(target, linkpath):
+    tmp = '%s.%d.tmp' % (linkpath, os.getpid())
+    try:
+        os.unlink(tmp)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            pass
+        else:
+            raise
+    os.symlink(target, tmp)
+    os.rename(tmp, linkpath)
+
+def link_placed(target, topdir, repopath, mode=0750):
+    """
+    Point ``topdir/repopath`` at a repository placed on another root.
+    """
+    p = topdir
+    for segment in repopath.split(os.sep)[:-1]:
+        p = os.path.join(p, segment)
+        util.mkdir(p, mode)
+    _link(os.path.abspath(target), os.path.join(topdir, repopath))
+
+def move_repo(topdir, repopath, newroot):
+    """
+    Move a placed repository to ``newroot`` and repoint its symlink.
+
+    Pushes to the repository while it is being copied may be lost;
+    run this when the repository is quiet.
+    """
+    linkpath = os.path.join(topdir, repopath)
+    old = os.path.realpath(linkpath)
+    new = os.path.abspath(os.path.join(newroot, repopath))
+    p = newroot
+    for segment in repopath.split(os.sep)[:-1]:
+        p = os.path.join(p, segment)
+        util.mkdir(p, 0750)
+    tmp = '%s.%d.tmp' % (new, os.getpid())
+    shutil.copytree(old, tmp, symlinks=True)
+    shutil.copystat(old, tmp)
+    os.rename(tmp, new)
+    link_placed(new, topdir, repopath)
+    shutil.rmtree(old)
+    log.info('Moved %r from %r to %r', repopath, old, new)
+
+def list_placed(config):
+    """
+    Generate ``(root, topdir, repopath)`` for all placed repositories.
+    """
+    topdir = util.getRepositoryDir(config)
+    for (dirpath, repo, name) in gitdaemon.walk_repos(config):
+        fullpath = os.path.join(dirpath, repo)
+        root = find_root(config, fullpath)
+        if root is None:
+            continue
+        yield (root, topdir, '%s.git' % name)
+
+def _capacity(root):
+    st = os.statvfs(root)
+    return st.f_blocks * st.f_frsize
+
+def _freed(stats, size):
+    """
+    ``stats`` of a root after ``size`` bytes are moved off it.
+    """
+    stats = dict(stats)
+    if stats['bytes']:
+        stats['space'] += float(size) / stats['bytes']
+    return stats
+
+def _spread(stats, weights):
+    scores = [score(s, weights) for s in stats.values()]
+    return max(scores) - min(scores)
+
+def rebalance(config, max_moves=None, threshold=0.05, dry_run=False,
+              _stats=None):
+    """
+    Move repositories from the worst scoring root to the best one.
+
+    Root statistics and repository sizes are taken once, and each
+    move updates the free space of both roots from the size of the
+    repository. A repository is only moved if that narrows the gap
+    between the best and the worst score, so none can go back and
+    forth. Stops when the scores are within ``threshold`` of each
+    other, when no move narrows the gap, or after ``max_moves``
+    moves. With ``dry_run``, the moves are only logged. Returns the
+    list of moves as ``(repopath, from_root, to_root)``.
+    """
+    weights = getWeights(config)
+    if _stats is None:
+        inflight = read_inflight()
+        _stats = {}
+        for root in getRoots(config):
+            try:
+                stats = root_stats(root, inflight)
+                stats['bytes'] = _capacity(root)
+            except OSError, e:
+                log.warning('Ignoring unusable root %r: %s', root, e)
+                continue
+            _stats[root] = stats
+    stats = dict((os.path.realpath(root), s) for (root, s) in _stats.items())
+    if len(stats) < 2:
+        return []
+
+    placed = {}
+    for (root, topdir, repopath) in list_placed(config):
+        if root not in stats:
+            continue
+        size = util.diskUsage(os.path.join(root, repopath))
+        placed.setdefault(root, []).append((size, topdir, repopath))
+
+    moves = []
+    while max_moves is None or len(moves) < max_moves:
+        ranked = [(score(s, weights), root) for (root, s) in stats.items()]
+        ranked.sort(reverse=True)
+        (best_score, best) = ranked[0]
+        (worst_score, worst) = ranked[-1]
+        gap = best_score - worst_score
+        if gap <= threshold:
+            break
+
+        # the biggest repository that helps frees up the most per move
+        chosen = None
+        for candidate in sorted(placed.get(worst, []), reverse=True):
+            size = candidate[0]
+            after = dict(stats)
+            after[worst] = _freed(stats[worst], size)
+            after[best] = _freed(stats[best], -size)
+            if _spread(after, weights) < gap:
+                chosen = candidate
+                break
+        if chosen is None:
+            break
+        stats = after
+        placed[worst].remove(chosen)
+        placed.setdefault(best, []).append(chosen)
+
+        (size, topdir, repopath) = chosen
+        moves.append((repopath, worst, best))
+        if dry_run:
+            log.info('Would move %r (%d bytes) from %r to %r',
+                     repopath, size, worst, best)
+            continue
+        move_repo(topdir, repopath, best)
+        repoindex.record(config, 'move', repopath, best)
+    return moves
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Move repositories between repository roots')
+        parser.set_defaults(
+            dry_run=False,
+            max_moves=None,
+            threshold=0.05,
+            )
+        parser.add_option('--dry-run',
+                          action='store_true',
+                          help='only show the moves to make',
+                          )
+        parser.add_option('--max-moves',
+                          metavar='N',
+                          type='int',
+                          help='move at most N repositories',
+                          )
+        parser.add_option('--threshold',
+                          metavar='SCORE',
+                          type='float',
+                          help='stop when scores differ by at most SCORE',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        os.umask(0022)
+        os.chdir(os.path.expanduser('~'))
+
+        if not getRoots(cfg):
+            log.error('No repository-roots configured.')
+            return
+
+        for (score_, root) in rank_roots(cfg):
+            log.info('Root %r scores %.3f', root, score_)
+        moves = rebalance(
+            cfg,
+            max_moves=options.max_moves,
+            threshold=options.threshold,
+            dry_run=options.dry_run,
+            )
+        log.info('Done, %d move(s).', len(moves))
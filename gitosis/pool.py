@@ -0,0 +1,147 @@
+"""
+Keep a pool of ready-made empty repositories for auto-init.
+
+With ``init-pool-size`` set in the ``gitosis`` section, every
+repository root gets a ``.gitosis-pool`` directory holding up to that
+many bare repositories, initialized the same way ``gitosis-serve``
+would (including ``init-template``). Creating a repository on first
+push then only takes a rename. The pool is refilled by
+``gitosis-run-hook`` and by ``gitosis-refill-pool``, which is meant
+to be run from cron.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+
+from gitosis import app
+from gitosis import hooks
+from gitosis import placement
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.pool')
+
+POOL_DIR = '.gitosis-pool'
+
+def getPoolSize(config):
+    size = util.getConfigDefault(config, 'gitosis', 'init-pool-size', None)
+    if size is None:
+        return 0
+    return int(size)
+
+def getPoolMode(config):
+    """
+    Directory mode of pooled repositories; repositories asking for
+    anything else are initialized the slow way.
+    """
+    mode = util.getConfigDefault(config, 'defaults', 'dirmode', None)
+    if mode is None:
+        return 0750
+    return int(mode, 8)
+
+def pool_path(base):
+    return os.path.join(base, POOL_DIR)
+
+def _ready(path):
+    try:
+        names = os.listdir(path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    return sorted(name for name in names if not name.startswith('tmp-'))
+
+def take(config, base, fullpath, mode):
+    """
+    Move a pooled repository to ``fullpath``.
+
+    Leading directories of ``fullpath`` must exist. Returns whether a
+    repository was taken; if not, the caller should init one itself.
+    """
+    if getPoolSize(config) <= 0 or mode != getPoolMode(config):
+        return False
+    path = pool_path(base)
+    for name in _ready(path):
+        try:
+            os.rename(os.path.join(path, name), fullpath)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                # someone else got to it first
+                continue
+            if e.errno in [errno.EEXIST, errno.ENOTEMPTY, errno.EXDEV]:
+                return False
+            raise
+        log.debug('Took %r from pool for %r', name, fullpath)
+        return True
+    log.debug('Pool in %r is empty', path)
+    return False
+
+def refill(config, dry_run=False):
+    """
+    Top up the pool of every repository root.
+
+    Returns the number of repositories created, or that would be
+    with ``dry_run``.
+    """
+    size = getPoolSize(config)
+    if size <= 0:
+        return 0
+
+    mode = getPoolMode(config)
+    bases = placement.getRoots(config)
+    if not bases:
+        bases = [util.getRepositoryDir(config)]
+
+    created = 0
+    for base in bases:
+        path = pool_path(base)
+        if dry_run:
+            missing = max(0, size - len(_ready(path)))
+            if missing:
+                log.info('Would add %d repositories to pool in %r',
+                         missing, path)
+            created += missing
+            continue
+        util.mkdir(path, 0750)
+        missing = size - len(_ready(path))
+        for i in range(missing):
+            # unique, unlike anything made from the pid
+            tmp = tempfile.mkdtemp(prefix='tmp-', dir=path)
+            name = os.path.basename(tmp)[len('tmp-'):]
+            try:
+                os.chmod(tmp, mode)
+                hooks.init(config, tmp, mode)
+            except repository.GitInitError, e:
+                log.warning('Cannot fill pool in %r: %s', path, e)
+                shutil.rmtree(tmp, ignore_errors=True)
+                break
+            try:
+                os.rename(tmp, os.path.join(path, name))
+            except OSError, e:
+                if e.errno not in [errno.EEXIST, errno.ENOTEMPTY]:
+                    raise
+                # left over from an earlier entry of the same name
+                log.warning('Pool entry %r exists, discarding new one',
+                            name)
+                shutil.rmtree(tmp, ignore_errors=True)
+                continue
+            created += 1
+    log.debug('Added %d repositories to pool', created)
+    return created
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Refill the pool of empty repositories')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        os.umask(0022)
+        os.chdir(os.path.expanduser('~'))
+        refill(cfg)
@@ -0,0 +1,133 @@
+"""
+Check the ``repository-index`` against the repositories directory.
+
+``gitosis-reindex`` walks the repositories directory and rewrites the
+index from what it finds: repositories missing from the index are
+added, ones no longer there are dropped, and ones moved to another
+repository root get their new root. Creation and push times already
+in the index are kept. Run it to create the index, and then now and
+then from cron to repair anything the recorded events missed.
+"""
+
+import logging
+import os
+import time
+
+from gitosis import actions
+from gitosis import app
+from gitosis import gitdaemon
+from gitosis import parallel
+from gitosis import placement
+from gitosis import repoindex
+
+log = logging.getLogger('gitosis.reindex')
+
+def scan(config):
+    """
+    Find the repositories on disk, as entries like ``repoindex.read``
+    returns them.
+    """
+    found = {}
+    for (dirpath, repo, name) in gitdaemon.walk_tree(config):
+        fullpath = os.path.join(dirpath, repo)
+        try:
+            st = os.stat(fullpath)
+        except OSError:
+            continue
+        found[name] = dict(
+            root=placement.find_root(config, fullpath),
+            created=int(st.st_ctime),
+            pushed=None,
+            )
+    return found
+
+def reindex(config, dry_run=False, _now=None):
+    """
+    Bring the index in line with the repositories directory.
+
+    Returns ``(added, removed, moved)``, lists of repository names.
+    """
+    if _now is None:
+        _now = time.time()
+    # walk without the lock, pushes and creations keep being recorded
+    found = scan(config)
+
+    lockfile = repoindex.lock(config, exclusive=True)
+    try:
+        entries = repoindex.read(config)
+        if entries is None:
+            entries = {}
+        added = []
+        removed = []
+        moved = []
+        for name in sorted(found):
+            entry = entries.get(name)
+            if entry is None:
+                added.append(name)
+                entries[name] = found[name]
+            elif entry['root'] != found[name]['root']:
+                moved.append(name)
+                entry['root'] = found[name]['root']
+        for name in sorted(entries):
+            if name in found:
+                continue
+            entry = entries[name]
+            if (entry['created'] >= _now
+                or (entry['pushed'] or 0) >= _now):
+                # recorded after the walk started
+                continue
+            removed.append(name)
+            del entries[name]
+        if not dry_run:
+            repoindex.write(config, entries)
+    finally:
+        lockfile.close()
+    return (added, removed, moved)
+
+def install_hooks(config, names=None, inventory=None, writer=None):
+    """
+    Install the ``post-receive`` hook in all (or the named)
+    repositories, if the index or any push actions are enabled.
+    """
+    if (repoindex.getIndexPath(config) is None
+        and not actions.haveActions(config)):
+        return
+    parallel.map(
+        config,
+        lambda (dirpath, repo, name): repoindex.install_hook(
+            os.path.join(dirpath, repo), writer),
+        gitdaemon.select_repos(config, names, inventory),
+        )
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Check the repository index against the repositories')
+        parser.set_defaults(
+            dry_run=False,
+            )
+        parser.add_option('--dry-run',
+                          action='store_true',
+                          help='only report what is wrong',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        os.chdir(os.path.expanduser('~'))
+
+        if repoindex.getIndexPath(cfg) is None:
+            log.error('No repository-index configured.')
+            return
+
+        (added, removed, moved) = reindex(cfg, dry_run=options.dry_run)
+        for name in added:
+            log.info('Not in index: %r', name)
+        for name in removed:
+            log.info('Gone: %r', name)
+        for name in moved:
+            log.info('Moved: %r', name)
+        log.info('%d added, %d removed, %d moved',
+                 len(added), len(removed), len(moved))
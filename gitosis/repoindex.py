@@ -0,0 +1,259 @@
+"""
+Keep a list of the managed repositories, so they need not be found
+by walking the repositories directory.
+
+With ``repository-index`` set in the ``gitosis`` section, gitosis
+appends one line per event to that file::
+
+	<unix time> <TAB> <event> <TAB> <name> <TAB> <root>
+
+where ``<event>`` is ``create``, ``push``, ``move`` or ``remove``,
+``<name>`` is the repository path without ``.git``, and ``<root>`` is
+the repository root it was placed on, or ``-``. Reading the file
+folds the events into the current state. Appends are single
+``O_APPEND`` writes under a shared lock; ``gitosis-reindex`` takes the
+lock exclusively while it rewrites the file from a walk of the
+repositories directory, repairing anything the events missed.
+Once the file holds ``COMPACT_SLACK`` more events than needed to
+describe the repositories, the next reader rewrites it in compact
+form, so pushes do not make every read slower.
+
+Until ``gitosis-reindex`` has created the file, repositories are
+found by walking as before.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import time
+
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.repoindex')
+
+EVENTS = ['create', 'push', 'move', 'remove']
+
+COMPACT_SLACK = 1000
+
+POST_RECEIVE_HOOK = """\
+#!/bin/sh
+# installed by gitosis, will be overwritten
+exec gitosis-run-hook post-receive
+"""
+
+def getIndexPath(config):
+    path = util.getConfigDefault(config, 'gitosis', 'repository-index', None)
+    if path is None:
+        return None
+    return os.path.expanduser(path)
+
+def lock(config, exclusive=False, wait=True):
+    """
+    Take the index lock; close the returned file to release it.
+
+    Without ``wait``, raises ``IOError`` if the lock is held.
+    """
+    f = file('%s.lock' % getIndexPath(config), 'a')
+    if exclusive:
+        op = fcntl.LOCK_EX
+    else:
+        op = fcntl.LOCK_SH
+    if not wait:
+        op |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(f.fileno(), op)
+    except:
+        f.close()
+        raise
+    return f
+
+def _line(when, event, name, root):
+    if root is None:
+        root = '-'
+    return '%d\t%s\t%s\t%s\n' % (when, event, name, root)
+
+def record(config, event, name, root=None, _now=None):
+    """
+    Append an event to the index, if enabled.
+
+    Failing to record never fails the caller; ``gitosis-reindex``
+    will pick up what was missed.
+    """
+    assert event in EVENTS, event
+    path = getIndexPath(config)
+    if path is None:
+        return
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    if root is not None:
+        root = os.path.realpath(root)
+    if _now is None:
+        _now = time.time()
+    try:
+        lockfile = lock(config)
+        try:
+            # never create it, a partial index would hide repositories
+            fd = os.open(path, os.O_WRONLY|os.O_APPEND)
+            try:
+                os.write(fd, _line(_now, event, name, root))
+            finally:
+                os.close(fd)
+        finally:
+            lockfile.close()
+    except (IOError, OSError), e:
+        if e.errno == errno.ENOENT:
+            log.debug('No repository index yet, not recording %s', event)
+            return
+        log.warning('Cannot write repository index %r: %s', path, e)
+
+def record_push(config, env=None):
+    """
+    Record a push from the ``post-receive`` hook, using the
+    repository ``gitosis-serve`` put in the environment.
+    """
+    if env is None:
+        env = os.environ
+    repopath = env.get('GITOSIS_REPO')
+    if repopath is None:
+        log.warning('No GITOSIS_REPO in environment, push not indexed')
+        return
+    record(config, 'push', repopath)
+
+def install_hook(git_dir, writer=None):
+    """
+    Install the ``post-receive`` hook that records pushes, unless
+    the repository has a hook of its own.
+    """
+    repository.install_hook(git_dir, 'post-receive', POST_RECEIVE_HOOK,
+                            writer)
+
+def _fold(f):
+    """
+    Returns the entries, and how many events made them.
+    """
+    entries = {}
+    events = 0
+    for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 4:
+            continue
+        (when, event, name, root) = fields
+        try:
+            when = int(when)
+        except ValueError:
+            continue
+        events += 1
+        if root == '-':
+            root = None
+        entry = entries.get(name)
+        if event == 'create':
+            entries[name] = dict(root=root, created=when, pushed=None)
+        elif event == 'remove':
+            entries.pop(name, None)
+        elif entry is None:
+            # pushed or moved before the index knew it
+            entries[name] = dict(root=root, created=when, pushed=None)
+            entry = entries[name]
+        if event == 'push':
+            entry['pushed'] = when
+        elif event == 'move':
+            entry['root'] = root
+    return (entries, events)
+
+def _wasteful(entries, events):
+    # write puts down at most two events per repository
+    return events > 2 * len(entries) + COMPACT_SLACK
+
+def compact(config):
+    """
+    Rewrite the index from its own events, unless the lock is held,
+    in which case the index is being written already.
+
+    Returns whether it was rewritten.
+    """
+    path = getIndexPath(config)
+    try:
+        lockfile = lock(config, exclusive=True, wait=False)
+    except IOError, e:
+        if e.errno not in [errno.EAGAIN, errno.EACCES]:
+            log.warning('Cannot lock repository index %r: %s', path, e)
+        return False
+    try:
+        try:
+            f = file(path)
+            try:
+                (entries, events) = _fold(f)
+            finally:
+                f.close()
+            if not _wasteful(entries, events):
+                return False
+            write(config, entries)
+        except (IOError, OSError), e:
+            log.warning('Cannot compact repository index %r: %s', path, e)
+            return False
+    finally:
+        lockfile.close()
+    log.info('Compacted repository index from %d events', events)
+    return True
+
+def read(config):
+    """
+    Map repository names to dicts with ``root``, ``created`` and
+    ``pushed`` (``None`` if never pushed to).
+
+    Returns ``None`` if there is no index.
+    """
+    path = getIndexPath(config)
+    if path is None:
+        return None
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        (entries, events) = _fold(f)
+    finally:
+        f.close()
+    if _wasteful(entries, events):
+        compact(config)
+    return entries
+
+def walk(config):
+    """
+    Like ``gitdaemon.walk_repos``, from the index. Returns ``None``
+    if there is no index.
+    """
+    entries = read(config)
+    if entries is None:
+        return None
+    topdir = util.getRepositoryDir(config)
+    found = []
+    for name in sorted(entries):
+        (reldir, basename) = os.path.split(name)
+        found.append((os.path.join(topdir, reldir).rstrip('/'),
+                      '%s.git' % basename,
+                      name))
+    return found
+
+def write(config, entries):
+    """
+    Replace the index with ``entries``, as returned by ``read``.
+
+    The caller must hold the exclusive lock.
+    """
+    path = getIndexPath(config)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        for name in sorted(entries):
+            entry = entries[name]
+            f.write(_line(entry['created'], 'create', name, entry['root']))
+            if entry['pushed'] is not None:
+                f.write(_line(entry['pushed'], 'push', name, None))
+    finally:
+        f.close()
+    os.rename(tmp, path)
@@ -1,10 +1,15 @@
 import errno
+import logging
 import os
 import re
+import shutil
 import subprocess
 import sys
 
 from gitosis import util
+from gitosis.writer import Writer
+
+log = logging.getLogger('gitosis.repository')
 
 class GitError(Exception):
     """git failed"""
@@ -20,6 +25,7 @@ def init(
     template=None,
     _git=None,
     mode=0750,
+    hooks_path=None,
     ):
     """
     Create a git repository at C{path} (if missing).
@@ -37,11 +43,19 @@ def init(
     @param mode: Permissions for the new reposistory
 
     @type mode: int
+
+    @param hooks_path: Shared hooks directory for the new repository
+    to use, instead of hooks copied from the default template.
+
+    @type hooks_path: str
     """
     if _git is None:
         _git = 'git'
 
     util.mkdir(path, mode)
+    if hooks_path is not None and template is None:
+        # an empty template copies nothing
+        template = ''
     args = [
         _git,
         '--git-dir=.',
@@ -57,6 +71,8 @@ def init(
         )
     if returncode != 0:
         raise GitInitError('exit status %d' % returncode)
+    if hooks_path is not None:
+        set_config(path, 'core.hooksPath', hooks_path)
 
 
 class GitFastImportError(GitError):
@@ -69,9 +85,14 @@ def fast_import(
     committer,
     files,
     parent=None,
+    deletions=(),
     ):
     """
-    Create an initial commit.
+    Create an initial commit, or one on top of ``parent``.
+
+    ``files`` is an iterable of ``(path, content)``, where content
+    may be a file, which is streamed to git instead of being read
+    into memory. ``deletions`` are paths to remove.
     """
     child = subprocess.Popen(
         args=[
@@ -85,18 +106,31 @@ def fast_import(
         stdin=subprocess.PIPE,
         close_fds=True,
         )
-    files = list(files)
+    paths = []
     for index, (path, content) in enumerate(files):
-        child.stdin.write("""\
+        if hasattr(content, 'read'):
+            child.stdin.write("""\
+blob
+mark :%(mark)d
+data %(len)d
+""" % dict(
+                mark=index+1,
+                len=os.fstat(content.fileno()).st_size,
+                ))
+            shutil.copyfileobj(content, child.stdin)
+            child.stdin.write('\n')
+        else:
+            child.stdin.write("""\
 blob
 mark :%(mark)d
 data %(len)d
 %(content)s
 """ % dict(
-            mark=index+1,
-            len=len(content),
-            content=content,
-            ))
+                mark=index+1,
+                len=len(content),
+                content=content,
+                ))
+        paths.append(path)
     child.stdin.write("""\
 commit refs/heads/master
 committer %(committer)s now
@@ -114,8 +148,10 @@ from %(parent)s
 """ % dict(
                 parent=parent,
                 ))
-    for index, (path, content) in enumerate(files):
+    for index, path in enumerate(paths):
         child.stdin.write('M 100644 :%d %s\n' % (index+1, path))
+    for path in deletions:
+        child.stdin.write('D %s\n' % path)
     child.stdin.close()
     returncode = child.wait()
     if returncode != 0:
@@ -199,3 +235,201 @@ def has_initial_commit(git_dir):
         return True
     else:
         raise GitHasInitialCommitError('Unknown git HEAD: %r' % got)
+
+def rev_parse(git_dir, rev='HEAD'):
+    """
+    Return the object ID ``rev`` names.
+    """
+    child = subprocess.Popen(
+        args=[
+            'git',
+            '--git-dir=%s' % git_dir,
+            'rev-parse',
+            '--verify',
+            '--quiet',
+            rev,
+            ],
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read()
+    returncode = child.wait()
+    if returncode != 0:
+        raise GitRevParseError('exit status %d' % returncode)
+    return got.strip()
+
+def is_ancestor(git_dir, ancestor, rev):
+    """
+    Whether ``ancestor`` is ``rev`` or one of its ancestors.
+    """
+    returncode = subprocess.call(
+        args=[
+            'git',
+            '--git-dir=%s' % git_dir,
+            'merge-base',
+            '--is-ancestor',
+            ancestor,
+            rev,
+            ],
+        close_fds=True,
+        )
+    return returncode == 0
+
+class GitLsTreeError(GitError):
+    """git ls-tree failed"""
+
+def ls_tree(git_dir, paths, rev='HEAD', recursive=False):
+    """
+    Look up the object IDs of ``paths`` in the tree of ``rev``.
+
+    Returns a dict mapping each path found to its object ID; missing
+    paths are left out. With ``recursive``, trees are replaced by
+    all the blobs in them.
+    """
+    args = [
+        'git',
+        '--git-dir=%s' % git_dir,
+        'ls-tree',
+        '-z',
+        ]
+    if recursive:
+        args.append('-r')
+    child = subprocess.Popen(
+        args=args + [
+            rev,
+            '--',
+            ] + list(paths),
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read()
+    returncode = child.wait()
+    if returncode != 0:
+        raise GitLsTreeError('exit status %d' % returncode)
+    found = {}
+    for entry in got.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        mode, type_, sha1 = info.split()
+        found[path] = sha1
+    return found
+
+class GitCatFileError(GitError):
+    """git cat-file failed"""
+
+def cat_blob(git_dir, sha1):
+    """
+    Return the contents of blob ``sha1``.
+    """
+    child = subprocess.Popen(
+        args=[
+            'git',
+            '--git-dir=%s' % git_dir,
+            'cat-file',
+            'blob',
+            sha1,
+            ],
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read()
+    returncode = child.wait()
+    if returncode != 0:
+        raise GitCatFileError('exit status %d' % returncode)
+    return got
+
+class CatFile(object):
+    """
+    A persistent ``git cat-file --batch`` process, for reading many
+    objects without starting git for each one.
+    """
+
+    def __init__(self, git_dir):
+        self.child = subprocess.Popen(
+            args=[
+                'git',
+                '--git-dir=%s' % git_dir,
+                'cat-file',
+                '--batch',
+                ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            close_fds=True,
+            )
+
+    def get(self, name):
+        """
+        Return ``(type, content)`` of the object ``name``.
+        """
+        self.child.stdin.write('%s\n' % name)
+        self.child.stdin.flush()
+        header = self.child.stdout.readline()
+        if not header:
+            raise GitCatFileError('unexpected end of output')
+        words = header.split()
+        if words[-1] == 'missing':
+            raise GitCatFileError('missing object', name)
+        (sha1, type_, size) = words
+        data = self.child.stdout.read(int(size))
+        # objects are followed by a newline
+        self.child.stdout.read(1)
+        return (type_, data)
+
+    def close(self):
+        self.child.stdin.close()
+        self.child.stdout.close()
+        returncode = self.child.wait()
+        if returncode != 0:
+            raise GitCatFileError('exit status %d' % returncode)
+
+class GitConfigError(GitError):
+    """git config failed"""
+
+def set_config(git_dir, name, value):
+    """
+    Set the option ``name`` in the configuration of the repository.
+    """
+    returncode = subprocess.call(
+        args=[
+            'git',
+            '--git-dir=%s' % git_dir,
+            'config',
+            name,
+            value,
+            ],
+        close_fds=True,
+        )
+    if returncode != 0:
+        raise GitConfigError('exit status %d' % returncode)
+
+def install_hook(git_dir, name, script, writer=None):
+    """
+    Install ``script`` as the hook ``name``, unless the repository
+    has a hook of its own there.
+
+    Hooks installed by gitosis say so in a comment, and are replaced
+    when ``script`` changes.
+    """
+    if writer is None:
+        writer = Writer()
+    path = os.path.join(git_dir, 'hooks', name)
+    try:
+        f = file(path)
+    except IOError:
+        current = None
+    else:
+        try:
+            current = f.read()
+        finally:
+            f.close()
+    if current == script:
+        writer.unchanged(path)
+        return
+    if current is not None and 'installed by gitosis' not in current:
+        log.warning('Not replacing custom %s hook in %r', name, git_dir)
+        writer.unchanged(path)
+        return
+    if not writer.dry_run:
+        util.mkdir(os.path.join(git_dir, 'hooks'), 0755)
+    writer.write(path, script, mode=0755)
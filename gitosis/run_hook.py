@@ -3,10 +3,12 @@ Perform gitosis actions for a git hook.
 """
 
 import errno
+import fcntl
 import logging
 import os
 import sys
-import shutil
+import time
+from ConfigParser import RawConfigParser
 
 from gitosis import repository
 from gitosis import ssh
@@ -17,62 +19,518 @@ from gitosis import app
 from gitosis import util
 from gitosis import group
 from gitosis import serve
+from gitosis import pool
+from gitosis import limits
+from gitosis import delta
+from gitosis import parallel
+from gitosis import inventory
+from gitosis import reindex
+from gitosis import repoindex
+from gitosis import spool
+from gitosis import confd
+from gitosis import delegate
+from gitosis import actions
+from gitosis import hooks
+from gitosis import tier
+from gitosis.writer import Writer
 
-def autoinit_repos(config):
+log = logging.getLogger('gitosis.run_hook')
+
+def autoinit_repos(config, names=None, dry_run=False):
     do_init = util.getConfigDefaultBoolean(config, 'gitosis', 'init-on-config', False)
     if not do_init:
         return
 
-    for (section, name, topdir, subpath) in gitweb.enum_cfg_repos(config):
+    for (section, name, topdir, subpath) in gitweb.enum_cfg_repos(
+        config, names=names):
         if os.path.exists(os.path.join(topdir,subpath)):
             continue
+        if tier.is_archived(config, subpath):
+            # gitosis-serve restores it when it is next used
+            continue
+        if dry_run:
+            log.info('Would create %r', os.path.join(topdir, subpath))
+            continue
 
         try:
             serve.auto_init_repo(config,topdir,subpath)
-        except GitInitError, e:
+        except repository.GitInitError, e:
             log.warning('Auto-init failed: %r' % e)
-        except GitError, e:
+        except repository.GitError, e:
             log.warning('Git error in init: %r' % e)
 
 
-def post_update(cfg, git_dir):
-    export = os.path.join(git_dir, 'gitosis-export')
+def config_ids(head):
+    """
+    The ``gitosis-state`` entries for the configuration files of the
+    admin repository in ``head``.
+    """
+    ids = {}
+    if 'gitosis.conf' in head:
+        ids['config'] = head['gitosis.conf']
+    if confd.CONF_DIR in head:
+        ids['confd'] = head[confd.CONF_DIR]
+    return ids
+
+def _config_changed(old, new):
+    for key in set(old) | set(new):
+        if ((key in ['config', 'confd'] or key.startswith('delegate.'))
+            and old.get(key) != new.get(key)):
+            return True
+    return False
+
+def read_main(git_dir, ids, catfile, store=True):
+    """
+    Read the configuration files of the admin repository, as a
+    ``confd.Merged``.
+    """
+    return confd.read(git_dir, ids.get('config'), ids.get('confd'),
+                      catfile, store=store)
+
+def read_config(git_dir, cfg, ids, catfile, main=None, store=True):
+    """
+    Read the configuration ``ids`` describes: the files of the admin
+    repository (already read if ``main`` is given), then the slices
+    of the delegations they declare.
+
+    Returns a ``confd.Merged``.
+    """
+    if main is None:
+        main = read_main(git_dir, ids, catfile, store=store)
+    main_groups = set(section for section in main.cfg.sections()
+                      if section.startswith('group '))
+    for delegation in delegate.getDelegations(main.cfg):
+        sha1 = ids.get(delegation.key())
+        if sha1 is None:
+            continue
+        (name, parsed) = delegate.load(
+            git_dir, cfg, delegation, sha1, main_groups, store=store)
+        # a slice cannot change what the main configuration sets
+        main.add(name, parsed, sha1, override=False)
+    return main
+
+def compute_delta(git_dir, cfg, state, ids, keydir, catfile, main=None,
+                  store=True):
+    """
+    Find out what changed since the run that wrote ``state``.
+
+    Returns ``(changes, new)``, where ``new`` is the configuration
+    ``ids`` describes, as returned by ``read_config``, if it had to
+    be read.
+    """
+    if not state:
+        return (delta.Delta(), None)
+    keys_changed = state.get('keydir') != keydir
+    if not _config_changed(state, ids):
+        return (delta.Delta(config=False, keys=keys_changed, repos=set(),
+                            groups=False, new_repos=set()),
+                None)
+    old = read_config(git_dir, cfg, state, catfile, store=store)
+    new = read_config(git_dir, cfg, ids, catfile, main=main, store=store)
+    return (delta.compute(old.cfg, new.cfg, keys_changed=keys_changed), new)
+
+
+KEY_CACHE = 'gitosis-keycache'
+KEYS_LOCK_FILE = 'gitosis-keys.lock'
+
+def write_config(git_dir, data):
+    path = os.path.join(git_dir, 'gitosis.conf')
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
     try:
-        shutil.rmtree(export)
-    except OSError, e:
-        if e.errno == errno.ENOENT:
-            pass
-        else:
-            raise
-    repository.export(git_dir=git_dir, path=export)
-    os.rename(
-        os.path.join(export, 'gitosis.conf'),
-        os.path.join(export, '..', 'gitosis.conf'),
-        )
-    # re-read config to get up-to-date settings
-    cfg.read(os.path.join(export, '..', 'gitosis.conf'))
-    autoinit_repos(config=cfg)
-    gitweb.set_descriptions(
-        config=cfg,
-        )
-    generated = util.getGeneratedFilesDir(config=cfg)
-    gitweb.generate_project_list(
-        config=cfg,
-        path=os.path.join(generated, 'projects.list'),
-        )
-    gitdaemon.set_export_ok(
-        config=cfg,
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def read_keys(git_dir, commit, catfile):
+    """
+    Return ``(keys, cache)`` for the ``keydir`` of ``commit``.
+    """
+    cache_path = os.path.join(git_dir, KEY_CACHE)
+    return ssh.readKeysFromTree(
+        repository.ls_tree(git_dir, ['keydir'], rev=commit, recursive=True),
+        catfile,
+        ssh.readKeyCache(cache_path),
         )
-    if htaccess.gen_htaccess_if_enabled(config=cfg):
-        group.generate_group_list(
-            config=cfg,
-            path=os.path.join(generated, 'groups'),
+
+def write_keys(cfg, git_dir, keys, cache, keydir, writer=None):
+    """
+    Write ``authorized_keys``, the key index and the key cache for
+    the ``keydir`` tree ``keydir``.
+
+    Runs and the key fast lane take turns here. If ``keydir`` is no
+    longer the current one, nothing is written: the run for the
+    newer push will write it. Returns whether the keys were written.
+    """
+    if writer is None:
+        writer = Writer()
+    lock = file(os.path.join(git_dir, KEYS_LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        current = repository.ls_tree(git_dir, ['keydir']).get('keydir')
+        if current != keydir:
+            log.info('keydir changed since it was read, not writing keys')
+            return False
+        ssh.writeAuthorizedKeys(
+            path=util.getSSHAuthorizedKeysPath(config=cfg),
+            keys=keys,
+            ca_keys=util.getSSHCAKeys(config=cfg),
+            ca_principal=util.getSSHCAPrincipal(config=cfg),
+            writer=writer,
             )
-    authorized_keys = util.getSSHAuthorizedKeysPath(config=cfg)
-    ssh.writeAuthorizedKeys(
-        path=authorized_keys,
-        keydir=os.path.join(export, 'keydir'),
-        )
+        if writer.dry_run:
+            return True
+        key_index = util.getSSHKeyIndexPath(config=cfg)
+        if key_index is not None:
+            ssh.writeKeyIndex(
+                path=key_index,
+                keys=keys,
+                )
+        ssh.writeKeyCache(os.path.join(git_dir, KEY_CACHE), cache)
+        return True
+    finally:
+        lock.close()
+
+def apply_keys(cfg, git_dir):
+    """
+    Bring ``authorized_keys`` up to date with the admin repository,
+    and nothing else.
+
+    This is the fast lane for key changes when the rest of the work
+    is left to ``gitosis-worker``. Returns whether keys were written.
+    """
+    commit = repository.rev_parse(git_dir)
+    head = repository.ls_tree(git_dir, ['keydir'], rev=commit)
+    state = delta.readState(git_dir)
+    if state and state.get('keydir') == head.get('keydir'):
+        return False
+    catfile = repository.CatFile(git_dir)
+    try:
+        (keys, cache) = read_keys(git_dir, commit, catfile)
+    finally:
+        catfile.close()
+    if not write_keys(cfg, git_dir, keys, cache, head.get('keydir')):
+        return False
+    if state:
+        # only when there is a previous run; otherwise the first run
+        # must not think the keys are done
+        state = delta.readState(git_dir)
+        if 'keydir' in head:
+            state['keydir'] = head['keydir']
+        delta.writeState(git_dir, state)
+    log.info('Keys applied.')
+    return True
+
+STAGES = [
+    'descriptions',
+    'projects.list',
+    'export-ok',
+    'htaccess',
+    'hooks',
+    'authorized_keys',
+    'pool',
+    ]
+
+STAT_FIELDS = ['stage', 'seconds', 'examined', 'written', 'syscalls', 'saved']
+
+def format_stats(stat):
+    """
+    Format one entry of the ``post_update`` statistics as a line of
+    ``key=value`` pairs.
+    """
+    fields = []
+    for key in STAT_FIELDS:
+        if key not in stat:
+            continue
+        value = stat[key]
+        if isinstance(value, float):
+            value = '%.3f' % value
+        fields.append('%s=%s' % (key, value))
+    return ' '.join(fields)
+
+def post_update(cfg, git_dir, full=False, dry_run=False):
+    """
+    Bring everything gitosis generates up to date with the admin
+    repository.
+
+    Returns statistics: a list of dicts, one per stage that ran, with
+    its name as ``stage``, the ``seconds`` it took, and how many files
+    it ``examined`` and how many of those it ``written``; the last
+    one, ``total``, also has the filesystem calls the repository
+    inventory made (``syscalls``) and ``saved``.
+
+    With ``dry_run``, everything is worked out but nothing is
+    written; the statistics count what would have been.
+    """
+    start = time.time()
+    commit = repository.rev_parse(git_dir)
+    head = repository.ls_tree(
+        git_dir, ['gitosis.conf', confd.CONF_DIR, 'keydir'], rev=commit)
+    state = delta.readState(git_dir)
+    catfile = repository.CatFile(git_dir)
+    try:
+        ids = config_ids(head)
+        # the delegations are declared here, see what they have now
+        main = read_main(git_dir, ids, catfile, store=not dry_run)
+        ids.update(delegate.heads(cfg, delegate.getDelegations(main.cfg)))
+        new = None
+        if full:
+            changes = delta.Delta()
+        else:
+            (changes, new) = compute_delta(
+                git_dir, cfg, state, ids, head.get('keydir'), catfile,
+                main=main, store=not dry_run)
+        log.debug('Changes: %r', changes)
+        if changes.is_empty():
+            log.info('Nothing to do.')
+            if not dry_run and state.get('commit') != commit:
+                state['commit'] = commit
+                delta.writeState(git_dir, state)
+            return [dict(stage='total', seconds=time.time() - start,
+                         examined=0, written=0, syscalls=0, saved=0)]
+
+        if changes.config:
+            if new is None:
+                new = read_config(git_dir, cfg, ids, catfile, main=main,
+                                  store=not dry_run)
+            for conflict in new.conflicts:
+                log.warning('Conflicting setting: %s', conflict)
+            if not dry_run and new.blobs:
+                write_config(git_dir, confd.export(
+                        new, ids.get('config'), catfile))
+            # up-to-date settings, without parsing it all again
+            confd.replace(cfg, new.cfg)
+        else:
+            # re-read config to get up-to-date settings
+            current = RawConfigParser()
+            if current.read(os.path.join(git_dir, 'gitosis.conf')):
+                confd.replace(cfg, current)
+        if changes.keys:
+            (keys, cache) = read_keys(git_dir, commit, catfile)
+    finally:
+        catfile.close()
+
+    if changes.config:
+        # creates repositories the other stages look at
+        autoinit_repos(config=cfg, names=changes.new_repos, dry_run=dry_run)
+
+    generated = util.getGeneratedFilesDir(config=cfg)
+    stages = []
+    repos = inventory.Inventory(cfg)
+    # one per stage, to count what each one did
+    out = dict((name, Writer(dry_run=dry_run)) for name in STAGES)
+    if changes.config:
+        if changes.repos is None:
+            # every stage walks, list the tree before they start
+            repos.scan()
+        # group members, expanded once for all the stages
+        expansion = group.Expansion(cfg)
+        def _htaccess():
+            if (htaccess.gen_htaccess_if_enabled(config=cfg,
+                                                 names=changes.repos,
+                                                 inventory=repos,
+                                                 writer=out['htaccess'],
+                                                 expansion=expansion)
+                and changes.groups):
+                group.generate_group_list(
+                    config=cfg,
+                    path=os.path.join(generated, 'groups'),
+                    writer=out['htaccess'],
+                    expansion=expansion,
+                    )
+        def _hooks():
+            names = changes.repos
+            if hooks.getSharedHooksDir(cfg) is not None:
+                hooks.install(config=cfg, writer=out['hooks'])
+                # only repositories that cannot share need their own
+                names = hooks.use_all(
+                    config=cfg,
+                    names=changes.repos,
+                    inventory=repos,
+                    writer=out['hooks'],
+                    )
+            limits.install_hooks(
+                config=cfg,
+                names=names,
+                inventory=repos,
+                writer=out['hooks'],
+                )
+            reindex.install_hooks(
+                config=cfg,
+                names=names,
+                inventory=repos,
+                writer=out['hooks'],
+                )
+            delegate.install_hooks(config=cfg, writer=out['hooks'])
+        stages.extend([
+            ('descriptions', lambda: gitweb.set_descriptions(
+                        config=cfg,
+                        names=changes.repos,
+                        inventory=repos,
+                        writer=out['descriptions'],
+                        )),
+            ('projects.list', lambda: gitweb.generate_project_list(
+                        config=cfg,
+                        path=os.path.join(generated, 'projects.list'),
+                        inventory=repos,
+                        writer=out['projects.list'],
+                        )),
+            ('export-ok', lambda: gitdaemon.set_export_ok(
+                        config=cfg,
+                        names=changes.repos,
+                        inventory=repos,
+                        writer=out['export-ok'],
+                        expansion=expansion,
+                        )),
+            ('htaccess', _htaccess),
+            ('hooks', _hooks),
+            ])
+    if changes.keys:
+        stages.append(('authorized_keys', lambda: write_keys(
+                        cfg, git_dir, keys, cache, head.get('keydir'),
+                        writer=out['authorized_keys'])))
+    stages.append(('pool', lambda: pool.refill(config=cfg, dry_run=dry_run)))
+
+    stats = [dict(stage='setup', seconds=time.time() - start,
+                  examined=0, written=0)]
+    timings = {}
+    done = {}
+    # on failure, the state is left as is and the next run retries
+    try:
+        done = parallel.run_stages(cfg, stages, timings)
+    finally:
+        for name in STAGES:
+            out[name].sync()
+        for (name, fn) in stages:
+            stat = dict(
+                stage=name,
+                seconds=timings.get(name, 0.0),
+                examined=out[name].examined(),
+                written=out[name].written,
+                )
+            if name == 'pool':
+                # makes repositories, not files
+                stat['written'] = done.get('pool', 0)
+            stats.append(stat)
+        stats.append(dict(
+                stage='total',
+                seconds=time.time() - start,
+                examined=sum([stat['examined'] for stat in stats]),
+                written=sum([stat['written'] for stat in stats]),
+                syscalls=repos.syscalls,
+                saved=repos.saved(),
+                ))
+        for stat in stats:
+            log.debug('%s', format_stats(stat))
+
+    if dry_run:
+        return stats
+    state = dict(commit=commit)
+    state.update(ids)
+    if new is not None:
+        confd.prune(git_dir, new.blobs)
+    if 'keydir' in head:
+        state['keydir'] = head['keydir']
+    delta.writeState(git_dir, state)
+    return stats
+
+LOCK_FILE = 'gitosis-run-hook.lock'
+DIRTY_FILE = 'gitosis-dirty'
+
+def mark_dirty(git_dir, full=False):
+    """
+    Ask for a run; the run in progress, or the next one, will see it.
+    """
+    path = os.path.join(git_dir, DIRTY_FILE)
+    if full:
+        line = 'full\n'
+    else:
+        line = 'changes\n'
+    fd = os.open(path, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def take_dirty(git_dir):
+    """
+    Take the pending requests. Returns ``None`` if there are none,
+    otherwise whether any of them asked for a full run.
+    """
+    path = os.path.join(git_dir, DIRTY_FILE)
+    taken = '%s.%d.taken' % (path, os.getpid())
+    try:
+        os.rename(path, taken)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    f = file(taken)
+    try:
+        requests = f.read().split()
+    finally:
+        f.close()
+    os.unlink(taken)
+    return 'full' in requests
+
+def _copy_config(cfg):
+    new = RawConfigParser()
+    for (key, value) in cfg.defaults().items():
+        new.set('DEFAULT', key, value)
+    for section in cfg.sections():
+        new.add_section(section)
+        for (key, value) in cfg.items(section):
+            new.set(section, key, value)
+    return new
+
+def _try_lock(git_dir):
+    f = file(os.path.join(git_dir, LOCK_FILE), 'a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+    except IOError, e:
+        f.close()
+        if e.errno in [errno.EAGAIN, errno.EACCES]:
+            return None
+        raise
+    return f
+
+def run_post_update(cfg, git_dir, full=False, stats=None):
+    """
+    Run ``post_update``, unless another run is in progress.
+
+    A push that arrives during a run only leaves a note and exits;
+    the run in progress then goes round once more, against the admin
+    repository as it is by then. Returns the number of runs made by
+    this call; if given, ``stats`` is extended with the statistics of
+    each.
+    """
+    mark_dirty(git_dir, full=full)
+    runs = 0
+    while True:
+        lock = _try_lock(git_dir)
+        if lock is None:
+            log.info('Another run in progress, leaving it to that one.')
+            return runs
+        try:
+            while True:
+                full_run = take_dirty(git_dir)
+                if full_run is None:
+                    break
+                if runs:
+                    log.info('More pushes arrived, running again.')
+                # start from the same settings every time
+                got = post_update(_copy_config(cfg), git_dir, full=full_run)
+                if stats is not None:
+                    stats.extend(got)
+                runs += 1
+        finally:
+            lock.close()
+        # a push may have left its note after we last looked, but
+        # before we let go of the lock
+        if not os.path.exists(os.path.join(git_dir, DIRTY_FILE)):
+            return runs
 
 class Main(app.App):
     def create_parser(self):
@@ -80,6 +538,25 @@ class Main(app.App):
         parser.set_usage('%prog [OPTS] HOOK')
         parser.set_description(
             'Perform gitosis actions for a git hook')
+        parser.set_defaults(
+            full=False,
+            dry_run=False,
+            stats=False,
+            )
+        parser.add_option('--full',
+                          action='store_true',
+                          help='regenerate everything, not just changes',
+                          )
+        parser.add_option('--dry-run',
+                          action='store_true',
+                          help='show what post-update would change,'
+                          +' without changing it (implies --stats)',
+                          )
+        parser.add_option('--stats',
+                          action='store_true',
+                          help='print time taken and files written'
+                          +' by each post-update stage',
+                          )
         return parser
 
     def handle_args(self, parser, cfg, options, args):
@@ -97,8 +574,48 @@ class Main(app.App):
             sys.exit(1)
 
         if hook == 'post-update':
+            delegation = delegate.lookup(cfg, git_dir)
+            if delegation is not None:
+                # the slice is merged by the run of gitosis-admin
+                log.info('Push to delegated admin repository of %s',
+                         delegation.name)
+                git_dir = os.path.join(util.getRepositoryDir(cfg),
+                                       'gitosis-admin.git')
+
+        if hook == 'post-update' and options.dry_run:
+            try:
+                stats = post_update(cfg, git_dir, full=options.full,
+                                    dry_run=True)
+            except parallel.StageError, e:
+                log.error('%s', e)
+                sys.exit(1)
+            for stat in stats:
+                print format_stats(stat)
+        elif hook == 'post-update':
             log.info('Running hook %s', hook)
-            post_update(cfg, git_dir)
+            if spool.isAsync(cfg):
+                spool.submit(git_dir, repository.rev_parse(git_dir),
+                             full=options.full)
+                # keys should not wait behind the rest
+                apply_keys(cfg, git_dir)
+                spool.start_worker(cfg, git_dir)
+                log.info('Queued for gitosis-worker.')
+                return
+            stats = []
+            try:
+                run_post_update(cfg, git_dir, full=options.full, stats=stats)
+            except parallel.StageError, e:
+                log.error('%s', e)
+                sys.exit(1)
+            if options.stats:
+                for stat in stats:
+                    print format_stats(stat)
             log.info('Done.')
+        elif hook == 'post-receive':
+            repoindex.record_push(cfg)
+            actions.run(cfg, git_dir, sys.stdin)
+        elif hook == 'pre-receive':
+            if not limits.pre_receive(cfg, git_dir, sys.stdin):
+                sys.exit(1)
         else:
             log.warning('Ignoring unknown hook: %r', hook)
@@ -8,7 +8,6 @@ import logging
 
 import sys, os, re
 
-from ConfigParser import NoSectionError, NoOptionError
 
 from gitosis import access
 from gitosis import repository
@@ -18,6 +17,15 @@ from gitosis import htaccess
 from gitosis import app
 from gitosis import util
 from gitosis import group
+from gitosis import placement
+from gitosis import pool
+from gitosis import ssh
+from gitosis import tier
+from gitosis import limits
+from gitosis import repoindex
+from gitosis import delegate
+from gitosis import hooks
+from gitosis import actions
 
 log = logging.getLogger('gitosis.serve')
 
@@ -57,10 +65,55 @@ class WriteAccessDenied(AccessDenied):
 class ReadAccessDenied(AccessDenied):
     """Repository read access denied"""
 
-def auto_init_repo(cfg,topdir,repopath):
-    # create leading directories
-    p = topdir
+class CertificateUserError(ServingError):
+    """Cannot determine user from SSH certificate"""
+
+def certificate_user(cfg, auth_info):
+    """
+    Find the gitosis user an SSH certificate was issued to.
+
+    ``auth_info`` is the ``SSH_USER_AUTH`` file. The certificate must
+    name exactly one principal besides ``ssh-ca-principal``, and that
+    is the user.
+    """
+    if auth_info is None:
+        log.error('Need SSH_USER_AUTH in environment, '
+                  +'set ExposeAuthInfo in sshd_config.')
+        raise CertificateUserError()
+    try:
+        f = file(auth_info)
+    except IOError, e:
+        log.error('Cannot read %r: %s', auth_info, e)
+        raise CertificateUserError()
+    try:
+        blob = ssh.readAuthInfoCertificate(f)
+    finally:
+        f.close()
+    if blob is None:
+        log.error('Not authenticated with a certificate.')
+        raise CertificateUserError()
+    try:
+        cert = ssh.parseCertificate(blob)
+    except ssh.CertificateError, e:
+        log.error('%s', e)
+        raise CertificateUserError()
+    if cert['cert_type'] != ssh.SSH_CERT_TYPE_USER:
+        log.error('Not a user certificate: %r', cert['key_id'])
+        raise CertificateUserError()
+
+    gate = util.getSSHCAPrincipal(cfg)
+    users = [p for p in cert['principals'] if p != gate]
+    if len(users) != 1:
+        log.error('Certificate %r must have exactly one user principal, '
+                  +'has %r', cert['key_id'], users)
+        raise CertificateUserError()
+    (user,) = users
+    if not ssh.isSafeUsername(user):
+        log.error('Unsafe username in certificate: %r', user)
+        raise CertificateUserError()
+    return user
 
+def auto_init_repo(cfg,topdir,repopath):
     assert repopath.endswith('.git'), 'must have .git extension'
     newdirmode = util.getConfigDefault(cfg,
                                        'repo %s' % repopath[:-4],
@@ -72,20 +125,30 @@ def auto_init_repo(cfg,topdir,repopath):
     else:
         newdirmode = 0750
 
+    # with several repository roots, create the repository on the
+    # chosen one and link it into place once it is complete
+    root = placement.choose_root(cfg)
+    if root is not None:
+        p = root
+    else:
+        p = topdir
+    base = p
+
+    # create leading directories
     for segment in repopath.split(os.sep)[:-1]:
         p = os.path.join(p, segment)
         util.mkdir(p, newdirmode)
 
-    fullpath = os.path.join(topdir, repopath)
+    fullpath = os.path.join(base, repopath)
 
-    # init using a custom template, if required
-    try:
-        template = cfg.get('gitosis', 'init-template')
-        repository.init(path=fullpath, template=template, mode=newdirmode)
-    except (NoSectionError, NoOptionError):
-        pass
+    # a pooled repository only needs to be renamed into place
+    if not pool.take(cfg, base, fullpath, newdirmode):
+        # init using a custom template, if required
+        hooks.init(cfg, fullpath, newdirmode)
 
-    repository.init(path=fullpath, mode=newdirmode)
+    if root is not None:
+        placement.link_placed(fullpath, topdir, repopath, newdirmode)
+    repoindex.record(cfg, 'create', repopath, root)
 
 def path_from_args(args):
     match = ALLOW_RE.match(args)
@@ -215,6 +278,9 @@ def serve(
 
     (topdir, repopath) = construct_path(newpath)
     fullpath = os.path.join(topdir, repopath)
+    # restores the repository if it was moved to the archive for
+    # being cold
+    tier.access(cfg, topdir, repopath, user, verb)
     if not os.path.exists(fullpath):
         # it doesn't exist on the filesystem, but the configuration
         # refers to it, we're serving a write request, and the user is
@@ -235,6 +301,23 @@ def serve(
             config=cfg,
             )
 
+    if verb in COMMANDS_WRITE:
+        # the shared hooks are kept up to date by gitosis-run-hook
+        own_hooks = not hooks.use(cfg, fullpath)
+        os.environ.update(GITOSIS_USER=user, GITOSIS_REPO=repopath)
+        if (own_hooks
+            and (repoindex.getIndexPath(cfg) is not None
+                 or actions.haveActions(cfg))):
+            repoindex.install_hook(fullpath)
+        if own_hooks and delegate.is_admin(cfg, repopath):
+            delegate.install_hook(fullpath)
+        push_limits = limits.getLimits(cfg, user, repopath[:-len('.git')])
+        if push_limits:
+            if own_hooks:
+                limits.install_hook(fullpath)
+            os.environ.update(
+                limits.environment(user, repopath, push_limits))
+
     # put the verb back together with the new path
     newcmd = "%(verb)s '%(path)s'" % dict(
         verb=verb,
@@ -248,15 +331,35 @@ class Main(app.App):
         parser.set_usage('%prog [OPTS] USER')
         parser.set_description(
             'Allow restricted git operations under DIR')
+        parser.set_defaults(
+            certificate=False,
+            )
+        parser.add_option('--certificate',
+                          action='store_true',
+                          help='take USER from the SSH certificate',
+                          )
         return parser
 
     def handle_args(self, parser, cfg, options, args):
-        try:
-            (user,) = args
-        except ValueError:
-            parser.error('Missing argument USER.')
-
         main_log = logging.getLogger('gitosis.serve.main')
+
+        if options.certificate:
+            if args:
+                parser.error('Cannot use USER with --certificate.')
+            try:
+                user = certificate_user(
+                    cfg=cfg,
+                    auth_info=os.environ.get('SSH_USER_AUTH'),
+                    )
+            except ServingError, e:
+                main_log.error('%s', e)
+                sys.exit(1)
+        else:
+            try:
+                (user,) = args
+            except ValueError:
+                parser.error('Missing argument USER.')
+
         os.umask(0022)
 
         cmd = os.environ.get('SSH_ORIGINAL_COMMAND', None)
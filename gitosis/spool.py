@@ -0,0 +1,148 @@
+"""
+Hand admin pushes to ``gitosis-worker`` instead of applying them in
+the hook.
+
+With ``async-hook`` set in the ``gitosis`` section, the
+``post-update`` hook of ``gitosis-admin`` only drops the pushed
+commit ID into the ``gitosis-spool`` directory of the admin
+repository, brings ``authorized_keys`` up to date if ``keydir``
+changed, and starts ``gitosis-worker`` to do the rest (unless
+``worker-spawn`` is off because a resident ``gitosis-worker
+--interval`` polls the spool).
+
+The commit last applied is kept in ``gitosis-state``;
+``gitosis-worker --status`` shows it with what is still pending, and
+``gitosis-worker --wait`` blocks until a commit has been applied.
+"""
+
+import errno
+import logging
+import os
+import subprocess
+import time
+
+from gitosis import delta
+from gitosis import repository
+from gitosis import util
+
+log = logging.getLogger('gitosis.spool')
+
+SPOOL_DIR = 'gitosis-spool'
+
+def isAsync(config):
+    return util.getConfigDefaultBoolean(config, 'gitosis', 'async-hook', False)
+
+def spool_path(git_dir):
+    return os.path.join(git_dir, SPOOL_DIR)
+
+def submit(git_dir, commit, full=False, _now=None):
+    """
+    Queue ``commit`` of the admin repository to be applied.
+    """
+    if _now is None:
+        _now = time.time()
+    spool = spool_path(git_dir)
+    util.mkdir(spool, 0755)
+    path = os.path.join(spool, '%d.%d' % (_now, os.getpid()))
+    tmp = '%s.tmp' % path
+    f = file(tmp, 'w')
+    try:
+        if full:
+            print >>f, '%s full' % commit
+        else:
+            print >>f, '%s changes' % commit
+    finally:
+        f.close()
+    os.rename(tmp, path)
+    return path
+
+def pending(git_dir):
+    """
+    List the queued entries, oldest first, as ``(path, commit,
+    full)``.
+    """
+    spool = spool_path(git_dir)
+    try:
+        names = os.listdir(spool)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    entries = []
+    for name in names:
+        if name.endswith('.tmp'):
+            continue
+        try:
+            (when, pid) = [int(n) for n in name.split('.')]
+        except ValueError:
+            continue
+        path = os.path.join(spool, name)
+        try:
+            f = file(path)
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                # taken by a worker meanwhile
+                continue
+            raise
+        try:
+            words = f.read().split()
+        finally:
+            f.close()
+        if len(words) != 2:
+            continue
+        entries.append(((when, pid), path, words[0], words[1] == 'full'))
+    entries.sort()
+    return [(path, commit, full) for (key, path, commit, full) in entries]
+
+def status(git_dir):
+    """
+    Return ``(applied, pending)``: the commit last applied, or
+    ``None``, and the commits still queued.
+    """
+    state = delta.readState(git_dir)
+    return (state.get('commit'),
+            [commit for (path, commit, full) in pending(git_dir)])
+
+def is_applied(git_dir, commit):
+    (applied, queued) = status(git_dir)
+    if applied is None:
+        return False
+    return repository.is_ancestor(git_dir, commit, applied)
+
+def wait(git_dir, commit, timeout=None, interval=0.2):
+    """
+    Wait until ``commit``, or a later one, has been applied.
+
+    Returns ``False`` if ``timeout`` seconds pass first.
+    """
+    if timeout is not None:
+        deadline = time.time() + timeout
+    while not is_applied(git_dir, commit):
+        if timeout is not None and time.time() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def start_worker(config, git_dir):
+    """
+    Start ``gitosis-worker`` in the background, unless a resident
+    worker is expected to pick the spool up.
+    """
+    if not util.getConfigDefaultBoolean(config, 'gitosis', 'worker-spawn', True):
+        return None
+    devnull = file(os.devnull, 'r+')
+    try:
+        return subprocess.Popen(
+            args=['gitosis-worker', '--git-dir=%s' % os.path.abspath(git_dir)],
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            # outlive the hook, and the push
+            preexec_fn=os.setsid,
+            )
+    except OSError, e:
+        log.warning('Cannot start gitosis-worker: %s', e)
+        return None
+    finally:
+        devnull.close()
@@ -1,5 +1,10 @@
 import os, errno, re
+import base64, hashlib, struct
 import logging
+from cStringIO import StringIO
+
+from gitosis import cdb
+from gitosis.writer import Writer
 
 log = logging.getLogger('gitosis.ssh')
 
@@ -9,42 +14,256 @@ def isSafeUsername(user):
     match = _ACCEPTABLE_USER_RE.match(user)
     return (match is not None)
 
-def readKeys(keydir):
+def _keyUser(filename):
+    """
+    Username a key file is for, or ``None`` if it is not a key file.
+    """
+    if filename.startswith('.'):
+        return None
+    basename, ext = os.path.splitext(filename)
+    if ext != '.pub':
+        return None
+
+    if not isSafeUsername(basename):
+        log.warn('Unsafe SSH username in keyfile: %r', filename)
+        return None
+    return basename
+
+_KEYTYPE_RE = re.compile(r'^(ssh|ecdsa|sk)-[a-zA-Z0-9@._-]+$')
+
+_BASE64_RE = re.compile(r'^[A-Za-z0-9+/]+={0,2}$')
+
+def normalizeKey(line):
+    """
+    Check a public key line and put it in canonical form, a single
+    space between the key type, the base64 key and the comment.
+
+    Returns ``None`` if the line is not a plain public key.
     """
-    Read SSH public keys from ``keydir/*.pub``
+    words = line.split()
+    if len(words) < 2:
+        return None
+    if not _KEYTYPE_RE.match(words[0]):
+        return None
+    if not _BASE64_RE.match(words[1]):
+        return None
+    try:
+        base64.b64decode(words[1])
+    except TypeError:
+        return None
+    return ' '.join(words)
+
+def parseKeyFile(filename, data):
     """
-    for filename in os.listdir(keydir):
-        if filename.startswith('.'):
+    Return the normalized key lines of a ``.pub`` file.
+
+    Blank lines and comments are skipped, anything else that is not a
+    key is logged and skipped.
+    """
+    keys = []
+    for line in data.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
             continue
-        basename, ext = os.path.splitext(filename)
-        if ext != '.pub':
+        key = normalizeKey(stripped)
+        if key is None:
+            log.warning('Ignoring malformed SSH key in %r', filename)
             continue
+        keys.append(key)
+    return keys
 
-        if not isSafeUsername(basename):
-            log.warn('Unsafe SSH username in keyfile: %r', filename)
-            continue
+def readKeys(keydir):
+    """
+    Read SSH public keys from ``*.pub`` files in ``keydir`` and its
+    subdirectories.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(keydir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            basename = _keyUser(filename)
+            if basename is None:
+                continue
 
-        path = os.path.join(keydir, filename)
+            path = os.path.join(dirpath, filename)
+            f = file(path)
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            for key in parseKeyFile(path, data):
+                yield (basename, key)
+
+KEY_CACHE_HEADER = '# gitosis key cache, version 2'
+
+def readKeyCache(path):
+    """
+    Read the key lines cached by ``writeKeyCache``.
+
+    Returns a dict mapping blob IDs to lists of normalized key lines.
+    A cache written by an older version is ignored.
+    """
+    cache = {}
+    try:
         f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return cache
+        raise
+    try:
+        if f.readline().rstrip('\n') != KEY_CACHE_HEADER:
+            return cache
         for line in f:
-            line = line.rstrip('\n')
-            yield (basename, line)
+            words = line.rstrip('\n').split(' ', 1)
+            if len(words) == 1 and words[0]:
+                # blob without any valid keys
+                cache.setdefault(words[0], [])
+                continue
+            if len(words) != 2:
+                continue
+            (sha1, key) = words
+            cache.setdefault(sha1, []).append(key)
+    finally:
         f.close()
+    return cache
+
+def writeKeyCache(path, cache):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        print >>f, KEY_CACHE_HEADER
+        for sha1 in sorted(cache):
+            if not cache[sha1]:
+                print >>f, sha1
+            for key in cache[sha1]:
+                print >>f, '%s %s' % (sha1, key)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def _inKeydir(path):
+    """
+    Whether ``path`` is a file somewhere below ``keydir/``, not
+    inside a dot directory.
+    """
+    parts = path.split('/')
+    if len(parts) < 2 or parts[0] != 'keydir':
+        return False
+    for part in parts[1:-1]:
+        if part.startswith('.'):
+            return False
+    return True
+
+def readKeysFromTree(entries, catfile, cache):
+    """
+    Read SSH public keys from a ``keydir`` tree in git, including
+    its subdirectories.
+
+    ``entries`` maps paths to blob IDs, as returned by
+    ``repository.ls_tree``. Blobs found in ``cache`` are not read
+    again. Returns ``(keys, new_cache)``, where ``new_cache`` holds
+    exactly the blobs in use.
+    """
+    keys = []
+    new_cache = {}
+    for path in sorted(entries):
+        if not _inKeydir(path):
+            continue
+        basename = _keyUser(os.path.basename(path))
+        if basename is None:
+            continue
+
+        sha1 = entries[path]
+        lines = cache.get(sha1)
+        if lines is None:
+            (type_, data) = catfile.get(sha1)
+            lines = parseKeyFile(path, data)
+        new_cache[sha1] = lines
+        for line in lines:
+            keys.append((basename, line))
+    return (keys, new_cache)
 
 COMMENT = '### autogenerated by gitosis, DO NOT EDIT'
 
-def generateAuthorizedKeys(keys):
-    TEMPLATE=('command="gitosis-serve %(user)s",no-port-forwarding,'
-              +'no-X11-forwarding,no-agent-forwarding,no-pty %(key)s')
+TEMPLATE = ('command="gitosis-serve %(user)s",no-port-forwarding,'
+            +'no-X11-forwarding,no-agent-forwarding,no-pty %(key)s')
+
+CA_TEMPLATE = ('cert-authority,principals="%(principal)s",'
+               +'command="gitosis-serve --certificate",no-port-forwarding,'
+               +'no-X11-forwarding,no-agent-forwarding,no-pty %(key)s')
 
+def generateAuthorizedKeys(keys, ca_keys=(), ca_principal=None):
     yield COMMENT
     for (user, key) in keys:
         yield TEMPLATE % dict(user=user, key=key)
+    for key in ca_keys:
+        yield CA_TEMPLATE % dict(principal=ca_principal, key=key)
+
+def fingerprint(blob):
+    """
+    OpenSSH style SHA256 fingerprint of a base64 encoded key.
+    """
+    try:
+        raw = base64.b64decode(blob)
+    except TypeError:
+        return None
+    digest = base64.b64encode(hashlib.sha256(raw).digest())
+    return 'SHA256:%s' % digest.rstrip('=')
+
+def keyFingerprint(line):
+    """
+    Fingerprint of the key on an ``authorized_keys`` style line.
+
+    Returns ``None`` if no key is found.
+    """
+    words = line.split()
+    for i in range(len(words) - 1):
+        if _KEYTYPE_RE.match(words[i]):
+            return fingerprint(words[i+1])
+    return None
+
+def writeKeyIndex(path, keys):
+    """
+    Write a database mapping key fingerprints to the lines
+    ``gitosis-authorized-keys`` should print for them.
+    """
+    maker = cdb.CdbMaker(path)
+    try:
+        for (user, key) in keys:
+            fp = keyFingerprint(key)
+            if fp is None:
+                log.warning('Cannot parse SSH key for %r, not indexed', user)
+                continue
+            maker.add(fp, TEMPLATE % dict(user=user, key=key))
+    except:
+        maker.abort()
+        raise
+    maker.finish()
+
+def lookupKeyIndex(path, keytype, blob):
+    """
+    Generate the indexed ``authorized_keys`` lines for a key.
+    """
+    fp = fingerprint(blob)
+    if fp is None:
+        return
+    db = cdb.Cdb(path)
+    try:
+        for line in db.getall(fp):
+            if keytype not in line.split():
+                continue
+            yield line
+    finally:
+        db.close()
 
 _COMMAND_RE = re.compile('^command="(/[^ "]+/)?gitosis-serve [^"]+",no-port-forw'
                          +'arding,no-X11-forwarding,no-agent-forwardi'
                          +'ng,no-pty .*')
 
+_CA_COMMAND_RE = re.compile('^cert-authority,principals="[^"]*",'
+                            +'command="(/[^ "]+/)?gitosis-serve --certificate",'
+                            +'no-port-forwarding,no-X11-forwarding,'
+                            +'no-agent-forwarding,no-pty .*')
+
 def filterAuthorizedKeys(fp):
     """
     Read lines from ``fp``, filter out autogenerated ones.
@@ -54,37 +273,133 @@ def filterAuthorizedKeys(fp):
 
     for line in fp:
         line = line.rstrip('\n')
+        if 'gitosis' not in line:
+            # cheap test first, most lines are not ours
+            yield line
+            continue
         if line == COMMENT:
             continue
         if _COMMAND_RE.match(line):
             continue
+        if _CA_COMMAND_RE.match(line):
+            continue
         yield line
 
-def writeAuthorizedKeys(path, keydir):
-    tmp = '%s.%d.tmp' % (path, os.getpid())
+def writeAuthorizedKeys(path, keydir=None, ca_keys=(), ca_principal=None,
+                        keys=None, writer=None):
+    """
+    Replace the autogenerated part of ``path``, keeping other lines.
+
+    The file is only rewritten if its content changes. Returns
+    whether it was written.
+    """
+    if writer is None:
+        writer = Writer()
     try:
         in_ = file(path)
     except IOError, e:
         if e.errno == errno.ENOENT:
-            in_ = None
+            old = None
         else:
             raise
+    else:
+        try:
+            old = in_.read()
+        finally:
+            in_.close()
+
+    lines = []
+    if old is not None:
+        lines.extend(filterAuthorizedKeys(StringIO(old)))
+    if keys is None:
+        keys = readKeys(keydir)
+    lines.extend(generateAuthorizedKeys(keys, ca_keys, ca_principal))
+    new = ''.join('%s\n' % line for line in lines)
+
+    if new == old:
+        log.debug('Authorized keys unchanged: %r', path)
+        return writer.unchanged(path)
+    return writer.write(path, new, sync=True)
+
+class CertificateError(Exception):
+    """Cannot parse SSH certificate"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+# number of key specific fields between the nonce and the serial, see
+# PROTOCOL.certkeys in OpenSSH
+_CERT_KEY_FIELDS = {
+    'ssh-rsa-cert-v01@openssh.com': 2,
+    'ssh-dss-cert-v01@openssh.com': 4,
+    'ecdsa-sha2-nistp256-cert-v01@openssh.com': 2,
+    'ecdsa-sha2-nistp384-cert-v01@openssh.com': 2,
+    'ecdsa-sha2-nistp521-cert-v01@openssh.com': 2,
+    'ssh-ed25519-cert-v01@openssh.com': 1,
+    'sk-ecdsa-sha2-nistp256-cert-v01@openssh.com': 3,
+    'sk-ssh-ed25519-cert-v01@openssh.com': 2,
+    }
+
+SSH_CERT_TYPE_USER = 1
+
+def _readString(data, pos):
+    if pos + 4 > len(data):
+        raise CertificateError('truncated')
+    (size,) = struct.unpack('>L', data[pos:pos+4])
+    pos += 4
+    if pos + size > len(data):
+        raise CertificateError('truncated')
+    return (data[pos:pos+size], pos+size)
 
+def parseCertificate(blob):
+    """
+    Extract the key id and principals from a base64 encoded OpenSSH
+    certificate.
+
+    The signature is not checked; ``sshd`` has done that already.
+    """
     try:
-        out = file(tmp, 'w')
-        try:
-            if in_ is not None:
-                for line in filterAuthorizedKeys(in_):
-                    print >>out, line
+        data = base64.b64decode(blob)
+    except TypeError:
+        raise CertificateError('not base64')
+    (certtype, pos) = _readString(data, 0)
+    nfields = _CERT_KEY_FIELDS.get(certtype)
+    if nfields is None:
+        raise CertificateError('unknown type %r' % certtype)
+    # nonce, then the public key itself
+    for i in range(1 + nfields):
+        (_, pos) = _readString(data, pos)
+    if pos + 12 > len(data):
+        raise CertificateError('truncated')
+    (serial, kind) = struct.unpack('>QL', data[pos:pos+12])
+    pos += 12
+    (key_id, pos) = _readString(data, pos)
+    (packed, pos) = _readString(data, pos)
+    principals = []
+    i = 0
+    while i < len(packed):
+        (principal, i) = _readString(packed, i)
+        principals.append(principal)
+    return dict(
+        type=certtype,
+        cert_type=kind,
+        serial=serial,
+        key_id=key_id,
+        principals=principals,
+        )
 
-            keygen = readKeys(keydir)
-            for line in generateAuthorizedKeys(keygen):
-                print >>out, line
+def readAuthInfoCertificate(fp):
+    """
+    Find the certificate used to log in, in the ``SSH_USER_AUTH``
+    file ``sshd`` writes with ``ExposeAuthInfo yes``.
 
-            os.fsync(out)
-        finally:
-            out.close()
-    finally:
-        if in_ is not None:
-            in_.close()
-    os.rename(tmp, path)
+    Returns the base64 encoded certificate, or ``None``.
+    """
+    found = None
+    for line in fp:
+        words = line.split()
+        if (len(words) >= 3
+            and words[0] == 'publickey'
+            and words[1] in _CERT_KEY_FIELDS):
+            found = words[2]
+    return found
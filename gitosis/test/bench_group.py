@@ -0,0 +1,76 @@
+"""
+Time group expansion for many repositories and deeply nested groups.
+
+Run with ``python -m gitosis.test.bench_group [DEPTH [REPOS]]``. It
+compares what ``gen_htaccess`` used to do, ``listMembers`` for every
+group of every repository, with one ``group.Expansion`` shared by
+all of them. The baseline is a copy of ``listMembers`` as it was then,
+before it learned to stop on loops.
+"""
+
+import sys
+import time
+from ConfigParser import RawConfigParser
+
+from gitosis import access
+from gitosis import util
+
+def make_config(depth, repos, width=4):
+    """
+    ``width`` chains of ``depth`` groups, each group a member of the
+    one before it, and ``repos`` repositories readable by the heads
+    of the chains.
+    """
+    cfg = RawConfigParser()
+    for chain in range(width):
+        for level in range(depth):
+            section = 'group c%d-%d' % (chain, level)
+            cfg.add_section(section)
+            members = ['user%d-%d-%d' % (chain, level, n) for n in range(3)]
+            if level + 1 < depth:
+                members.append('@c%d-%d' % (chain, level + 1))
+            cfg.set(section, 'members', ' '.join(members))
+        cfg.set('group c%d-0' % chain, 'readonly',
+                ' '.join('repo%d' % n for n in range(repos)))
+    return cfg
+
+def old_listMembers(config, group, mset):
+    if group <> 'all':
+        members = util.getConfigList(config, 'group %s' % group, 'members')
+
+        for user in members:
+            mset.add(user)
+            if user.startswith('@'):
+                old_listMembers(config, user[1:], mset)
+
+def unshared(cfg, table, names):
+    for name in names:
+        users = set()
+        groups = set()
+        access.listAccess(cfg, table, 'readonly', name, users, groups)
+        all_refs = set(['@' + item for item in groups])
+        for grp in groups:
+            old_listMembers(cfg, grp, all_refs)
+
+def shared(cfg, table, names):
+    for name in names:
+        access.getAllAccess(cfg, table, name, ['readonly'])
+
+def main(args):
+    depth = 100
+    repos = 200
+    if args:
+        depth = int(args[0])
+    if args[1:]:
+        repos = int(args[1])
+    cfg = make_config(depth, repos)
+    names = ['repo%d' % n for n in range(repos)]
+    for (label, fn) in [('listMembers per repository', unshared),
+                        ('shared Expansion', shared)]:
+        table = access.getAccessTable(cfg, ['readonly'])
+        start = time.time()
+        fn(cfg, table, names)
+        print '%-28s %8.3fs' % (label, time.time() - start)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
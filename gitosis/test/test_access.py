@@ -208,3 +208,37 @@ def test_pattern():
     cfg.set('group fooers', 'writable', 'foo/*')
     eq(access.haveAccess(config=cfg, user='jdoe', mode='writable', path='foo/bar'),
        ('repositories', 'foo/bar'))
+
+def test_list_pattern():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'readonly', 'squee-* baz/*/thud')
+    cfg.add_section('group everyone')
+    cfg.set('group everyone', 'readonly', '*')
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'readonly', 'squee-[ab]')
+    table = access.getAccessTable(cfg)
+    users = set()
+    groups = set()
+    access.listAccess(cfg,table,'readonly','squee-a.git',users,groups)
+    eq(sorted(groups), ['everyone', 'fooers'])
+    eq(sorted(users), ['jdoe'])
+    users = set()
+    groups = set()
+    access.listAccess(cfg,table,'readonly','baz/quux/thud',users,groups)
+    eq(sorted(groups), ['everyone', 'fooers'])
+    eq(sorted(users), [])
+    users = set()
+    groups = set()
+    access.listAccess(cfg,table,'writable','squee-a',users,groups)
+    eq(sorted(groups), [])
+
+def test_list_all_pattern():
+    cfg = RawConfigParser()
+    cfg.add_section('group all')
+    cfg.set('group all', 'readonly', 'public/*')
+    table = access.getAccessTable(cfg)
+    (users, groups, all_refs) = access.getAllAccess(cfg,table,'public/foo')
+    eq(sorted(all_refs), ['@all'])
+    (users, groups, all_refs) = access.getAllAccess(cfg,table,'private/foo')
+    eq(sorted(all_refs), [])
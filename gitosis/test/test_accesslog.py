@@ -0,0 +1,70 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import accesslog
+from gitosis.test.util import maketemp, writeFile
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'access-log', os.path.join(tmp, 'access.log'))
+    return cfg
+
+def test_disabled():
+    cfg = RawConfigParser()
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git')
+    eq(list(accesslog.read(cfg)), [])
+
+def test_missing():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    eq(list(accesslog.read(cfg)), [])
+
+def test_record():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git', _now=10)
+    accesslog.record(cfg, 'wsmith', 'git receive-pack', 'bar/baz.git',
+                     _now=20)
+    eq(list(accesslog.read(cfg)), [
+        (10, 'jdoe', 'git-upload-pack', 'foo.git'),
+        (20, 'wsmith', 'git receive-pack', 'bar/baz.git'),
+        ])
+    eq(list(accesslog.read(cfg, since=15)), [
+        (20, 'wsmith', 'git receive-pack', 'bar/baz.git'),
+        ])
+
+def test_read_junk():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    writeFile(os.path.join(tmp, 'access.log'),
+              'junk\nx\ty\tz\tw\n5\tjdoe\tgit-upload-pack\tfoo.git\n')
+    eq(list(accesslog.read(cfg)), [
+        (5, 'jdoe', 'git-upload-pack', 'foo.git'),
+        ])
+
+def test_last_access():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git', _now=30)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git', _now=10)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'bar.git', _now=20)
+    eq(accesslog.last_access(cfg), {'foo.git': 30, 'bar.git': 20})
+
+def test_LastAccess():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    last = accesslog.LastAccess(cfg)
+    eq(last.get('foo.git'), 0)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git', _now=30)
+    eq(last.get('foo.git'), 30)
+    offset = last.offset
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'bar.git', _now=20)
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git', _now=10)
+    eq(last.get('bar.git'), 20)
+    eq(last.get('foo.git'), 30)
+    # only the new lines were read
+    assert last.offset > offset
+    eq(last.last, accesslog.last_access(cfg))
@@ -0,0 +1,90 @@
+from nose.tools import eq_ as eq
+
+import os
+import time
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import actions
+from gitosis.test.util import maketemp, readFile
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.add_section('action log')
+    cfg.set('action log', 'command',
+            'cat >>"log-$GITOSIS_ACTION"; echo "$GITOSIS_REPO" >>"log-$GITOSIS_ACTION"')
+    cfg.add_section('action notify')
+    cfg.set('action notify', 'command', 'echo notified >notify')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'actions', 'log nosuch')
+    cfg.add_section('group web')
+    cfg.set('group web', 'writable', 'web/* foo')
+    cfg.set('group web', 'actions', 'notify log')
+    return cfg
+
+def test_haveActions():
+    cfg = RawConfigParser()
+    eq(actions.haveActions(cfg), False)
+    eq(actions.haveActions(_config()), True)
+
+def test_getAction_timeout():
+    cfg = _config()
+    eq(actions.getAction(cfg, 'log').timeout, 60)
+    cfg.set('gitosis', 'action-timeout', '5')
+    eq(actions.getAction(cfg, 'log').timeout, 5)
+    cfg.set('action log', 'timeout', '2')
+    eq(actions.getAction(cfg, 'log').timeout, 2)
+    eq(actions.getAction(cfg, 'log').detach, False)
+    eq(actions.getAction(cfg, 'nosuch'), None)
+
+def test_forRepo():
+    cfg = _config()
+    eq([a.name for a in actions.forRepo(cfg, 'foo.git')], ['log', 'notify'])
+    eq([a.name for a in actions.forRepo(cfg, 'web/site')], ['notify', 'log'])
+    eq(actions.forRepo(cfg, 'other'), [])
+
+def test_run():
+    tmp = maketemp()
+    cfg = _config()
+    env = dict(os.environ, GITOSIS_REPO='foo.git', GITOSIS_USER='jdoe')
+    updates = 'old new refs/heads/master\n'
+    got = actions.run(cfg, tmp, StringIO(updates), env)
+    eq(got, [('log', 'ok'), ('notify', 'ok')])
+    eq(readFile(os.path.join(tmp, 'log-log')), updates + 'foo.git\n')
+    eq(readFile(os.path.join(tmp, 'notify')), 'notified\n')
+
+def test_run_no_repo():
+    tmp = maketemp()
+    eq(actions.run(_config(), tmp, StringIO(''), {}), [])
+
+def test_run_failed_and_timeout():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('action fail')
+    cfg.set('action fail', 'command', 'exit 2')
+    cfg.add_section('action slow')
+    cfg.set('action slow', 'command', 'sleep 30')
+    cfg.set('action slow', 'timeout', '0.2')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'actions', 'fail slow')
+    start = time.time()
+    got = actions.run(cfg, tmp, StringIO(''), dict(GITOSIS_REPO='foo'))
+    eq(got, [('fail', 'failed'), ('slow', 'timeout')])
+    assert time.time() - start < 10
+
+def test_run_detached():
+    tmp = maketemp()
+    cfg = _config()
+    cfg.set('action notify', 'command', 'sleep 0.2; echo notified >notify')
+    cfg.set('action notify', 'detach', 'yes')
+    env = dict(os.environ, GITOSIS_REPO='web/site')
+    got = actions.run(cfg, tmp, StringIO('x\n'), env)
+    # only the action waited for is reported
+    eq(got, [('log', 'ok')])
+    path = os.path.join(tmp, 'notify')
+    for i in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    eq(readFile(path), 'notified\n')
@@ -0,0 +1,139 @@
+from nose.tools import eq_ as eq, assert_raises
+
+import os
+from cStringIO import StringIO
+
+from gitosis import batch, repository
+from gitosis.test.util import maketemp, readFile, writeFile
+
+CONFIG = """\
+[gitosis]
+
+# the web people
+[group web]
+members = jdoe
+	olduser
+writable = web/site
+
+[group admins]
+members = olduser
+"""
+
+def _admin(tmp):
+    git_dir = os.path.join(tmp, 'admin.git')
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        commit_msg='initial',
+        committer='John Doe <jdoe@example.com>',
+        files=[
+            ('gitosis.conf', CONFIG),
+            ('keydir/jdoe.pub', 'ssh-rsa AAAA jdoe@host\n'),
+            ('keydir/old/olduser.pub', 'ssh-rsa BBBB olduser@host\n'),
+            ],
+        )
+    return git_dir
+
+def _tree(git_dir):
+    return repository.ls_tree(git_dir, [], recursive=True)
+
+def test_parse():
+    changes = batch.parse(StringIO("""\
+# onboarding
+add-key asmith keys/asmith.pub
+remove-user olduser
+
+add-members web asmith @admins
+add-repos web readonly docs  # not ours
+remove-repos web web/old
+"""))
+    eq(changes.changes, [
+            ('add-key', 'asmith', 'keys/asmith.pub'),
+            ('remove-user', 'olduser'),
+            ('add-members', 'web', ['asmith', '@admins']),
+            ('add-repos', 'web', 'readonly', ['docs']),
+            ('remove-repos', 'web', ['web/old']),
+            ])
+
+def test_parse_bad():
+    for line in ['add-members web\n',
+                 'add-repos web sometimes foo\n',
+                 'add-key ../etc x\n',
+                 'frobnicate\n']:
+        try:
+            batch.parse(StringIO('\n%s' % line), 'changes')
+        except batch.BatchError, e:
+            eq(e.args[0], 'changes:2')
+        else:
+            raise AssertionError('no error for %r' % line)
+
+def test_edit_config():
+    got = batch.edit_config(CONFIG, 'group web', 'members', 'jdoe')
+    eq(got, CONFIG.replace('jdoe\n\tolduser\n', 'jdoe\n'))
+    got = batch.edit_config(CONFIG, 'group web', 'readonly', 'docs')
+    eq(got, CONFIG.replace('writable = web/site\n',
+                           'writable = web/site\nreadonly = docs\n'))
+    got = batch.edit_config(CONFIG, 'group admins', 'members', '')
+    eq(got, CONFIG.replace('members = olduser\n', ''))
+    got = batch.edit_config(CONFIG, 'group new', 'members', 'x')
+    eq(got, CONFIG + '\n[group new]\nmembers = x\n')
+
+def test_commit():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    before = repository.rev_parse(git_dir)
+    key = os.path.join(tmp, 'asmith.pub')
+    writeFile(key, 'ssh-rsa CCCC asmith@host\n')
+    changes = batch.ChangeSet()
+    changes.add_key('asmith', key)
+    changes.remove_user('olduser')
+    changes.add_members('web', ['asmith'])
+    changes.add_repos('web', 'writable', ['web/blog'])
+    rev = batch.commit(git_dir, changes, 'Batch <batch@example.com>', 'many')
+    eq(rev, repository.rev_parse(git_dir))
+    eq(repository.rev_parse(git_dir, '%s^' % rev), before)
+    tree = _tree(git_dir)
+    eq(sorted(tree), ['gitosis.conf', 'keydir/asmith.pub', 'keydir/jdoe.pub'])
+    eq(repository.cat_blob(git_dir, tree['keydir/asmith.pub']),
+       'ssh-rsa CCCC asmith@host\n')
+    eq(repository.cat_blob(git_dir, tree['gitosis.conf']), """\
+[gitosis]
+
+# the web people
+[group web]
+members = jdoe asmith
+writable = web/site web/blog
+
+[group admins]
+""")
+
+def test_commit_nothing():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    key = os.path.join(tmp, 'jdoe.pub')
+    writeFile(key, 'ssh-rsa AAAA jdoe@host\n')
+    changes = batch.ChangeSet()
+    changes.add_key('jdoe', key)
+    changes.add_members('web', ['jdoe'])
+    changes.remove_repos('nosuchgroup', ['foo'])
+    eq(batch.commit(git_dir, changes, 'Batch <batch@example.com>', 'x'), None)
+
+def test_commit_missing_key():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    changes = batch.ChangeSet()
+    changes.add_key('asmith', os.path.join(tmp, 'nope.pub'))
+    assert_raises(batch.BatchError, batch.commit,
+                  git_dir, changes, 'Batch <batch@example.com>', 'x')
+
+def test_run_hook():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    hook = os.path.join(git_dir, 'hooks', 'post-update')
+    writeFile(hook, '#!/bin/sh\necho "$GIT_DIR $1" >>ran\n')
+    os.chmod(hook, 0755)
+    batch.run_hook(git_dir)
+    eq(readFile(os.path.join(git_dir, 'ran')), '. refs/heads/master\n')
+    writeFile(hook, '#!/bin/sh\nexit 3\n')
+    os.chmod(hook, 0755)
+    assert_raises(batch.BatchError, batch.run_hook, git_dir)
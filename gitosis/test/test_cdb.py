@@ -0,0 +1,55 @@
+from nose.tools import eq_ as eq
+
+import os
+
+from gitosis import cdb
+from gitosis.test.util import maketemp
+
+def _make(path, records):
+    maker = cdb.CdbMaker(path)
+    for (key, data) in records:
+        maker.add(key, data)
+    maker.finish()
+
+def test_empty():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'db')
+    _make(path, [])
+    db = cdb.Cdb(path)
+    eq(db.get('foo'), None)
+    db.close()
+
+def test_simple():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'db')
+    _make(path, [('foo', 'bar'), ('baz', '')])
+    db = cdb.Cdb(path)
+    eq(db.get('foo'), 'bar')
+    eq(db.get('baz'), '')
+    eq(db.get('quux', 'missing'), 'missing')
+    db.close()
+    eq(os.listdir(tmp), ['db'])
+
+def test_duplicates():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'db')
+    _make(path, [('foo', 'one'), ('bar', 'x'), ('foo', 'two')])
+    db = cdb.Cdb(path)
+    eq(list(db.getall('foo')), ['one', 'two'])
+    db.close()
+
+def test_many():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'db')
+    records = [('key%d' % i, 'value%d' % i) for i in range(2000)]
+    _make(path, records)
+    db = cdb.Cdb(path)
+    for (key, data) in records:
+        eq(db.get(key), data)
+    eq(db.get('key2000'), None)
+    db.close()
+
+def test_hash():
+    # reference values from the cdb specification's hash function
+    eq(cdb.cdb_hash(''), 5381)
+    eq(cdb.cdb_hash('a'), (5381 * 33) ^ ord('a'))
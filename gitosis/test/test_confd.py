@@ -0,0 +1,147 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import confd, init, repository
+from gitosis.test.util import maketemp, writeFile
+
+def _admin(tmp):
+    git_dir = os.path.join(tmp, 'admin.git')
+    init.init_admin_repository(
+        git_dir=git_dir,
+        pubkey='ssh-somealgo AAAAB3NzaC1yc2EAAAA= theadmin@fakehost',
+        user='theadmin',
+        )
+    return git_dir
+
+def _commit(git_dir, files):
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='config',
+        parent='refs/heads/master^0',
+        files=files,
+        )
+    return repository.ls_tree(git_dir, ['gitosis.conf', confd.CONF_DIR])
+
+def test_is_fragment():
+    eq(confd.is_fragment('team.conf'), True)
+    eq(confd.is_fragment('.team.conf'), False)
+    eq(confd.is_fragment('team.conf~'), False)
+    eq(confd.is_fragment('sub/team.conf'), False)
+
+def test_merge():
+    (cfg, conflicts) = confd.merge([
+            ('gitosis.conf', [('group a', [('members', 'jdoe')])]),
+            ('conf.d/a.conf', [('group a', [('writable', 'foo')]),
+                               ('repo foo', [('owner', 'jdoe')])]),
+            ('conf.d/b.conf', [('repo foo', [('owner', 'jdoe')])]),
+            ])
+    eq(sorted(cfg.items('group a')),
+       [('members', 'jdoe'), ('writable', 'foo')])
+    # same value twice is no conflict
+    eq(conflicts, [])
+
+def test_merge_conflict():
+    (cfg, conflicts) = confd.merge([
+            ('conf.d/a.conf', [('repo foo', [('owner', 'jdoe')])]),
+            ('conf.d/b.conf', [('repo foo', [('owner', 'jane')])]),
+            ])
+    # the later one wins
+    eq(cfg.get('repo foo', 'owner'), 'jane')
+    eq([str(c) for c in conflicts],
+       ['[repo foo] owner in conf.d/b.conf overrides conf.d/a.conf'])
+
+def test_read_order_and_cache():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    head = _commit(git_dir, [
+            ('gitosis.conf', '[gitosis]\n'),
+            ('conf.d/20-b.conf', '[repo foo]\ndescription = b\n'),
+            ('conf.d/10-a.conf', '[repo foo]\ndescription = a\n'),
+            ('conf.d/README', 'not read\n'),
+            ])
+    catfile = repository.CatFile(git_dir)
+    try:
+        eq([name for (name, sha1) in confd.files(
+                    git_dir, head['gitosis.conf'], head[confd.CONF_DIR])],
+           ['gitosis.conf', 'conf.d/10-a.conf', 'conf.d/20-b.conf'])
+        merged = confd.read(
+            git_dir, head['gitosis.conf'], head[confd.CONF_DIR], catfile)
+        eq(merged.cfg.get('repo foo', 'description'), 'b')
+        eq(len(merged.conflicts), 1)
+        eq(len(merged.blobs), 3)
+        eq(sorted(os.listdir(os.path.join(git_dir, confd.CACHE_DIR))),
+           sorted(merged.blobs))
+        # poison the cache; unchanged blobs come from it
+        (sha1,) = [sha1 for (name, sha1) in confd.files(
+                git_dir, head['gitosis.conf'], head[confd.CONF_DIR])
+                   if name == 'conf.d/20-b.conf']
+        confd._store(git_dir, sha1, [('repo foo', [('description', 'c')])])
+        merged = confd.read(
+            git_dir, head['gitosis.conf'], head[confd.CONF_DIR], catfile)
+        eq(merged.cfg.get('repo foo', 'description'), 'c')
+    finally:
+        catfile.close()
+
+def test_broken_cache_entry():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    head = _commit(git_dir, [('gitosis.conf', '[repo foo]\nowner = x\n')])
+    sha1 = head['gitosis.conf']
+    os.mkdir(os.path.join(git_dir, confd.CACHE_DIR))
+    writeFile(os.path.join(git_dir, confd.CACHE_DIR, sha1), '')
+    catfile = repository.CatFile(git_dir)
+    try:
+        merged = confd.read(git_dir, sha1, None, catfile)
+    finally:
+        catfile.close()
+    eq(merged.cfg.get('repo foo', 'owner'), 'x')
+
+def test_export_without_confd_is_verbatim():
+    tmp = maketemp()
+    git_dir = _admin(tmp)
+    head = _commit(git_dir, [('gitosis.conf', '# hi\n[gitosis]\n')])
+    catfile = repository.CatFile(git_dir)
+    try:
+        merged = confd.read(git_dir, head['gitosis.conf'], None, catfile)
+        eq(confd.export(merged, head['gitosis.conf'], catfile),
+           '# hi\n[gitosis]\n')
+    finally:
+        catfile.close()
+
+def test_prune():
+    tmp = maketemp()
+    os.mkdir(os.path.join(tmp, confd.CACHE_DIR))
+    for name in ['a', 'b']:
+        writeFile(os.path.join(tmp, confd.CACHE_DIR, name), '')
+    confd.prune(tmp, set(['b']))
+    eq(os.listdir(os.path.join(tmp, confd.CACHE_DIR)), ['b'])
+
+def test_merge_no_override():
+    merged = confd.Merged()
+    merged.add('gitosis.conf', [('repo web/site', [('owner', 'jdoe')])])
+    merged.add('web-admin:gitosis.conf',
+               [('repo web/site', [('owner', 'mallory'),
+                                   ('description', 'the site')])],
+               override=False)
+    eq(merged.cfg.get('repo web/site', 'owner'), 'jdoe')
+    eq(merged.cfg.get('repo web/site', 'description'), 'the site')
+    eq(merged.conflicts, [])
+
+def test_replace():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', '/srv/git')
+    cfg.set('gitosis', 'loglevel', 'DEBUG')
+    cfg.add_section('group old')
+    cfg.set('group old', 'writable', 'foo')
+    new = RawConfigParser()
+    new.add_section('gitosis')
+    new.set('gitosis', 'loglevel', 'INFO')
+    new.add_section('repo foo')
+    confd.replace(cfg, new)
+    eq(cfg.sections(), ['gitosis', 'repo foo'])
+    eq(sorted(cfg.items('gitosis')),
+       [('loglevel', 'INFO'), ('repositories', '/srv/git')])
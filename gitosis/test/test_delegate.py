@@ -0,0 +1,92 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import delegate
+from gitosis.test.util import maketemp
+
+def _config(tmp=None):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    if tmp is not None:
+        cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('delegate web')
+    cfg.set('delegate web', 'admin', 'teams/web-admin.git')
+    cfg.set('delegate web', 'repos', 'web/* www')
+    cfg.set('delegate web', 'groups', 'web-devs')
+    cfg.add_section('delegate broken')
+    return cfg
+
+def _web(cfg):
+    (web,) = delegate.getDelegations(cfg)
+    return web
+
+def test_getDelegations():
+    web = _web(_config())
+    eq(web.name, 'web')
+    eq(web.admin, 'teams/web-admin')
+    eq(web.key(), 'delegate.web')
+    eq(web.owns('web/site.git'), True)
+    eq(web.owns('www'), True)
+    eq(web.owns('secret'), False)
+
+def test_lookup():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    path = os.path.join(tmp, 'teams', 'web-admin.git')
+    os.makedirs(path)
+    eq(delegate.lookup(cfg, path).name, 'web')
+    eq(delegate.lookup(cfg, os.path.join(tmp, 'gitosis-admin.git')), None)
+    eq(delegate.is_admin(cfg, 'teams/web-admin.git'), True)
+    eq(delegate.is_admin(cfg, 'web/site.git'), False)
+
+def test_restrict():
+    web = _web(_config())
+    got = delegate.restrict(web, [
+            ('repo web/site', [('description', 'the site')]),
+            ('repo secret', [('description', 'mine now')]),
+            ('gitosis', [('loglevel', 'DEBUG')]),
+            ('user jdoe', [('writable', 'secret')]),
+            ('group web-devs', [('members', 'jdoe jane'),
+                                ('writable', 'web/site secret'),
+                                ('map writable w', 'secret'),
+                                ('map readonly s', 'web/site'),
+                                ('repositories', '/etc')]),
+            ('group admins', [('members', 'jdoe')]),
+            ], set())
+    eq(got, [
+            ('repo web/site', [('description', 'the site')]),
+            ('group web-devs', [('members', 'jdoe jane'),
+                                ('writable', 'web/site'),
+                                ('map readonly s', 'web/site')]),
+            ])
+
+def test_restrict_main_group():
+    web = _web(_config())
+    got = delegate.restrict(web, [
+            ('group web-devs', [('members', 'mallory')]),
+            ], set(['group web-devs']))
+    eq(got, [])
+
+def test_covers():
+    web = _web(_config())
+    eq(web.covers('web/site'), True)
+    eq(web.covers('web/*'), True)
+    eq(web.covers('web/blog-*'), True)
+    eq(web.covers('w*'), False)
+    eq(web.covers('*'), False)
+
+def test_restrict_pattern_escape():
+    cfg = _config()
+    cfg.set('delegate web', 'repos', 'team-?/*')
+    web = _web(cfg)
+    # fnmatch('team-*/*', 'team-?/*') holds, but team-xyz/secret
+    # is not delegated
+    got = delegate.restrict(web, [
+            ('group web-devs', [('writable', 'team-*/* team-?/* team-a/x'),
+                                ('map writable s', 'team-*/*')]),
+            ], set())
+    eq(got, [
+            ('group web-devs', [('writable', 'team-?/* team-a/x')]),
+            ])
@@ -0,0 +1,91 @@
+from nose.tools import eq_ as eq
+
+import os
+from cStringIO import StringIO
+from ConfigParser import RawConfigParser
+
+from gitosis import delta
+from gitosis.test.util import maketemp
+
+def _cfg(s):
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(s))
+    return cfg
+
+BASE = """\
+[group a]
+members = jdoe
+writable = foo
+
+[group b]
+members = @a wsmith
+readonly = bar
+
+[group c]
+members = alice
+writable = baz
+
+[repo foo]
+description = foo
+
+[repo quux]
+description = quux
+"""
+
+def test_state_roundtrip():
+    tmp = maketemp()
+    eq(delta.readState(tmp), {})
+    delta.writeState(tmp, dict(config='1'*40, keydir='2'*40))
+    eq(delta.readState(tmp), dict(config='1'*40, keydir='2'*40))
+
+def test_unchanged():
+    got = delta.compute(_cfg(BASE), _cfg(BASE), keys_changed=False)
+    assert got.is_empty()
+
+def test_keys_only():
+    got = delta.compute(_cfg(BASE), _cfg(BASE), keys_changed=True)
+    eq(got.config, False)
+    eq(got.keys, True)
+
+def test_repo_section():
+    new = _cfg(BASE)
+    new.set('repo quux', 'description', 'changed')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    eq(got.repos, set(['quux']))
+    eq(got.groups, False)
+    eq(got.new_repos, set())
+
+def test_new_repo_section():
+    new = _cfg(BASE)
+    new.add_section('repo xyzzy')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    eq(got.repos, set(['xyzzy']))
+    eq(got.new_repos, set(['xyzzy']))
+
+def test_group_membership_nested():
+    new = _cfg(BASE)
+    new.set('group a', 'members', 'jdoe bill')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    # a is a member of b, so b's repositories are affected too
+    eq(got.repos, set(['foo', 'bar']))
+    eq(got.groups, True)
+
+def test_group_access_removed():
+    new = _cfg(BASE)
+    new.set('group c', 'writable', 'thud')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    eq(got.repos, set(['baz', 'thud']))
+
+def test_global():
+    new = _cfg(BASE)
+    new.add_section('defaults')
+    new.set('defaults', 'daemon', 'yes')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    eq(got.repos, None)
+    eq(got.keys, True)
+
+def test_pattern():
+    new = _cfg(BASE)
+    new.set('group c', 'writable', 'baz squee-*')
+    got = delta.compute(_cfg(BASE), new, keys_changed=False)
+    eq(got.repos, None)
@@ -158,3 +158,68 @@ foo: a b c d
 bar: c d
 baz: 
 ''')
+
+def test_listMembers_loop():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b @foo')
+    got = set()
+    group.listMembers(cfg, 'foo', got)
+    eq(sorted(got), ['@bar', '@foo', 'a', 'b'])
+
+def test_listMembers_seeded():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b')
+    # groups already in the set are still expanded
+    got = set(['@bar'])
+    group.listMembers(cfg, 'foo', got)
+    eq(sorted(got), ['@bar', 'a', 'b'])
+
+def test_expansion():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar @all @nosuch')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b @baz')
+    cfg.add_section('group baz')
+    cfg.set('group baz', 'members', 'c')
+    expansion = group.Expansion(cfg)
+    for name in ['foo', 'bar', 'baz', 'all', 'nosuch', 'undefined']:
+        want = set()
+        group.listMembers(cfg, name, want)
+        eq(expansion.members(name), want)
+    eq(sorted(expansion.members('foo')),
+       ['@all', '@bar', '@baz', '@nosuch', 'a', 'b', 'c'])
+
+def test_expansion_loop():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b @quux')
+    cfg.add_section('group quux')
+    cfg.set('group quux', 'members', 'c @foo @thud')
+    cfg.add_section('group thud')
+    cfg.set('group thud', 'members', 'd')
+    expansion = group.Expansion(cfg)
+    want = ['@bar', '@foo', '@quux', '@thud', 'a', 'b', 'c', 'd']
+    for name in ['foo', 'bar', 'quux']:
+        eq(sorted(expansion.members(name)), want)
+    eq(sorted(expansion.members('thud')), ['d'])
+
+def test_expansion_deep():
+    # deeper than the recursion limit
+    cfg = RawConfigParser()
+    depth = 1500
+    for i in range(depth):
+        cfg.add_section('group g%d' % i)
+        cfg.set('group g%d' % i, 'members', 'u%d @g%d' % (i, i + 1))
+    expansion = group.Expansion(cfg)
+    eq(len(expansion.members('g0')), 2 * depth)
+    eq(sorted(expansion.members('g%d' % (depth - 1))),
+       ['@g%d' % depth, 'u%d' % (depth - 1)])
@@ -0,0 +1,177 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+from ConfigParser import RawConfigParser
+
+from gitosis import hooks
+from gitosis import limits
+from gitosis import repoindex
+from gitosis import repository
+from gitosis import serve
+from gitosis.test.util import maketemp, mkdir, readFile, writeFile
+from gitosis.writer import Writer
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'shared-hooks', os.path.join(tmp, 'hooks'))
+    return (cfg, repos)
+
+def _hooks_path(git_dir):
+    child = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'config', 'core.hooksPath'],
+        stdout=subprocess.PIPE,
+        )
+    got = child.stdout.read()
+    child.wait()
+    return got.strip() or None
+
+def test_getSharedHooksDir_unset():
+    cfg = RawConfigParser()
+    eq(hooks.getSharedHooksDir(cfg), None)
+
+def test_scripts_nothing():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    eq(hooks.scripts(cfg), {'pre-receive': None,
+                            'post-receive': None,
+                            'post-update': None})
+
+def test_install():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.add_section('defaults')
+    cfg.set('defaults', 'max-pack-size', '1m')
+    cfg.set('gitosis', 'repository-index', os.path.join(tmp, 'index'))
+    hooks.install(cfg)
+    path = os.path.join(tmp, 'hooks')
+    eq(sorted(os.listdir(path)), ['post-receive', 'pre-receive'])
+    eq(readFile(os.path.join(path, 'pre-receive')), limits.PRE_RECEIVE_HOOK)
+    eq(readFile(os.path.join(path, 'post-receive')),
+       repoindex.POST_RECEIVE_HOOK)
+    # one file for everyone when it changes
+    cfg.remove_option('defaults', 'max-pack-size')
+    writer = Writer()
+    hooks.install(cfg, writer)
+    eq(sorted(os.listdir(path)), ['post-receive'])
+    eq((writer.written, writer.skipped), (1, 2))
+
+def test_post_update_dispatch():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.add_section('delegate web')
+    cfg.set('delegate web', 'admin', 'web-admin')
+    for name in ['web-admin.git', 'other.git']:
+        repository.init(os.path.join(repos, name))
+    bindir = os.path.join(tmp, 'bin')
+    mkdir(bindir)
+    fake = os.path.join(bindir, 'gitosis-run-hook')
+    writeFile(fake, '#!/bin/sh\necho "ran $1"\n')
+    os.chmod(fake, 0755)
+    hooks.install(cfg)
+    script = os.path.join(tmp, 'hooks', 'post-update')
+    def run(name):
+        env = dict(os.environ)
+        env['PATH'] = '%s:%s' % (bindir, env['PATH'])
+        env['GIT_DIR'] = '.'
+        child = subprocess.Popen(
+            args=[script],
+            cwd=os.path.join(repos, name),
+            env=env,
+            stdout=subprocess.PIPE,
+            )
+        got = child.stdout.read()
+        eq(child.wait(), 0)
+        return got
+    eq(run('web-admin.git'), 'ran post-update\n')
+    eq(run('other.git'), '')
+
+def test_init_hooks_path():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path, hooks_path=hooks.getSharedHooksDir(cfg))
+    assert not os.path.exists(os.path.join(path, 'hooks'))
+    eq(_hooks_path(path), os.path.join(tmp, 'hooks'))
+    eq(hooks.use(cfg, path), True)
+
+def test_init_template_hooks():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    template = os.path.join(tmp, 'template')
+    mkdir(template)
+    mkdir(os.path.join(template, 'hooks'))
+    hook = os.path.join(template, 'hooks', 'update')
+    writeFile(hook, '#!/bin/sh\nexit 1\n')
+    os.chmod(hook, 0755)
+    cfg.set('gitosis', 'init-template', template)
+    path = os.path.join(repos, 'foo.git')
+    serve.auto_init_repo(cfg, repos, 'foo.git')
+    # the template hooks stay in effect
+    assert os.access(os.path.join(path, 'hooks', 'update'), os.X_OK)
+    eq(_hooks_path(path), None)
+
+    # a template without hooks still shares them
+    os.unlink(hook)
+    path = os.path.join(repos, 'bar.git')
+    hooks.init(cfg, path, 0750)
+    eq(_hooks_path(path), os.path.join(tmp, 'hooks'))
+
+def test_use():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    writer = Writer(dry_run=True)
+    eq(hooks.use(cfg, path, writer), True)
+    eq(_hooks_path(path), None)
+    writer = Writer()
+    eq(hooks.use(cfg, path, writer), True)
+    eq(_hooks_path(path), os.path.join(tmp, 'hooks'))
+    eq(hooks.use(cfg, path, writer), True)
+    eq((writer.written, writer.skipped), (1, 1))
+
+def test_use_admin():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'gitosis-admin.git')
+    repository.init(path)
+    eq(hooks.use(cfg, path), False)
+    eq(_hooks_path(path), None)
+
+def test_use_custom_hook():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    hook = os.path.join(path, 'hooks', 'update')
+    writeFile(hook, '#!/bin/sh\nexit 1\n')
+    os.chmod(hook, 0755)
+    # installed by gitosis is fine, custom is not
+    limits.install_hook(path)
+    eq(hooks.use(cfg, path), False)
+    eq(_hooks_path(path), None)
+    os.unlink(hook)
+    eq(hooks.use(cfg, path), True)
+
+def test_use_unset():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.remove_option('gitosis', 'shared-hooks')
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    eq(hooks.use(cfg, path), False)
+
+def test_use_all():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    for name in ['foo.git', 'bar.git', 'gitosis-admin.git']:
+        repository.init(os.path.join(repos, name))
+    eq(hooks.use_all(cfg), ['gitosis-admin'])
+    eq(_hooks_path(os.path.join(repos, 'foo.git')),
+       os.path.join(tmp, 'hooks'))
+    eq(hooks.use_all(cfg, names=['bar']), [])
@@ -0,0 +1,106 @@
+from nose.tools import eq_ as eq
+
+import os
+import shutil
+from ConfigParser import RawConfigParser
+
+from gitosis import gitdaemon
+from gitosis import gitweb
+from gitosis import inventory
+from gitosis.test.util import maketemp, mkdir, writeFile
+
+def _setup(tmp):
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    for path in ['foo.git', 'sub', 'sub/bar.git', 'sub/bar.git/refs.git',
+                 '.gitosis-pool', '.gitosis-pool/pool.git', 'plain']:
+        mkdir(os.path.join(repos, path))
+    elsewhere = os.path.join(tmp, 'elsewhere.git')
+    mkdir(elsewhere)
+    os.symlink(elsewhere, os.path.join(repos, 'linked.git'))
+    writeFile(os.path.join(repos, 'file.git'), '')
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    return (cfg, repos)
+
+def test_walk():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    inv = inventory.Inventory(cfg)
+    got = list(inv.walk())
+    eq(got, [
+            (repos, 'foo.git', 'foo'),
+            (repos, 'linked.git', 'linked'),
+            (os.path.join(repos, 'sub'), 'bar.git', 'sub/bar'),
+            ])
+    eq(sorted(got), sorted(gitdaemon.walk_repos(cfg)))
+
+def test_walk_missing():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', os.path.join(tmp, 'missing'))
+    inv = inventory.Inventory(cfg)
+    eq(list(inv.walk()), [])
+
+def test_walk_once():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    inv = inventory.Inventory(cfg)
+    first = list(inv.walk())
+    shutil.rmtree(os.path.join(repos, 'foo.git'))
+    # answered from memory
+    eq(list(inv.walk()), first)
+    assert inv.exists('foo.git')
+    assert inv.is_repo('sub/bar.git')
+    assert not inv.exists('nosuch.git')
+    assert not inv.is_repo('plain')
+    assert not inv.is_repo('file.git')
+    assert inv.saved() > 0
+
+def test_exists_unlisted():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    inv = inventory.Inventory(cfg)
+    assert inv.exists('sub/bar.git')
+    assert not inv.exists('nosuch.git')
+    eq(inv.syscalls, 2)
+    # checked once, then remembered
+    shutil.rmtree(os.path.join(repos, 'sub', 'bar.git'))
+    assert inv.exists('sub/bar.git')
+    eq(inv.syscalls, 2)
+    eq(inv.saved(), 1)
+
+def test_exists_insideRepo():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    inv = inventory.Inventory(cfg)
+    inv.scan()
+    # not listed, looked up
+    assert inv.exists('sub/bar.git/refs.git')
+
+def test_select():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    inv = inventory.Inventory(cfg)
+    eq(list(inv.select(['sub/bar', 'foo.git', 'plain', 'nosuch'])), [
+            (repos, 'foo.git', 'foo'),
+            (os.path.join(repos, 'sub'), 'bar.git', 'sub/bar'),
+            ])
+    inv.scan()
+    eq(list(inv.select(['sub/bar', 'linked'])), [
+            (repos, 'linked.git', 'linked'),
+            (os.path.join(repos, 'sub'), 'bar.git', 'sub/bar'),
+            ])
+
+def test_gitweb():
+    tmp = maketemp()
+    (cfg, repos) = _setup(tmp)
+    for name in ['foo', 'sub/bar', 'missing']:
+        cfg.add_section('repo %s' % name)
+        cfg.set('repo %s' % name, 'gitweb', 'yes')
+    inv = inventory.Inventory(cfg)
+    inv.scan()
+    got = sorted(gitweb.enum_cfg_repos(cfg, inv))
+    eq(got, sorted(gitweb.enum_cfg_repos(cfg)))
@@ -0,0 +1,165 @@
+from nose.tools import eq_ as eq
+from gitosis.test.util import assert_raises
+
+import os
+import subprocess
+from cStringIO import StringIO
+from ConfigParser import RawConfigParser
+
+from gitosis import accesslog
+from gitosis import limits
+from gitosis import repository
+from gitosis.test.util import maketemp, readFile
+
+def test_parseSize():
+    eq(limits.parseSize('42'), 42)
+    eq(limits.parseSize('2k'), 2048)
+    eq(limits.parseSize(' 3M '), 3 * 1024 * 1024)
+    eq(limits.parseSize('1g'), 1024 * 1024 * 1024)
+
+def test_getLimits_none():
+    cfg = RawConfigParser()
+    eq(limits.getLimits(cfg, 'jdoe', 'foo'), {})
+
+def test_getLimits_precedence():
+    cfg = RawConfigParser()
+    cfg.add_section('defaults')
+    cfg.set('defaults', 'max-pack-size', '1g')
+    cfg.set('defaults', 'max-ref-updates', '100')
+    cfg.add_section('group big')
+    cfg.set('group big', 'members', 'jdoe')
+    cfg.set('group big', 'max-blob-size', '10m')
+    cfg.add_section('group small')
+    cfg.set('group small', 'members', 'jdoe')
+    cfg.set('group small', 'max-blob-size', '1m')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'max-pack-size', '20m')
+    eq(limits.getLimits(cfg, 'jdoe', 'foo'), {
+        'max-pack-size': 20 * 1024 * 1024,
+        'max-blob-size': 1024 * 1024,
+        'max-ref-updates': 100,
+        })
+    eq(limits.getLimits(cfg, 'wsmith', 'bar'), {
+        'max-pack-size': 1024 * 1024 * 1024,
+        'max-ref-updates': 100,
+        })
+
+def test_getLimits_bad_value():
+    cfg = RawConfigParser()
+    cfg.add_section('defaults')
+    cfg.set('defaults', 'max-pack-size', '1g')
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'max-pack-size', 'huge')
+    cfg.set('repo foo', 'max-ref-updates', '')
+    eq(limits.getLimits(cfg, 'jdoe', 'foo'), {
+        'max-pack-size': 1024 * 1024 * 1024,
+        })
+
+def test_environment_git_parses():
+    tmp = maketemp()
+    env = dict(os.environ)
+    env.update(limits.environment('jdoe', 'foo.git', {
+        'max-pack-size': 1000,
+        }))
+    child = subprocess.Popen(
+        args=['git', 'config', 'receive.maxinputsize'],
+        cwd=tmp,
+        env=env,
+        stdout=subprocess.PIPE,
+        )
+    got = child.communicate()[0]
+    eq(child.returncode, 0)
+    eq(got, '1000\n')
+
+def test_environment():
+    env = limits.environment('jdoe', 'foo.git', {
+        'max-pack-size': 1000,
+        'max-ref-updates': 3,
+        })
+    eq(env['GITOSIS_USER'], 'jdoe')
+    eq(env['GITOSIS_REPO'], 'foo.git')
+    eq(env['GITOSIS_MAX_REF_UPDATES'], '3')
+    assert env['GIT_CONFIG_PARAMETERS'].endswith(
+        "'receive.maxinputsize=1000'")
+    eq(limits.limitsFromEnvironment(env), {
+        'max-pack-size': 1000,
+        'max-ref-updates': 3,
+        })
+
+def test_check_push_refs():
+    updates = [('0'*40, '1'*40, 'refs/heads/a'),
+               ('0'*40, '2'*40, 'refs/heads/b')]
+    limits.check_push('.', updates, {'max-ref-updates': 2})
+    e = assert_raises(
+        limits.PushRejected,
+        limits.check_push,
+        '.', updates, {'max-ref-updates': 1},
+        )
+    eq(e.args[0], 'max-ref-updates')
+
+def _dangling_commit(path):
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg='big',
+        committer='Mr. Unit Test <unit.test@example.com>',
+        files=[('big', 'x' * 1000), ('small', 'y')],
+        )
+    child = subprocess.Popen(
+        args=['git', '--git-dir=%s' % path, 'rev-parse', 'HEAD'],
+        stdout=subprocess.PIPE,
+        )
+    sha1 = child.stdout.read().strip()
+    child.wait()
+    # pretend it was just pushed and no ref has it yet
+    subprocess.check_call(
+        args=['git', '--git-dir=%s' % path, 'update-ref', '-d',
+              'refs/heads/master'],
+        )
+    return sha1
+
+def test_find_large_blob():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repo.git')
+    sha1 = _dangling_commit(path)
+    (blob, size) = limits.find_large_blob(path, [sha1], 999)
+    eq(size, 1000)
+    eq(limits.find_large_blob(path, [sha1], 1000), None)
+
+def test_pre_receive_rejects_and_logs():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repo.git')
+    sha1 = _dangling_commit(path)
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'access-log', os.path.join(tmp, 'access.log'))
+    env = limits.environment('jdoe', 'repo.git', {'max-blob-size': 10})
+    fp = StringIO('%s %s refs/heads/master\n' % ('0'*40, sha1))
+    eq(limits.pre_receive(cfg, path, fp, env=env), False)
+    eq([(user, verb, repopath) for (when, user, verb, repopath)
+        in accesslog.read(cfg)],
+       [('jdoe', 'rejected-max-blob-size', 'repo.git')])
+
+def test_pre_receive_no_limits():
+    cfg = RawConfigParser()
+    eq(limits.pre_receive(cfg, '.', StringIO('junk\n'), env={}), True)
+
+def test_install_hook():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repo.git')
+    repository.init(path)
+    limits.install_hook(path)
+    hook = os.path.join(path, 'hooks', 'pre-receive')
+    eq(readFile(hook), limits.PRE_RECEIVE_HOOK)
+    assert os.access(hook, os.X_OK)
+
+def test_install_hook_keeps_custom():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repo.git')
+    repository.init(path)
+    hook = os.path.join(path, 'hooks', 'pre-receive')
+    f = file(hook, 'w')
+    f.write('#!/bin/sh\nexit 0\n')
+    f.close()
+    limits.install_hook(path)
+    eq(readFile(hook), '#!/bin/sh\nexit 0\n')
@@ -0,0 +1,113 @@
+from nose.tools import eq_ as eq, assert_raises
+
+import threading
+import time
+from ConfigParser import RawConfigParser
+
+from gitosis import parallel
+
+def _config(workers):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'workers', str(workers))
+    return cfg
+
+def test_getWorkers_default():
+    cfg = RawConfigParser()
+    eq(parallel.getWorkers(cfg), 4)
+
+def test_getWorkers_atLeastOne():
+    eq(parallel.getWorkers(_config(0)), 1)
+
+def test_map_order():
+    got = parallel.map(_config(3), lambda x: x * 2, range(20))
+    eq(got, [x * 2 for x in range(20)])
+
+def test_map_threads():
+    seen = set()
+    lock = threading.Lock()
+    def fn(x):
+        lock.acquire()
+        try:
+            seen.add(threading.currentThread().getName())
+        finally:
+            lock.release()
+        return x
+    parallel.map(_config(1), fn, range(5))
+    eq(seen, set([threading.currentThread().getName()]))
+
+def test_map_error():
+    done = []
+    def fn(x):
+        if x in [3, 7]:
+            raise ValueError(x)
+        done.append(x)
+    assert_raises(ValueError, parallel.map, _config(4), fn, range(10))
+    # every item was tried
+    eq(sorted(done), [0, 1, 2, 4, 5, 6, 8, 9])
+
+def test_run_stages():
+    got = parallel.run_stages(_config(2), [
+            ('one', lambda: 1),
+            ('two', lambda: 2),
+            ])
+    eq(got, dict(one=1, two=2))
+
+def test_run_stages_timings():
+    timings = {}
+    def fail():
+        raise RuntimeError('broken')
+    assert_raises(parallel.StageError, parallel.run_stages, _config(2), [
+            ('one', lambda: 1),
+            ('bad', fail),
+            ], timings)
+    eq(sorted(timings), ['bad', 'one'])
+    for seconds in timings.values():
+        assert seconds >= 0
+
+def test_run_stages_error():
+    done = []
+    def fail():
+        raise RuntimeError('broken')
+    try:
+        parallel.run_stages(_config(2), [
+                ('bad', fail),
+                ('good', lambda: done.append('good')),
+                ('worse', fail),
+                ])
+    except parallel.StageError, e:
+        eq(e.args, ('bad', 'worse'))
+        eq(str(e), 'Stages failed: bad, worse')
+    else:
+        raise AssertionError('expected StageError')
+    eq(done, ['good'])
+
+def test_run_stages_shared_workers():
+    cfg = _config(3)
+    lock = threading.Lock()
+    state = dict(running=0, most=0)
+    def fn(x):
+        lock.acquire()
+        try:
+            state['running'] += 1
+            state['most'] = max(state['most'], state['running'])
+        finally:
+            lock.release()
+        time.sleep(0.01)
+        lock.acquire()
+        try:
+            state['running'] -= 1
+        finally:
+            lock.release()
+        return x
+    def stage():
+        return parallel.map(cfg, fn, range(10))
+    got = parallel.run_stages(cfg, [
+            ('one', stage),
+            ('two', stage),
+            ('three', stage),
+            ('four', stage),
+            ])
+    eq(got['four'], range(10))
+    # not 3 stages times 3 threads each
+    eq(state['most'], 3)
@@ -0,0 +1,110 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import placement
+from gitosis import serve
+from gitosis import util
+from gitosis.test.util import maketemp, mkdir, writeFile
+
+def _config(tmp, roots):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    cfg.set('gitosis', 'repositories', repos)
+    if roots:
+        cfg.set('gitosis', 'repository-roots', ' '.join(roots))
+    return (cfg, repos)
+
+def test_choose_root_unconfigured():
+    cfg = RawConfigParser()
+    eq(placement.choose_root(cfg), None)
+
+def test_choose_root_skips_missing():
+    tmp = maketemp()
+    good = os.path.join(tmp, 'good')
+    mkdir(good)
+    (cfg, repos) = _config(tmp, [os.path.join(tmp, 'missing'), good])
+    eq(placement.choose_root(cfg, _inflight={}), good)
+
+def test_score_load():
+    weights = dict(space=1.0, inodes=0.5, load=0.5)
+    idle = placement.score(dict(space=0.5, inodes=0.5, load=0.0), weights)
+    busy = placement.score(dict(space=0.5, inodes=0.5, load=0.9), weights)
+    assert idle > busy
+
+def test_read_inflight():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'diskstats')
+    writeFile(path, """\
+   8       0 sda 1 2 3 4 5 6 7 8 3 10 11
+   8       1 sda1 1 2 3 4 5 6 7 8 0 10 11
+   7       0 loop0 junk
+""")
+    eq(placement.read_inflight(path), {(8, 0): 3, (8, 1): 0})
+
+def test_read_inflight_missing():
+    tmp = maketemp()
+    eq(placement.read_inflight(os.path.join(tmp, 'nope')), {})
+
+def test_auto_init_placed():
+    tmp = maketemp()
+    root = os.path.join(tmp, 'disk1')
+    mkdir(root)
+    (cfg, repos) = _config(tmp, [root])
+    serve.auto_init_repo(cfg, repos, 'foo/bar.git')
+    link = os.path.join(repos, 'foo', 'bar.git')
+    assert os.path.islink(link)
+    eq(os.path.realpath(link),
+       os.path.realpath(os.path.join(root, 'foo', 'bar.git')))
+    assert os.path.isfile(os.path.join(link, 'HEAD'))
+    eq(placement.find_root(cfg, link), os.path.realpath(root))
+
+def test_move_repo():
+    tmp = maketemp()
+    disk1 = os.path.join(tmp, 'disk1')
+    disk2 = os.path.join(tmp, 'disk2')
+    mkdir(disk1)
+    mkdir(disk2)
+    (cfg, repos) = _config(tmp, [disk1])
+    serve.auto_init_repo(cfg, repos, 'foo.git')
+    cfg.set('gitosis', 'repository-roots', '%s %s' % (disk1, disk2))
+    placement.move_repo(repos, 'foo.git', disk2)
+    link = os.path.join(repos, 'foo.git')
+    eq(placement.find_root(cfg, link), os.path.realpath(disk2))
+    assert os.path.isfile(os.path.join(link, 'HEAD'))
+    assert not os.path.exists(os.path.join(disk1, 'foo.git'))
+    got = list(placement.list_placed(cfg))
+    eq(got, [(os.path.realpath(disk2), repos, 'foo.git')])
+
+def test_rebalance():
+    tmp = maketemp()
+    disk1 = os.path.join(tmp, 'disk1')
+    disk2 = os.path.join(tmp, 'disk2')
+    mkdir(disk1)
+    mkdir(disk2)
+    (cfg, repos) = _config(tmp, [disk1])
+    for name in ['big.git', 'small.git']:
+        serve.auto_init_repo(cfg, repos, name)
+    writeFile(os.path.join(disk1, 'big.git', 'data'), 'x' * 200000)
+    cfg.set('gitosis', 'repository-roots', '%s %s' % (disk1, disk2))
+    big = util.diskUsage(os.path.join(disk1, 'big.git'))
+    small = util.diskUsage(os.path.join(disk1, 'small.git'))
+    capacity = 2 * (big + small)
+    stats = {
+        disk1: dict(space=0.2, inodes=1.0, load=0.0, bytes=capacity),
+        disk2: dict(space=0.2 + float(big) / capacity,
+                    inodes=1.0, load=0.0, bytes=capacity),
+        }
+    # moving big over would only swap the imbalance, small narrows it
+    got = placement.rebalance(cfg, threshold=0.0, dry_run=True,
+                              _stats=stats)
+    eq(got, [('small.git', os.path.realpath(disk1), os.path.realpath(disk2))])
+    got = placement.rebalance(cfg, threshold=0.0, _stats=stats)
+    eq(got, [('small.git', os.path.realpath(disk1), os.path.realpath(disk2))])
+    eq(placement.find_root(cfg, os.path.join(repos, 'small.git')),
+       os.path.realpath(disk2))
+    eq(placement.find_root(cfg, os.path.join(repos, 'big.git')),
+       os.path.realpath(disk1))
@@ -0,0 +1,95 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import pool
+from gitosis import serve
+from gitosis import gitdaemon
+from gitosis.test.util import check_mode, maketemp, mkdir, readFile, writeFile
+
+def _config(tmp, size):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.set('gitosis', 'init-pool-size', str(size))
+    return cfg
+
+def test_refill_disabled():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    eq(pool.refill(cfg), 0)
+    assert not os.path.exists(pool.pool_path(tmp))
+
+def test_refill():
+    tmp = maketemp()
+    cfg = _config(tmp, 2)
+    eq(pool.refill(cfg), 2)
+    got = os.listdir(pool.pool_path(tmp))
+    eq(len(got), 2)
+    for name in got:
+        assert not name.startswith('tmp-')
+        assert os.path.isfile(os.path.join(pool.pool_path(tmp), name, 'HEAD'))
+    # already full
+    eq(pool.refill(cfg), 0)
+
+def test_refill_leftover_entry():
+    tmp = maketemp()
+    cfg = _config(tmp, 3)
+    # from an earlier run by a process with our pid
+    leftover = os.path.join(pool.pool_path(tmp), '%d.0' % os.getpid())
+    mkdir(pool.pool_path(tmp))
+    mkdir(leftover, 0750)
+    writeFile(os.path.join(leftover, 'HEAD'), 'ref: refs/heads/master\n')
+    eq(pool.refill(cfg), 2)
+    got = os.listdir(pool.pool_path(tmp))
+    eq(len(got), 3)
+    for name in got:
+        check_mode(os.path.join(pool.pool_path(tmp), name), 0750)
+
+def test_refill_dry_run():
+    tmp = maketemp()
+    cfg = _config(tmp, 2)
+    eq(pool.refill(cfg, dry_run=True), 2)
+    assert not os.path.exists(pool.pool_path(tmp))
+
+def test_auto_init_takes_from_pool():
+    tmp = maketemp()
+    cfg = _config(tmp, 1)
+    pool.refill(cfg)
+    serve.auto_init_repo(cfg, tmp, 'foo/bar.git')
+    assert os.path.isfile(os.path.join(tmp, 'foo', 'bar.git', 'HEAD'))
+    eq(os.listdir(pool.pool_path(tmp)), [])
+    # empty pool falls back to git init
+    serve.auto_init_repo(cfg, tmp, 'baz.git')
+    assert os.path.isfile(os.path.join(tmp, 'baz.git', 'HEAD'))
+
+def test_pool_uses_template():
+    tmp = maketemp()
+    templatedir = os.path.join(
+        os.path.dirname(__file__),
+        'mocktemplates',
+        )
+    cfg = _config(tmp, 1)
+    cfg.set('gitosis', 'init-template', templatedir)
+    pool.refill(cfg)
+    serve.auto_init_repo(cfg, tmp, 'foo.git')
+    got = readFile(os.path.join(tmp, 'foo.git', 'no-confusion'))
+    eq(got, 'i should show up\n')
+
+def test_pool_skipped_for_other_mode():
+    tmp = maketemp()
+    cfg = _config(tmp, 1)
+    pool.refill(cfg)
+    cfg.add_section('repo foo')
+    cfg.set('repo foo', 'dirmode', '0700')
+    serve.auto_init_repo(cfg, tmp, 'foo.git')
+    eq(len(os.listdir(pool.pool_path(tmp))), 1)
+
+def test_walk_repos_ignores_pool():
+    tmp = maketemp()
+    cfg = _config(tmp, 1)
+    pool.refill(cfg)
+    eq(list(gitdaemon.walk_repos(cfg)), [])
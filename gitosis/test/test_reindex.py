@@ -0,0 +1,81 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import placement
+from gitosis import reindex
+from gitosis import repoindex
+from gitosis import repository
+from gitosis.test.util import maketemp, mkdir, readFile
+
+def _config(tmp):
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'repository-index', os.path.join(tmp, 'index'))
+    return (cfg, repos)
+
+def test_reindex_create():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    mkdir(os.path.join(repos, 'foo.git'))
+    mkdir(os.path.join(repos, 'sub'))
+    mkdir(os.path.join(repos, 'sub', 'bar.git'))
+    got = reindex.reindex(cfg)
+    eq(got, (['foo', 'sub/bar'], [], []))
+    eq(sorted(repoindex.read(cfg)), ['foo', 'sub/bar'])
+
+def test_reindex_repair():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    root = os.path.join(tmp, 'root')
+    mkdir(root)
+    cfg.set('gitosis', 'repository-roots', root)
+    mkdir(os.path.join(repos, 'foo.git'))
+    mkdir(os.path.join(root, 'moved.git'))
+    placement.link_placed(os.path.join(root, 'moved.git'), repos, 'moved.git')
+    repoindex.write(cfg, {
+            'foo': dict(root=None, created=5, pushed=7),
+            'moved': dict(root=None, created=5, pushed=None),
+            'gone': dict(root=None, created=5, pushed=None),
+            'new': dict(root=None, created=100, pushed=None),
+            })
+    got = reindex.reindex(cfg, _now=50)
+    eq(got, ([], ['gone'], ['moved']))
+    eq(repoindex.read(cfg), {
+            # times from the index are kept
+            'foo': dict(root=None, created=5, pushed=7),
+            'moved': dict(root=os.path.realpath(root), created=5,
+                          pushed=None),
+            # recorded after the walk started
+            'new': dict(root=None, created=100, pushed=None),
+            })
+
+def test_reindex_dryRun():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    mkdir(os.path.join(repos, 'foo.git'))
+    eq(reindex.reindex(cfg, dry_run=True), (['foo'], [], []))
+    eq(repoindex.read(cfg), None)
+
+def test_install_hooks():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    reindex.install_hooks(cfg)
+    hook = os.path.join(path, 'hooks', 'post-receive')
+    eq(readFile(hook), repoindex.POST_RECEIVE_HOOK)
+    assert os.access(hook, os.X_OK)
+
+def test_install_hooks_disabled():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.remove_option('gitosis', 'repository-index')
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    reindex.install_hooks(cfg)
+    assert not os.path.exists(os.path.join(path, 'hooks', 'post-receive'))
@@ -0,0 +1,122 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import gitdaemon
+from gitosis import inventory
+from gitosis import repoindex
+from gitosis.test.util import maketemp, mkdir, readFile, writeFile
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', os.path.join(tmp, 'repositories'))
+    cfg.set('gitosis', 'repository-index', os.path.join(tmp, 'index'))
+    return cfg
+
+def test_getIndexPath_default():
+    cfg = RawConfigParser()
+    eq(repoindex.getIndexPath(cfg), None)
+
+def test_record_noIndex():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    repoindex.record(cfg, 'create', 'foo.git', _now=10)
+    # only gitosis-reindex creates it
+    assert not os.path.exists(os.path.join(tmp, 'index'))
+    eq(repoindex.read(cfg), None)
+
+def test_record_read():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    root = os.path.join(tmp, 'root')
+    mkdir(root)
+    writeFile(os.path.join(tmp, 'index'), '')
+    repoindex.record(cfg, 'create', 'foo.git', _now=10)
+    repoindex.record(cfg, 'create', 'sub/bar.git', root=root, _now=11)
+    repoindex.record(cfg, 'push', 'foo.git', _now=12)
+    repoindex.record(cfg, 'push', 'foo.git', _now=13)
+    repoindex.record(cfg, 'create', 'gone.git', _now=14)
+    repoindex.record(cfg, 'remove', 'gone.git', _now=15)
+    repoindex.record(cfg, 'move', 'sub/bar.git', root=tmp, _now=16)
+    eq(repoindex.read(cfg), {
+            'foo': dict(root=None, created=10, pushed=13),
+            'sub/bar': dict(root=os.path.realpath(tmp), created=11,
+                            pushed=None),
+            })
+
+def test_read_pushUnknown():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    writeFile(os.path.join(tmp, 'index'), 'junk\n5\tpush\tfoo\t-\n')
+    eq(repoindex.read(cfg), {'foo': dict(root=None, created=5, pushed=5)})
+
+def test_write():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    entries = {
+        'foo': dict(root=None, created=10, pushed=13),
+        'bar': dict(root='/r', created=11, pushed=None),
+        }
+    repoindex.write(cfg, entries)
+    eq(readFile(os.path.join(tmp, 'index')),
+       '11\tcreate\tbar\t/r\n10\tcreate\tfoo\t-\n13\tpush\tfoo\t-\n')
+    eq(repoindex.read(cfg), entries)
+
+def test_read_compacts():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    path = os.path.join(tmp, 'index')
+    writeFile(path, '')
+    repoindex.record(cfg, 'create', 'foo.git', _now=10)
+    for i in range(repoindex.COMPACT_SLACK):
+        repoindex.record(cfg, 'push', 'foo.git', _now=11 + i)
+    # not worth it yet
+    eq(repoindex.read(cfg)['foo']['pushed'], 10 + repoindex.COMPACT_SLACK)
+    eq(len(readFile(path).splitlines()), repoindex.COMPACT_SLACK + 1)
+    repoindex.record(cfg, 'push', 'foo.git', _now=5000)
+    repoindex.record(cfg, 'push', 'foo.git', _now=5001)
+    entries = {'foo': dict(root=None, created=10, pushed=5001)}
+    eq(repoindex.read(cfg), entries)
+    eq(readFile(path), '10\tcreate\tfoo\t-\n5001\tpush\tfoo\t-\n')
+    eq(repoindex.read(cfg), entries)
+
+def test_compact_locked():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    writeFile(os.path.join(tmp, 'index'), '')
+    lockfile = repoindex.lock(cfg, exclusive=True)
+    try:
+        eq(repoindex.compact(cfg), False)
+    finally:
+        lockfile.close()
+
+def test_walk_repos_fromIndex():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    mkdir(os.path.join(repos, 'ondisk.git'))
+    eq(list(gitdaemon.walk_repos(cfg)), [(repos, 'ondisk.git', 'ondisk')])
+    repoindex.write(cfg, {
+            'sub/bar': dict(root=None, created=1, pushed=None),
+            'foo': dict(root=None, created=1, pushed=None),
+            })
+    eq(list(gitdaemon.walk_repos(cfg)), [
+            (repos, 'foo.git', 'foo'),
+            (os.path.join(repos, 'sub'), 'bar.git', 'sub/bar'),
+            ])
+    inv = inventory.Inventory(cfg)
+    eq(list(inv.walk()), list(gitdaemon.walk_repos(cfg)))
+    assert inv.exists('sub')
+    assert inv.is_repo('sub/bar.git')
+    assert not inv.is_repo('ondisk.git')
+
+def test_record_push():
+    tmp = maketemp()
+    cfg = _config(tmp)
+    writeFile(os.path.join(tmp, 'index'), '')
+    repoindex.record_push(cfg, env=dict(GITOSIS_REPO='foo.git'))
+    repoindex.record_push(cfg, env={})
+    eq(repoindex.read(cfg).keys(), ['foo'])
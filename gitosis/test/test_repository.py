@@ -354,3 +354,61 @@ def test_fast_import_parent():
         )
     eq(sorted(os.listdir(export)),
        sorted(['foo', 'quux']))
+
+def test_fast_import_stream_and_delete():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'repo.git')
+    repository.init(path=path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg='initial',
+        committer='Mr. Unit Test <unit.test@example.com>',
+        files=[
+            ('foo', 'bar\n'),
+            ('gone', 'soon\n'),
+            ],
+        )
+    source = os.path.join(tmp, 'source')
+    writeFile(source, 'streamed\n')
+    f = file(source)
+    try:
+        repository.fast_import(
+            git_dir=path,
+            commit_msg='another',
+            committer='Mr. Unit Test <unit.test@example.com>',
+            parent='refs/heads/master^0',
+            files=iter([('quux', f)]),
+            deletions=['gone'],
+            )
+    finally:
+        f.close()
+    export = os.path.join(tmp, 'export')
+    repository.export(
+        git_dir=path,
+        path=export,
+        )
+    eq(sorted(os.listdir(export)), ['foo', 'quux'])
+    eq(readFile(os.path.join(export, 'quux')), 'streamed\n')
+
+def test_ls_tree_and_cat_file():
+    tmp = maketemp()
+    git_dir = os.path.join(tmp, 'repo.git')
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='files',
+        files=[
+            ('foo', 'content'),
+            ('bar/quux', 'another'),
+            ],
+        )
+    got = repository.ls_tree(git_dir, ['foo', 'bar', 'missing'])
+    eq(sorted(got.keys()), ['bar', 'foo'])
+    got = repository.ls_tree(git_dir, ['bar'], recursive=True)
+    eq(got.keys(), ['bar/quux'])
+    catfile = repository.CatFile(git_dir)
+    eq(catfile.get(got['bar/quux']), ('blob', 'another'))
+    eq(catfile.get('HEAD:foo'), ('blob', 'content'))
+    assert_raises(repository.GitCatFileError, catfile.get, 'HEAD:missing')
+    catfile.close()
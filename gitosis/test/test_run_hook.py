@@ -1,11 +1,13 @@
 from nose.tools import eq_ as eq
 
 import os
+import shutil
 from ConfigParser import RawConfigParser
 from cStringIO import StringIO
 
-from gitosis import init, repository, run_hook
-from gitosis.test.util import maketemp, readFile
+from gitosis import confd, delta, init, parallel, repository, run_hook, serve, ssh
+from gitosis import tier
+from gitosis.test.util import maketemp, readFile, setup_admin, writeFile
 
 def test_post_update_simple():
     tmp = maketemp()
@@ -107,3 +109,415 @@ gitosis-admin: theadmin
     got = readFile(os.path.join(ssh, 'authorized_keys')).splitlines(True)
     assert 'command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding,no-agent-forwarding,no-pty ssh-somealgo 0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com\n' in got, \
         "SSH authorized_keys line for jdoe not found: %r" % got
+
+def _push_config(admin_repository, conf):
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='stuff',
+        parent='refs/heads/master^0',
+        files=[('gitosis.conf', conf)],
+        )
+
+def test_post_update_incremental():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    repository.init(path=os.path.join(repos, 'bar.git'))
+    _push_config(admin_repository, """\
+[repo foo]
+description = foo one
+
+[repo bar]
+description = bar one
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')),
+       'foo one\n')
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')),
+       'bar one\n')
+    authorized_keys = os.path.join(tmp, 'ssh', 'authorized_keys')
+    os.unlink(authorized_keys)
+
+    # scribble over bar; only foo changes, so bar must be left alone
+    writeFile(os.path.join(repos, 'bar.git', 'description'), 'local\n')
+    _push_config(admin_repository, """\
+[repo foo]
+description = foo two
+
+[repo bar]
+description = bar one
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')),
+       'foo two\n')
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')),
+       'local\n')
+    # keydir didn't change
+    assert not os.path.exists(authorized_keys)
+
+    # --full redoes everything
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository, full=True)
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')),
+       'bar one\n')
+    assert os.path.exists(authorized_keys)
+
+def test_post_update_removed_option():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    cfg.set('gitosis', 'htaccess', 'yes')
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    _push_config(admin_repository, """\
+[group g]
+writable = foo
+
+[repo foo]
+daemon = yes
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    htaccess = os.path.join(repos, 'foo.git', '.htaccess')
+    eq(readFile(htaccess), 'Require group g\n')
+    export_ok = os.path.join(repos, 'foo.git', 'git-daemon-export-ok')
+    assert os.path.exists(export_ok)
+
+    _push_config(admin_repository, """\
+[group g]
+
+[repo foo]
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    _push_config(admin_repository, """\
+[group g]
+
+[repo foo]
+
+[repo bar]
+description = unrelated
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(htaccess), 'Order allow,deny\nDeny from all\n')
+    assert not os.path.exists(export_ok)
+    # what is not in the admin repository is kept
+    eq(cfg.get('gitosis', 'htaccess'), 'yes')
+
+def test_post_update_nothing_changed():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    projects_list = os.path.join(tmp, 'generated', 'projects.list')
+    writeFile(projects_list, 'local\n')
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    # skipped entirely
+    eq(readFile(projects_list), 'local\n')
+
+def test_post_update_no_export():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    assert not os.path.exists(
+        os.path.join(admin_repository, 'gitosis-export'))
+    got = readFile(os.path.join(admin_repository, 'gitosis.conf'))
+    assert got.startswith('[gitosis]\n')
+
+def test_post_update_reads_changed_keys_only():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    cache_path = os.path.join(admin_repository, run_hook.KEY_CACHE)
+    cache = ssh.readKeyCache(cache_path)
+    eq(len(cache), 1)
+    # poison the cache; an unchanged blob must come from it
+    (sha1,) = cache.keys()
+    cache[sha1] = ['ssh-somealgo CACHED theadmin@fakehost']
+    ssh.writeKeyCache(cache_path, cache)
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='add jdoe',
+        parent='refs/heads/master^0',
+        files=[('keydir/jdoe.pub', 'ssh-somealgo NEWKEY== jdoe@host\n')],
+        )
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    got = readFile(os.path.join(tmp, 'ssh', 'authorized_keys'))
+    assert 'gitosis-serve theadmin",' in got
+    assert 'ssh-somealgo CACHED theadmin@fakehost' in got
+    assert 'ssh-somealgo NEWKEY== jdoe@host' in got
+
+def test_post_update_stage_error():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    os.rmdir(os.path.join(tmp, 'generated'))
+    try:
+        run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    except parallel.StageError, e:
+        eq(e.args, ('projects.list',))
+    else:
+        raise AssertionError('expected StageError')
+    # the other stages still ran
+    assert os.path.exists(os.path.join(tmp, 'ssh', 'authorized_keys'))
+    # but nothing is recorded as applied, so the next run retries
+    assert not os.path.exists(
+        os.path.join(admin_repository, delta.STATE_FILE))
+    os.mkdir(os.path.join(tmp, 'generated'))
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    assert os.path.exists(os.path.join(tmp, 'generated', 'projects.list'))
+
+def test_run_post_update_locked():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    lock = run_hook._try_lock(admin_repository)
+    try:
+        eq(run_hook.run_post_update(cfg=cfg, git_dir=admin_repository), 0)
+    finally:
+        lock.close()
+    # left for the run in progress
+    assert os.path.exists(
+        os.path.join(admin_repository, run_hook.DIRTY_FILE))
+    assert not os.path.exists(os.path.join(tmp, 'ssh', 'authorized_keys'))
+    eq(run_hook.run_post_update(cfg=cfg, git_dir=admin_repository), 1)
+    assert os.path.exists(os.path.join(tmp, 'ssh', 'authorized_keys'))
+    assert not os.path.exists(
+        os.path.join(admin_repository, run_hook.DIRTY_FILE))
+
+def test_run_post_update_coalesce():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    calls = []
+    real_post_update = run_hook.post_update
+    def post_update(cfg, git_dir, full=False):
+        calls.append(full)
+        if len(calls) == 1:
+            # three more pushes while the first run is going
+            for full in [False, True, False]:
+                eq(run_hook.run_post_update(cfg, git_dir, full=full), 0)
+        real_post_update(cfg, git_dir, full=full)
+    run_hook.post_update = post_update
+    try:
+        eq(run_hook.run_post_update(cfg=cfg, git_dir=admin_repository), 2)
+    finally:
+        run_hook.post_update = real_post_update
+    # one more run for all of them, full as one asked for it
+    eq(calls, [False, True])
+
+def test_apply_keys():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    authorized_keys = os.path.join(tmp, 'ssh', 'authorized_keys')
+    eq(run_hook.apply_keys(cfg=cfg, git_dir=admin_repository), True)
+    assert os.path.exists(authorized_keys)
+    # no state yet; the first full run is still due
+    assert not os.path.exists(
+        os.path.join(admin_repository, delta.STATE_FILE))
+    assert not os.path.exists(os.path.join(tmp, 'generated', 'projects.list'))
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    commit = repository.rev_parse(admin_repository)
+    eq(delta.readState(admin_repository)['commit'], commit)
+    eq(run_hook.apply_keys(cfg=cfg, git_dir=admin_repository), False)
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='add jdoe',
+        parent='refs/heads/master^0',
+        files=[('keydir/jdoe.pub', 'ssh-somealgo NEWKEY== jdoe@host\n')],
+        )
+    eq(run_hook.apply_keys(cfg=cfg, git_dir=admin_repository), True)
+    assert 'ssh-somealgo NEWKEY== jdoe@host' in readFile(authorized_keys)
+    # the rest of the push is still to be applied
+    eq(delta.readState(admin_repository)['commit'], commit)
+
+def test_post_update_dry_run():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    _push_config(admin_repository, """\
+[repo foo]
+description = foo one
+""")
+    stats = run_hook.post_update(cfg=cfg, git_dir=admin_repository,
+                                 dry_run=True)
+    eq([stat['stage'] for stat in stats],
+       ['setup'] + run_hook.STAGES + ['total'])
+    got = dict((stat['stage'], stat) for stat in stats)
+    eq(got['descriptions']['written'], 1)
+    eq(got['projects.list']['written'], 1)
+    eq(got['authorized_keys']['written'], 1)
+    eq(got['total']['written'], sum(
+            [got[name]['written'] for name in run_hook.STAGES]))
+    # nothing was touched
+    eq(os.listdir(os.path.join(tmp, 'generated')), [])
+    eq(os.listdir(os.path.join(tmp, 'ssh')), [])
+    assert readFile(os.path.join(repos, 'foo.git', 'description')) != (
+        'foo one\n')
+    assert not os.path.exists(
+        os.path.join(admin_repository, delta.STATE_FILE))
+    assert not os.path.exists(
+        os.path.join(admin_repository, 'gitosis.conf'))
+
+    stats = run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    got = dict((stat['stage'], stat) for stat in stats)
+    eq(got['descriptions']['written'], 1)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')),
+       'foo one\n')
+    # a full run now finds everything in place
+    stats = run_hook.post_update(cfg=cfg, git_dir=admin_repository,
+                                 full=True, dry_run=True)
+    got = dict((stat['stage'], stat) for stat in stats)
+    eq(got['total']['written'], 0)
+    assert got['total']['examined'] > 0
+
+def test_format_stats():
+    eq(run_hook.format_stats(dict(stage='hooks', seconds=0.12345,
+                                  examined=3, written=1)),
+       'stage=hooks seconds=0.123 examined=3 written=1')
+
+def test_post_update_confd():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    repository.init(path=os.path.join(repos, 'bar.git'))
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='split config',
+        parent='refs/heads/master^0',
+        files=[
+            ('conf.d/foo.conf', '[repo foo]\ndescription = foo one\n'),
+            ('conf.d/bar.conf', '[repo bar]\ndescription = bar one\n'),
+            ],
+        )
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')),
+       'foo one\n')
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')),
+       'bar one\n')
+    # the merged config is exported for gitosis-serve
+    exported = RawConfigParser()
+    exported.read(os.path.join(admin_repository, 'gitosis.conf'))
+    eq(exported.get('repo foo', 'description'), 'foo one')
+    assert exported.has_section('group gitosis-admin')
+
+    # only the changed fragment affects anything
+    writeFile(os.path.join(repos, 'bar.git', 'description'), 'local\n')
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='change foo',
+        parent='refs/heads/master^0',
+        files=[
+            ('conf.d/foo.conf', '[repo foo]\ndescription = foo two\n'),
+            ],
+        )
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')),
+       'foo two\n')
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')),
+       'local\n')
+    # old fragment versions are dropped from the cache
+    eq(len(os.listdir(os.path.join(admin_repository, confd.CACHE_DIR))), 3)
+
+def test_post_update_delegate():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    os.mkdir(os.path.join(repos, 'web'))
+    repository.init(path=os.path.join(repos, 'web', 'site.git'))
+    repository.init(path=os.path.join(repos, 'secret.git'))
+    web_admin = os.path.join(repos, 'web-admin.git')
+    repository.init(path=web_admin)
+    _push_config(admin_repository, """\
+[delegate web]
+admin = web-admin
+repos = web/*
+groups = web-devs
+
+[repo secret]
+description = secret
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    # the delegated admin repository gets the hook
+    got = readFile(os.path.join(web_admin, 'hooks', 'post-update'))
+    assert 'gitosis-run-hook post-update' in got
+
+    # only the repositories of the delegation are regenerated
+    writeFile(os.path.join(repos, 'secret.git', 'description'), 'local\n')
+    repository.fast_import(
+        git_dir=web_admin,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='web config',
+        files=[('gitosis.conf', """\
+[repo web/site]
+description = the site
+
+[repo secret]
+description = mine now
+
+[group web-devs]
+members = jdoe
+writable = web/site secret
+""")],
+        )
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'web', 'site.git', 'description')),
+       'the site\n')
+    eq(readFile(os.path.join(repos, 'secret.git', 'description')),
+       'local\n')
+    eq(cfg.get('group web-devs', 'writable'), 'web/site')
+    state = delta.readState(admin_repository)
+    assert 'delegate.web' in state
+    exported = RawConfigParser()
+    exported.read(os.path.join(admin_repository, 'gitosis.conf'))
+    eq(exported.get('repo web/site', 'description'), 'the site')
+    eq(exported.get('repo secret', 'description'), 'secret')
+
+def test_post_update_delegate_keeps_main():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    os.mkdir(os.path.join(repos, 'web'))
+    repository.init(path=os.path.join(repos, 'web', 'site.git'))
+    web_admin = os.path.join(repos, 'web-admin.git')
+    repository.init(path=web_admin)
+    _push_config(admin_repository, """\
+[delegate web]
+admin = web-admin
+repos = web/*
+
+[repo web/site]
+description = from the main config
+""")
+    repository.fast_import(
+        git_dir=web_admin,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='web config',
+        files=[('gitosis.conf', """\
+[repo web/site]
+description = from the slice
+owner = web people
+""")],
+        )
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    eq(readFile(os.path.join(repos, 'web', 'site.git', 'description')),
+       'from the main config\n')
+    eq(cfg.get('repo web/site', 'owner'), 'web people')
+
+def test_post_update_keeps_archived():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    cfg.set('gitosis', 'init-on-config', 'yes')
+    cfg.set('gitosis', 'archive-dir', os.path.join(tmp, 'archive'))
+    path = os.path.join(repos, 'cold.git')
+    repository.init(path=path)
+    writeFile(os.path.join(path, 'description'), 'keep me\n')
+    tier.archive(cfg, repos, 'cold.git')
+    _push_config(admin_repository, """\
+[repo cold]
+daemon = yes
+""")
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository, full=True)
+    # not recreated empty in place of the archive
+    assert not os.path.exists(path)
+    assert tier.is_archived(cfg, 'cold.git')
+    cfg.add_section('group coldies')
+    cfg.set('group coldies', 'members', 'jdoe')
+    cfg.set('group coldies', 'readonly', 'cold')
+    serve.serve(cfg=cfg, user='jdoe', command="git-upload-pack 'cold'")
+    eq(readFile(os.path.join(path, 'description')), 'keep me\n')
+    assert not tier.is_archived(cfg, 'cold.git')
@@ -8,6 +8,7 @@ from ConfigParser import RawConfigParser
 
 from gitosis import serve
 from gitosis import repository
+from gitosis import repoindex
 
 from gitosis.test import util
 
@@ -318,6 +319,37 @@ def test_push_inits_if_needed():
     eq(os.listdir(repositories), ['foo.git'])
     assert os.path.isfile(os.path.join(repositories, 'foo.git', 'HEAD'))
 
+def test_push_inits_records_index():
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    cfg.set('gitosis', 'repositories', repositories)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    index = os.path.join(tmp, 'index')
+    util.writeFile(index, '')
+    cfg.set('gitosis', 'repository-index', index)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'writable', 'foo')
+    old_environ = dict(os.environ)
+    try:
+        serve.serve(
+            cfg=cfg,
+            user='jdoe',
+            command="git-receive-pack 'foo'",
+            )
+        eq(os.environ['GITOSIS_REPO'], 'foo.git')
+    finally:
+        os.environ.clear()
+        os.environ.update(old_environ)
+    eq(repoindex.read(cfg).keys(), ['foo'])
+    assert os.path.exists(
+        os.path.join(repositories, 'foo.git', 'hooks', 'post-receive'))
+
 def test_push_inits_if_needed_haveExtension():
     # a push to a non-existent repository (but where config authorizes
     # you to do that) will create the repository on the fly
@@ -641,3 +673,42 @@ def test_typo_writeable():
         "Repository 'foo' config has typo \"writeable\", shou"
         +"ld be \"writable\"\n",
         )
+
+def _auth_info(tmp, cert):
+    path = os.path.join(tmp, 'auth_info')
+    util.writeFile(
+        path,
+        'publickey ssh-ed25519-cert-v01@openssh.com %s\n' % cert)
+    return path
+
+def test_certificate_user():
+    from gitosis.test.test_ssh import CERT
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    got = serve.certificate_user(cfg=cfg, auth_info=_auth_info(tmp, CERT))
+    eq(got, 'alice')
+
+def test_certificate_user_otherGate():
+    from gitosis.test.test_ssh import CERT
+    tmp = util.maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'ssh-ca-principal', 'git')
+    # both gitosis and alice are left, which is ambiguous
+    e = assert_raises(
+        serve.CertificateUserError,
+        serve.certificate_user,
+        cfg=cfg,
+        auth_info=_auth_info(tmp, CERT),
+        )
+    eq(str(e), 'Cannot determine user from SSH certificate')
+    assert isinstance(e, serve.ServingError)
+
+def test_certificate_user_noAuthInfo():
+    cfg = RawConfigParser()
+    assert_raises(
+        serve.CertificateUserError,
+        serve.certificate_user,
+        cfg=cfg,
+        auth_info=None,
+        )
@@ -23,6 +23,22 @@ ZwIAo7y/BU7cD3Y9UdVZykG34NiijHZLlCBo/TnobXjFIPXvFbfgQ3y8g+akwocFVcQ= f
 roop@snoop
 """)
 
+CA_KEY = ('ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIF4HJTUe6oCoKYGTTXmi2cNuL'
+          +'tIVSOrtcYBO1whc3hgE ca')
+
+# ssh-keygen -s ca -I alice -n gitosis,alice -V always:forever
+CERT = _key("""
+AAAAIHNzaC1lZDI1NTE5LWNlcnQtdjAxQG9wZW5zc2guY29tAAAAIDTfzEexBpc0P66ingO
+ORr7enF6i5wXpOy8PhIfHpW/PAAAAIEGbCuXqpu6c0I4D2Kn0LhelXhbSEkjAeWiJ2EdAw8
+GHAAAAAAAAAAAAAAABAAAABWFsaWNlAAAAFAAAAAdnaXRvc2lzAAAABWFsaWNlAAAAAAAAA
+AD//////////wAAAAAAAACCAAAAFXBlcm1pdC1YMTEtZm9yd2FyZGluZwAAAAAAAAAXcGVy
+bWl0LWFnZW50LWZvcndhcmRpbmcAAAAAAAAAFnBlcm1pdC1wb3J0LWZvcndhcmRpbmcAAAA
+AAAAACnBlcm1pdC1wdHkAAAAAAAAADnBlcm1pdC11c2VyLXJjAAAAAAAAAAAAAAAzAAAAC3
+NzaC1lZDI1NTE5AAAAIF4HJTUe6oCoKYGTTXmi2cNuLtIVSOrtcYBO1whc3hgEAAAAUwAAA
+Atzc2gtZWQyNTUxOQAAAED980tNpZsqCKgzESuIddccGoatmIagtbW8NnwNIvJeO8eXA+SM
+PXIfOjP7HKrLUCoqVWlZASa4sm9C72J/nVUH
+""")
+
 class ReadKeys_Test(object):
     def test_empty(self):
         tmp = maketemp()
@@ -98,6 +114,62 @@ class ReadKeys_Test(object):
             ('jdoe', KEY_2),
             ]))
 
+    def test_subdirectories(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'nested')
+        mkdir(keydir)
+        mkdir(os.path.join(keydir, 'team'))
+        mkdir(os.path.join(keydir, '.hidden'))
+        writeFile(os.path.join(keydir, 'team', 'jdoe.pub'), KEY_1+'\n')
+        writeFile(os.path.join(keydir, '.hidden', 'wsmith.pub'), KEY_2+'\n')
+
+        got = frozenset(ssh.readKeys(keydir=keydir))
+        eq(got, frozenset([('jdoe', KEY_1)]))
+
+    def test_malformed(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'malformed')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'),
+                  '# comment\n\n'
+                  +'no-pty %s\n' % KEY_1
+                  +'ssh-rsa not"base64 x\n'
+                  +'  %s  \r\n' % KEY_2.replace(' ', '   '))
+
+        got = list(ssh.readKeys(keydir=keydir))
+        eq(got, [('jdoe', KEY_2)])
+
+class KeyCache_Test(object):
+    def test_roundtrip(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'cache')
+        cache = {'a'*40: [KEY_1, KEY_2], 'b'*40: []}
+        ssh.writeKeyCache(path, cache)
+        eq(ssh.readKeyCache(path), cache)
+
+    def test_oldVersion(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'cache')
+        writeFile(path, '%s %s\n' % ('a'*40, KEY_1))
+        eq(ssh.readKeyCache(path), {})
+
+class ReadKeysFromTree_Test(object):
+    def test_subdirectories(self):
+        class FakeCatFile(object):
+            def get(self, sha1):
+                return ('blob', blobs[sha1])
+        blobs = {'1': KEY_1+'\n', '2': KEY_2+'\n', '3': 'junk\n'}
+        entries = {
+            'keydir/a/jdoe.pub': '1',
+            'keydir/b/c/wsmith.pub': '2',
+            'keydir/.old/wsmith.pub': '1',
+            'keydir/bad.pub': '3',
+            'other/jdoe.pub': '2',
+            }
+        (keys, cache) = ssh.readKeysFromTree(entries, FakeCatFile(), {})
+        eq(keys, [('jdoe', KEY_1), ('wsmith', KEY_2)])
+        eq(cache, {'1': [KEY_1], '2': [KEY_2], '3': []})
+
 class GenerateAuthorizedKeys_Test(object):
     def test_simple(self):
         def k():
@@ -113,6 +185,20 @@ class GenerateAuthorizedKeys_Test(object):
             +'-forwarding,no-agent-forwarding,no-pty %s' % KEY_2))
         assert_raises(StopIteration, gen.next)
 
+    def test_ca(self):
+        gen = ssh.generateAuthorizedKeys(
+            [('jdoe', KEY_1)],
+            ca_keys=[CA_KEY],
+            ca_principal='gitosis',
+            )
+        eq(gen.next(), ssh.COMMENT)
+        gen.next()
+        eq(gen.next(), (
+            'cert-authority,principals="gitosis",command="gitosis-serve'
+            +' --certificate",no-port-forwarding,no-X11-forwarding,'
+            +'no-agent-forwarding,no-pty %s' % CA_KEY))
+        assert_raises(StopIteration, gen.next)
+
 
 class FilterAuthorizedKeys_Test(object):
     def run(self, s):
@@ -158,6 +244,13 @@ g,no-agent-forwarding,no-pty %(key_1)s
         got = self.run(s)
         eq(got, '')
 
+    def test_filter_ca(self):
+        got = self.run(
+            'cert-authority,principals="gitosis",command="/usr/bin/gitosis-serve'
+            +' --certificate",no-port-forwarding,no-X11-forwarding,'
+            +'no-agent-forwarding,no-pty %s\n' % CA_KEY)
+        eq(got, '')
+
     def test_filter_withPath(self):
         s = '''\
 command="/foo/bar/baz/gitosis-serve wsmith",no-port-forwarding,no-X11-forwardin\
@@ -199,3 +292,85 @@ baz
 command="gitosis-serve jdoe",no-port-forwarding,\
 no-X11-forwarding,no-agent-forwarding,no-pty %(key_1)s
 ''' % dict(key_1=KEY_1))
+
+    def test_unchanged(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'authorized_keys')
+        keys = [('jdoe', KEY_1)]
+        eq(ssh.writeAuthorizedKeys(path=path, keys=keys), True)
+        before = os.stat(path)
+        eq(ssh.writeAuthorizedKeys(path=path, keys=keys), False)
+        eq(os.stat(path).st_ino, before.st_ino)
+        eq(ssh.writeAuthorizedKeys(path=path, keys=[('jdoe', KEY_2)]), True)
+        assert KEY_2 in readFile(path)
+
+class KeyIndex_Test(object):
+    def test_fingerprint(self):
+        # same as ssh-keygen -l -E sha256 would print
+        eq(ssh.fingerprint('AAAAC3NzaC1lZDI1NTE5AAAAIHKIIu65rPRQTHYCkmv01lPh78Y16vsC0Q+XrCmPsGR9'),
+           'SHA256:u9j1fFV/gx73kpuHmbrkOIsWKujkSD6OxS/oDvTM8+k')
+
+    def test_keyFingerprint_options(self):
+        eq(ssh.keyFingerprint('from="10.0.0.1" ' + KEY_1),
+           ssh.keyFingerprint(KEY_1))
+
+    def test_keyFingerprint_none(self):
+        eq(ssh.keyFingerprint('garbage'), None)
+
+    def test_lookup(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'index')
+        ssh.writeKeyIndex(path, [('jdoe', KEY_1), ('wsmith', KEY_2)])
+        (keytype, blob) = KEY_2.split()[:2]
+        got = list(ssh.lookupKeyIndex(path, keytype, blob))
+        eq(got, [
+            'command="gitosis-serve wsmith",no-port-forwarding,'
+            +'no-X11-forwarding,no-agent-forwarding,no-pty %s' % KEY_2,
+            ])
+
+    def test_lookup_wrong_type(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'index')
+        ssh.writeKeyIndex(path, [('jdoe', KEY_1)])
+        blob = KEY_1.split()[1]
+        eq(list(ssh.lookupKeyIndex(path, 'ssh-dss', blob)), [])
+
+    def test_lookup_missing(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'index')
+        ssh.writeKeyIndex(path, [('jdoe', KEY_1)])
+        blob = KEY_2.split()[1]
+        eq(list(ssh.lookupKeyIndex(path, 'ssh-rsa', blob)), [])
+
+
+class Certificate_Test(object):
+    def test_parse(self):
+        got = ssh.parseCertificate(CERT)
+        eq(got['type'], 'ssh-ed25519-cert-v01@openssh.com')
+        eq(got['cert_type'], ssh.SSH_CERT_TYPE_USER)
+        eq(got['key_id'], 'alice')
+        eq(got['principals'], ['gitosis', 'alice'])
+
+    def test_parse_notCert(self):
+        assert_raises(
+            ssh.CertificateError,
+            ssh.parseCertificate,
+            KEY_1.split()[1],
+            )
+
+    def test_parse_truncated(self):
+        assert_raises(
+            ssh.CertificateError,
+            ssh.parseCertificate,
+            CERT[:120],
+            )
+
+    def test_readAuthInfo(self):
+        f = StringIO(
+            'publickey ssh-ed25519 AAAAfoo\n'
+            +'publickey ssh-ed25519-cert-v01@openssh.com %s\n' % CERT)
+        eq(ssh.readAuthInfoCertificate(f), CERT)
+
+    def test_readAuthInfo_noCert(self):
+        f = StringIO('publickey ssh-ed25519 AAAAfoo\n')
+        eq(ssh.readAuthInfoCertificate(f), None)
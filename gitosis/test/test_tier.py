@@ -0,0 +1,109 @@
+from nose.tools import eq_ as eq
+
+import os
+import time
+from ConfigParser import RawConfigParser
+
+from gitosis import accesslog
+from gitosis import repository
+from gitosis import serve
+from gitosis import tier
+from gitosis.test.util import maketemp, mkdir, readFile, writeFile
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    archive = os.path.join(tmp, 'archive')
+    mkdir(archive)
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'archive-dir', archive)
+    cfg.set('gitosis', 'access-log', os.path.join(tmp, 'access.log'))
+    cfg.set('gitosis', 'cold-after', '30')
+    return (cfg, repos)
+
+def test_find_cold():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    repository.init(os.path.join(repos, 'foo.git'))
+    repository.init(os.path.join(repos, 'bar.git'))
+    repository.init(os.path.join(repos, 'gitosis-admin.git'))
+    later = time.time() + 60 * 24 * 60 * 60
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'bar.git', _now=later)
+    got = [repopath for (repopath, last, size)
+           in tier.find_cold(cfg, _now=later + 1)]
+    eq(got, ['foo.git'])
+    # nothing is cold yet
+    eq(list(tier.find_cold(cfg)), [])
+
+def test_find_cold_min_size():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    repository.init(os.path.join(repos, 'foo.git'))
+    cfg.set('gitosis', 'archive-min-size', str(1024 * 1024 * 1024))
+    later = time.time() + 60 * 24 * 60 * 60
+    eq(list(tier.find_cold(cfg, _now=later)), [])
+
+def test_archive_restore():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo', 'bar.git')
+    mkdir(os.path.join(repos, 'foo'))
+    repository.init(path)
+    writeFile(os.path.join(path, 'description'), 'hello\n')
+    tier.archive(cfg, repos, 'foo/bar.git')
+    assert not os.path.exists(path)
+    eq(os.listdir(os.path.join(repos, 'foo')), [])
+    assert tier.is_archived(cfg, 'foo/bar.git')
+
+    eq(tier.restore(cfg, repos, 'foo/bar.git'), True)
+    eq(readFile(os.path.join(path, 'description')), 'hello\n')
+    assert not tier.is_archived(cfg, 'foo/bar.git')
+    # already there
+    eq(tier.restore(cfg, repos, 'foo/bar.git'), False)
+
+def test_serve_restores():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    writeFile(os.path.join(path, 'description'), 'hello\n')
+    tier.archive(cfg, repos, 'foo.git')
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'readonly', 'foo')
+    got = serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-upload-pack 'foo'",
+        )
+    eq(got, "git-upload-pack '%s/foo.git'" % repos)
+    eq(readFile(os.path.join(path, 'description')), 'hello\n')
+    eq([(user, verb, repopath) for (when, user, verb, repopath)
+        in accesslog.read(cfg)],
+       [('jdoe', 'git-upload-pack', 'foo.git')])
+
+def test_lock_repo_creates_archive_dir():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.set('gitosis', 'archive-dir', os.path.join(tmp, 'fresh'))
+    repository.init(os.path.join(repos, 'foo.git'))
+    tier.archive(cfg, repos, 'foo.git')
+    assert tier.is_archived(cfg, 'foo.git')
+
+def test_archive_in_use():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    path = os.path.join(repos, 'foo.git')
+    repository.init(path)
+    since = time.time()
+    last_access = accesslog.LastAccess(cfg)
+    eq(list(tier.find_cold(cfg, last_access=last_access)), [])
+    # a request let in after the scan
+    accesslog.record(cfg, 'jdoe', 'git-receive-pack', 'foo.git')
+    eq(tier.archive(cfg, repos, 'foo.git', since=since,
+                    last_access=last_access), 0)
+    assert os.path.isdir(path)
+    assert not tier.is_archived(cfg, 'foo.git')
+    eq(os.listdir(os.path.join(tmp, 'archive')), ['foo.git.tar.gz.lock'])
@@ -0,0 +1,106 @@
+from nose.tools import eq_ as eq, assert_raises
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import gitdaemon, placement, repository, trash
+from gitosis.test.util import maketemp, mkdir, readFile, writeFile
+
+def _config(tmp, roots=None):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    cfg.set('gitosis', 'repositories', repos)
+    if roots:
+        cfg.set('gitosis', 'repository-roots', ' '.join(roots))
+    return (cfg, repos)
+
+def test_remove_restore():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    mkdir(os.path.join(repos, 'team'))
+    repository.init(path=os.path.join(repos, 'team', 'foo.git'))
+    writeFile(os.path.join(repos, 'team', 'foo.git', 'marker'), 'x')
+    entry = trash.remove(cfg, repos, 'team/foo', _now=100)
+    assert not os.path.exists(os.path.join(repos, 'team', 'foo.git'))
+    eq(list(gitdaemon.walk_tree(cfg)), [])
+    eq(trash.entries(cfg), [(100, repos, entry, 'team/foo.git')])
+    trash.restore(cfg, repos, 'team/foo.git')
+    eq(readFile(os.path.join(repos, 'team', 'foo.git', 'marker')), 'x')
+    eq(trash.entries(cfg), [])
+
+def test_remove_same_second():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    for name in ['a', 'b', 'c']:
+        repository.init(path=os.path.join(repos, '%s.git' % name))
+        trash.remove(cfg, repos, name, _now=100)
+    eq([origin for (when, base, entry, origin) in trash.entries(cfg)],
+       ['a.git', 'b.git', 'c.git'])
+    trash.restore(cfg, repos, 'b')
+    assert os.path.isdir(os.path.join(repos, 'b.git'))
+
+def test_remove_missing():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    assert_raises(trash.TrashError, trash.remove, cfg, repos, 'nope')
+    assert_raises(trash.TrashError, trash.restore, cfg, repos, 'nope')
+
+def test_restore_exists():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    trash.remove(cfg, repos, 'foo')
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    assert_raises(trash.TrashError, trash.restore, cfg, repos, 'foo')
+
+def test_remove_placed():
+    tmp = maketemp()
+    root = os.path.join(tmp, 'root')
+    mkdir(root)
+    (cfg, repos) = _config(tmp, [root])
+    repository.init(path=os.path.join(root, 'foo.git'))
+    placement.link_placed(os.path.join(root, 'foo.git'), repos, 'foo.git')
+    trash.remove(cfg, repos, 'foo')
+    # trashed on its own root, the link is gone
+    assert not os.path.lexists(os.path.join(repos, 'foo.git'))
+    eq([base for (when, base, entry, origin) in trash.entries(cfg)], [root])
+    trash.restore(cfg, repos, 'foo')
+    assert os.path.islink(os.path.join(repos, 'foo.git'))
+    eq(os.path.realpath(os.path.join(repos, 'foo.git')),
+       os.path.realpath(os.path.join(root, 'foo.git')))
+
+def test_reap():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    cfg.set('gitosis', 'trash-grace', '1')
+    for name in ['old', 'new']:
+        repository.init(path=os.path.join(repos, '%s.git' % name))
+    trash.remove(cfg, repos, 'old', _now=1000)
+    trash.remove(cfg, repos, 'new', _now=1000 + 24 * 60 * 60)
+    throttle = trash.Throttle(0)
+    eq(trash.reap(cfg, _now=1000 + 24 * 60 * 60, _throttle=throttle)[0], 1)
+    assert throttle.spent > 0
+    eq([origin for (when, base, entry, origin) in trash.entries(cfg)],
+       ['new.git'])
+    # a half reaped entry is finished off, and not restorable
+    entry = os.path.join(trash.trash_path(repos), '5.5.reaping')
+    mkdir(entry)
+    writeFile(os.path.join(entry, 'origin'), 'gone.git\n')
+    eq(trash.reap(cfg, _now=0)[0], 1)
+    assert not os.path.exists(entry)
+
+def test_throttle():
+    now = [0.0]
+    slept = []
+    def _sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+    throttle = trash.Throttle(100, _time=lambda: now[0], _sleep=_sleep)
+    throttle.spend(50)
+    throttle.spend(50)
+    eq(sum(slept), 1.0)
+    now[0] += 5
+    throttle.spend(100)
+    eq(sum(slept), 1.0)
@@ -0,0 +1,102 @@
+from nose.tools import eq_ as eq
+
+import os
+import subprocess
+from ConfigParser import RawConfigParser
+
+from gitosis import accesslog
+from gitosis import repository
+from gitosis import warm
+from gitosis.test.util import assert_raises, maketemp, mkdir
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'access-log', os.path.join(tmp, 'access.log'))
+    return (cfg, repos)
+
+def _repo(path):
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg='foo initial bar',
+        committer='Mr. Unit Test <unit.test@example.com>',
+        files=[('foo', 'bar\n')],
+        )
+    subprocess.check_call(
+        args=['git', '--git-dir=.', 'repack', '-a', '-d', '-b', '-q'],
+        cwd=path,
+        )
+
+def test_rank_repos():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    now = 1000000
+    for (when, repopath) in [(now, 'foo.git'),
+                             (now, 'bar.git'),
+                             (now, 'bar.git'),
+                             (1, 'old.git')]:
+        accesslog.record(cfg, 'jdoe', 'git-upload-pack', repopath,
+                         _now=when)
+    eq(warm.rank_repos(cfg, _now=now), ['bar.git', 'foo.git'])
+
+def test_pack_files_order():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo.git')
+    _repo(path)
+    got = [os.path.splitext(p)[1] for (p, size) in warm.pack_files(path)]
+    eq(got, ['.idx', '.bitmap', '.pack'])
+
+def test_pack_files_missing():
+    tmp = maketemp()
+    eq(list(warm.pack_files(os.path.join(tmp, 'nope.git'))), [])
+
+def test_warm():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    _repo(os.path.join(repos, 'foo.git'))
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git')
+    (files, warmed, working_set, in_cache) = warm.warm(cfg)
+    eq(files, 3)
+    eq(warmed, working_set)
+    if in_cache is not None:
+        assert 0 < in_cache <= working_set
+
+def test_warm_budget():
+    tmp = maketemp()
+    (cfg, repos) = _config(tmp)
+    _repo(os.path.join(repos, 'foo.git'))
+    accesslog.record(cfg, 'jdoe', 'git-upload-pack', 'foo.git')
+    (files, warmed, working_set, in_cache) = warm.warm(cfg, budget=0)
+    eq(files, 0)
+    eq(warmed, 0)
+    assert working_set > 0
+
+def test_getBudget():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    eq(warm.getBudget(cfg), 256 * 1024 * 1024)
+    cfg.set('gitosis', 'warm-budget', '64m')
+    eq(warm.getBudget(cfg), 64 * 1024 * 1024)
+    cfg.set('gitosis', 'warm-budget', 'lots')
+    eq(warm.getBudget(cfg), 256 * 1024 * 1024)
+
+def test_main_budget_suffix():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', os.path.join(tmp, 'repositories'))
+    cfg.set('gitosis', 'access-log', os.path.join(tmp, 'access.log'))
+    app = warm.Main()
+    parser = app.create_parser()
+    (options, args) = parser.parse_args(['--budget', '512M'])
+    cwd = os.getcwd()
+    try:
+        app.handle_args(parser, cfg, options, args)
+    finally:
+        os.chdir(cwd)
+    (options, args) = parser.parse_args(['--budget', 'lots'])
+    assert_raises(SystemExit, app.handle_args, parser, cfg, options, args)
@@ -0,0 +1,90 @@
+from nose.tools import eq_ as eq
+
+import os
+
+from gitosis import delta, repository, spool, worker
+from gitosis.test.util import assert_raises, maketemp, setup_admin, writeFile
+
+def test_pending_empty():
+    tmp = maketemp()
+    eq(spool.pending(tmp), [])
+
+def test_submit_pending_order():
+    tmp = maketemp()
+    b = spool.submit(tmp, 'b' * 40, _now=200)
+    a = spool.submit(tmp, 'a' * 40, full=True, _now=100)
+    # half written, and junk
+    writeFile(os.path.join(spool.spool_path(tmp), '300.1.tmp'), 'x')
+    writeFile(os.path.join(spool.spool_path(tmp), 'README'), 'x')
+    eq(spool.pending(tmp), [
+            (a, 'a' * 40, True),
+            (b, 'b' * 40, False),
+            ])
+
+def test_status():
+    tmp = maketemp()
+    eq(spool.status(tmp), (None, []))
+    spool.submit(tmp, 'a' * 40)
+    delta.writeState(tmp, dict(commit='b' * 40))
+    eq(spool.status(tmp), ('b' * 40, ['a' * 40]))
+
+def test_wait_timeout():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    commit = repository.rev_parse(admin_repository)
+    eq(spool.wait(admin_repository, commit, timeout=0, interval=0), False)
+
+def test_drain():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    eq(worker.drain(cfg, admin_repository), 0)
+    commit = repository.rev_parse(admin_repository)
+    spool.submit(admin_repository, commit, _now=100)
+    spool.submit(admin_repository, commit, _now=200)
+    eq(worker.drain(cfg, admin_repository), 2)
+    eq(spool.pending(admin_repository), [])
+    eq(spool.status(admin_repository), (commit, []))
+    assert os.path.exists(os.path.join(tmp, 'generated', 'projects.list'))
+    eq(spool.wait(admin_repository, commit, timeout=0), True)
+
+def test_drain_failure_keeps_entries():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    os.rmdir(os.path.join(tmp, 'generated'))
+    commit = repository.rev_parse(admin_repository)
+    path = spool.submit(admin_repository, commit)
+    try:
+        worker.drain(cfg, admin_repository)
+    except Exception:
+        pass
+    else:
+        raise AssertionError('expected the run to fail')
+    eq(spool.pending(admin_repository), [(path, commit, False)])
+
+def test_drain_logged():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    os.rmdir(os.path.join(tmp, 'generated'))
+    commit = repository.rev_parse(admin_repository)
+    path = spool.submit(admin_repository, commit)
+    eq(worker.drain_logged(cfg, admin_repository), 0)
+    eq(spool.pending(admin_repository), [(path, commit, False)])
+    os.mkdir(os.path.join(tmp, 'generated'))
+    eq(worker.drain_logged(cfg, admin_repository), 1)
+    eq(spool.pending(admin_repository), [])
+
+def test_main_wait_commit():
+    tmp = maketemp()
+    (cfg, repos, admin_repository) = setup_admin(tmp)
+    commit = repository.rev_parse(admin_repository)
+    spool.submit(admin_repository, commit)
+    worker.drain(cfg, admin_repository)
+    app = worker.Main()
+    parser = app.create_parser()
+    (options, args) = parser.parse_args(
+        ['--git-dir', admin_repository, '--wait', '--timeout=0', commit])
+    # returns, rather than exiting for the argument or the timeout
+    app.handle_args(parser, cfg, options, args)
+    (options, args) = parser.parse_args(
+        ['--git-dir', admin_repository, '--wait', commit, commit])
+    assert_raises(SystemExit, app.handle_args, parser, cfg, options, args)
@@ -0,0 +1,97 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import htaccess
+from gitosis.writer import Writer
+from gitosis.test.util import maketemp, mkdir, readFile, writeFile
+
+def test_write():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo')
+    w = Writer()
+    eq(w.write(path, 'one\n'), True)
+    eq(readFile(path), 'one\n')
+    ino = os.stat(path).st_ino
+    eq(w.write(path, 'one\n'), False)
+    eq(os.stat(path).st_ino, ino)
+    eq(w.write(path, 'two\n'), True)
+    eq(readFile(path), 'two\n')
+    eq((w.written, w.skipped), (2, 1))
+
+def test_write_prefix():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo')
+    writeFile(path, 'one\ntwo\n')
+    w = Writer()
+    eq(w.write(path, 'one\n'), True)
+    eq(readFile(path), 'one\n')
+
+def test_touch_remove():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo')
+    w = Writer()
+    eq(w.touch(path), True)
+    eq(w.touch(path), False)
+    assert os.path.exists(path)
+    eq(w.remove(path), True)
+    eq(w.remove(path), False)
+    assert not os.path.exists(path)
+    eq((w.written, w.skipped), (2, 2))
+
+def test_dry_run():
+    tmp = maketemp()
+    old = os.path.join(tmp, 'old')
+    writeFile(old, 'one\n')
+    new = os.path.join(tmp, 'new')
+    w = Writer(dry_run=True)
+    eq(w.write(old, 'one\n'), False)
+    eq(w.write(old, 'two\n'), True)
+    eq(w.write(new, 'two\n'), True)
+    eq(w.touch(new), True)
+    eq(w.remove(old), True)
+    eq(w.remove(new), False)
+    eq(readFile(old), 'one\n')
+    eq(os.listdir(tmp), ['old'])
+    eq((w.written, w.skipped, w.examined()), (4, 2, 6))
+    eq(w.sync(), 0)
+
+def test_write_mode():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'foo')
+    w = Writer()
+    w.write(path, 'x', mode=0755, sync=True)
+    eq(os.stat(path).st_mode & 0777, 0755)
+
+def test_sync():
+    tmp = maketemp()
+    mkdir(os.path.join(tmp, 'a'))
+    mkdir(os.path.join(tmp, 'b'))
+    w = Writer()
+    w.write(os.path.join(tmp, 'a', 'one'), 'x')
+    w.write(os.path.join(tmp, 'a', 'two'), 'x')
+    w.write(os.path.join(tmp, 'b', 'one'), 'x')
+    w.write(os.path.join(tmp, 'b', 'one'), 'x')
+    # one fsync per directory with changes
+    eq(w.sync(), 2)
+    eq(w.sync(), 0)
+
+def test_htaccess_unchanged():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    mkdir(repos)
+    mkdir(os.path.join(repos, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.add_section('group g')
+    cfg.set('group g', 'members', 'jdoe')
+    cfg.set('group g', 'readonly', 'foo')
+    w = Writer()
+    htaccess.gen_htaccess(cfg, writer=w)
+    path = htaccess.htaccess_path(os.path.join(repos, 'foo.git'))
+    ino = os.stat(path).st_ino
+    htaccess.gen_htaccess(cfg, writer=w)
+    eq(os.stat(path).st_ino, ino)
+    eq((w.written, w.skipped), (1, 1))
@@ -5,6 +5,9 @@ import os
 import shutil
 import stat
 import sys
+from ConfigParser import RawConfigParser
+
+from gitosis import init
 
 def mkdir(*a, **kw):
     try:
@@ -74,3 +77,37 @@ def check_mode(path, mode, is_file=None, is_dir=None):
 
     got = stat.S_IMODE(st.st_mode)
     eq(got, mode, 'File mode %04o!=%04o for %s' % (got, mode, path))
+
+def setup_admin(tmp):
+    """
+    Create a gitosis-admin repository and the directories
+    ``gitosis-run-hook`` writes to under ``tmp``.
+
+    Returns ``(cfg, repositories, admin_repository)``.
+    """
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    pubkey = (
+        'ssh-somealgo '
+        +'0123456789ABCDEFAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+        +'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA= fakeuser@fakehost')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey=pubkey,
+        user='theadmin',
+        )
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    ssh = os.path.join(tmp, 'ssh')
+    os.mkdir(ssh)
+    cfg.set(
+        'gitosis',
+        'ssh-authorized-keys-path',
+        os.path.join(ssh, 'authorized_keys'),
+        )
+    return (cfg, repos, admin_repository)
@@ -0,0 +1,281 @@
+"""
+Move cold repositories to a slower archive tier.
+
+With ``archive-dir`` set in the ``gitosis`` section,
+``gitosis-archive`` packs every repository not accessed (according
+to the ``access-log``) or modified for ``cold-after`` days into a
+compressed tarball under ``archive-dir`` and removes it from the
+repositories directory. Repositories smaller than
+``archive-min-size`` bytes are left alone.
+
+When ``gitosis-serve`` is asked for an archived repository, it
+restores it before running git. A lock per repository makes sure
+concurrent requests restore it only once, and that a repository is
+not archived under a request that has just been let in.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import tarfile
+import time
+
+from gitosis import accesslog
+from gitosis import app
+from gitosis import gitdaemon
+from gitosis import placement
+from gitosis import repoindex
+from gitosis import util
+
+log = logging.getLogger('gitosis.tier')
+
+def getArchiveDir(config):
+    path = util.getConfigDefault(config, 'gitosis', 'archive-dir', None)
+    if path is None:
+        return None
+    return os.path.expanduser(path)
+
+def getColdAfter(config):
+    """
+    Seconds without access after which a repository is cold.
+    """
+    days = util.getConfigDefault(config, 'gitosis', 'cold-after', '365')
+    return float(days) * 24 * 60 * 60
+
+def getMinSize(config):
+    return int(util.getConfigDefault(config, 'gitosis', 'archive-min-size', '0'))
+
+def archive_path(config, repopath):
+    return os.path.join(getArchiveDir(config), '%s.tar.gz' % repopath)
+
+def _mkdirs(base, repopath, mode=0750):
+    p = base
+    for segment in repopath.split(os.sep)[:-1]:
+        p = os.path.join(p, segment)
+        util.mkdir(p, mode)
+
+def lock_repo(config, repopath):
+    """
+    Take the archive lock of a repository; close the returned file
+    to release it.
+    """
+    archive_dir = getArchiveDir(config)
+    util.mkdir(archive_dir, 0750)
+    _mkdirs(archive_dir, repopath)
+    f = file('%s.lock' % archive_path(config, repopath), 'a')
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+def is_archived(config, repopath):
+    if getArchiveDir(config) is None:
+        return False
+    return os.path.exists(archive_path(config, repopath))
+
+def _last_modified(path):
+    last = 0
+    for p in ['', 'refs', 'packed-refs', 'logs']:
+        try:
+            st = os.stat(os.path.join(path, p))
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+        last = max(last, st.st_mtime)
+    return last
+
+def find_cold(config, _now=None, last_access=None):
+    """
+    Generate ``(repopath, last_used, size)`` for cold repositories.
+
+    ``last_access`` is an ``accesslog.LastAccess``, if one is kept.
+    """
+    if _now is None:
+        _now = time.time()
+    cutoff = _now - getColdAfter(config)
+    min_size = getMinSize(config)
+    if last_access is None:
+        last_access = accesslog.LastAccess(config)
+    last_access.refresh()
+
+    for (dirpath, repo, name) in gitdaemon.walk_repos(config):
+        if name == 'gitosis-admin':
+            continue
+        repopath = '%s.git' % name
+        fullpath = os.path.join(dirpath, repo)
+        last = max(last_access.last.get(repopath, 0),
+                   _last_modified(fullpath))
+        if last >= cutoff:
+            continue
+        size = util.diskUsage(os.path.realpath(fullpath))
+        if size < min_size:
+            continue
+        yield (repopath, last, size)
+
+def archive(config, topdir, repopath, since=None, last_access=None):
+    """
+    Replace a repository with a compressed copy in the archive.
+
+    The repository is kept if the access log shows it was used at
+    or after ``since`` (default: when this call started), as the
+    request may still be running. Pass the same ``last_access``, an
+    ``accesslog.LastAccess``, to archive many repositories with one
+    reading of the log.
+
+    Returns the number of bytes reclaimed.
+    """
+    if since is None:
+        since = time.time()
+    if last_access is None:
+        last_access = accesslog.LastAccess(config)
+    lock = lock_repo(config, repopath)
+    try:
+        fullpath = os.path.join(topdir, repopath)
+        if not os.path.exists(fullpath):
+            return 0
+        real = os.path.realpath(fullpath)
+        size = util.diskUsage(real)
+
+        dest = archive_path(config, repopath)
+        tmp = '%s.%d.tmp' % (dest, os.getpid())
+        f = file(tmp, 'wb')
+        try:
+            tar = tarfile.open(fileobj=f, mode='w:gz')
+            tar.add(real, arcname=os.path.basename(repopath))
+            tar.close()
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if last_access.get(repopath) >= int(since):
+            os.unlink(tmp)
+            log.info('Not archiving %r, it is in use', repopath)
+            return 0
+        os.rename(tmp, dest)
+
+        # make it disappear at once, then take our time deleting
+        doomed = os.path.join(
+            os.path.dirname(real),
+            '.%s.%d.cold' % (os.path.basename(real), os.getpid()),
+            )
+        os.rename(real, doomed)
+        if os.path.islink(fullpath):
+            os.unlink(fullpath)
+        repoindex.record(config, 'remove', repopath)
+        shutil.rmtree(doomed)
+        reclaimed = size - os.stat(dest).st_blocks * 512
+        log.info('Archived %r, reclaimed %d bytes', repopath, reclaimed)
+        return reclaimed
+    finally:
+        lock.close()
+
+def restore(config, topdir, repopath):
+    """
+    Bring an archived repository back.
+
+    Returns whether this call restored it; ``False`` means another
+    process got to it first.
+    """
+    lock = lock_repo(config, repopath)
+    try:
+        return _restore(config, topdir, repopath)
+    finally:
+        lock.close()
+
+def _restore(config, topdir, repopath):
+    fullpath = os.path.join(topdir, repopath)
+    if os.path.exists(fullpath):
+        return False
+    src = archive_path(config, repopath)
+
+    root = placement.choose_root(config)
+    if root is not None:
+        base = root
+    else:
+        base = topdir
+    _mkdirs(base, repopath)
+    dest = os.path.join(base, repopath)
+    tmp = os.path.join(
+        os.path.dirname(dest),
+        '.%s.%d.tmp' % (os.path.basename(dest), os.getpid()),
+        )
+    os.mkdir(tmp, 0750)
+    tar = tarfile.open(src, mode='r:gz')
+    try:
+        tar.extractall(tmp)
+    finally:
+        tar.close()
+    os.rename(os.path.join(tmp, os.path.basename(repopath)), dest)
+    os.rmdir(tmp)
+    if root is not None:
+        placement.link_placed(dest, topdir, repopath)
+    os.unlink(src)
+    repoindex.record(config, 'create', repopath, root)
+    log.info('Restored %r from archive', repopath)
+    return True
+
+def access(config, topdir, repopath, user, verb):
+    """
+    Log an access by ``gitosis-serve``, restoring the repository
+    first if it is archived.
+
+    Logging under the archive lock means ``archive`` either sees
+    this access and keeps the repository, or has finished and the
+    repository is restored here.
+    """
+    if getArchiveDir(config) is None:
+        accesslog.record(config, user, verb, repopath)
+        return
+    lock = lock_repo(config, repopath)
+    try:
+        accesslog.record(config, user, verb, repopath)
+        if is_archived(config, repopath):
+            _restore(config, topdir, repopath)
+    finally:
+        lock.close()
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Move cold repositories to the archive')
+        parser.set_defaults(
+            dry_run=False,
+            )
+        parser.add_option('--dry-run',
+                          action='store_true',
+                          help='only report what would be archived',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        os.umask(0022)
+        os.chdir(os.path.expanduser('~'))
+
+        if getArchiveDir(cfg) is None:
+            log.error('No archive-dir configured.')
+            return
+
+        topdir = util.getRepositoryDir(cfg)
+        count = 0
+        total = 0
+        since = time.time()
+        last_access = accesslog.LastAccess(cfg)
+        cold = list(find_cold(cfg, _now=since, last_access=last_access))
+        for (repopath, last, size) in cold:
+            if options.dry_run:
+                log.info('Would archive %r (%d bytes, last used %s)',
+                         repopath, size, time.ctime(last))
+                total += size
+            else:
+                total += archive(cfg, topdir, repopath, since=since,
+                                 last_access=last_access)
+            count += 1
+        if options.dry_run:
+            log.info('%d cold repositories, %d bytes', count, total)
+        else:
+            log.info('Archived %d repositories, reclaimed %d bytes',
+                     count, total)
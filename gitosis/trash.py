@@ -0,0 +1,340 @@
+"""
+Decommission repositories without deleting them on the spot.
+
+``gitosis-trash remove REPO`` renames a repository into
+``.gitosis-trash`` on the filesystem it lives on: the repositories
+directory, or the repository root it was placed on. The rename is
+atomic, and dot directories are never walked, so the repository is
+gone for ``gitosis-serve`` and the generated files at once.
+
+``gitosis-trash restore REPO`` puts it back, until
+``gitosis-trash reap``, run from cron, deletes what has been in the
+trash for ``trash-grace`` days (default 7). The reaper deletes at
+most ``trash-reap-rate`` bytes per second (default ``32m``, ``0``
+for no limit), so it does not starve git of disk bandwidth; only one
+reaper runs at a time.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import sys
+import time
+
+from gitosis import app
+from gitosis import limits
+from gitosis import placement
+from gitosis import repoindex
+from gitosis import util
+
+log = logging.getLogger('gitosis.trash')
+
+TRASH_DIR = '.gitosis-trash'
+
+# what unlinking even an empty file is charged
+MIN_COST = 4096
+
+class TrashError(Exception):
+    """Cannot do that"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+def getGrace(config):
+    """
+    Seconds a repository stays restorable.
+    """
+    days = util.getConfigDefault(config, 'gitosis', 'trash-grace', '7')
+    return float(days) * 24 * 60 * 60
+
+def getReapRate(config):
+    rate = util.getConfigDefault(config, 'gitosis', 'trash-reap-rate', '32m')
+    return limits.parseSize(rate)
+
+def trash_path(base):
+    return os.path.join(base, TRASH_DIR)
+
+def _bases(config):
+    bases = [util.getRepositoryDir(config)]
+    bases.extend(placement.getRoots(config))
+    return bases
+
+def _mkdirs(base, repopath, mode=0750):
+    p = base
+    for segment in repopath.split(os.sep)[:-1]:
+        p = os.path.join(p, segment)
+        util.mkdir(p, mode)
+
+def _normalize(repopath):
+    if not repopath.endswith('.git'):
+        repopath = '%s.git' % repopath
+    return repopath
+
+def _make_entry(trash, now):
+    """
+    Create a fresh entry directory named ``when.pid``, or
+    ``when.pid.seq`` when this process already made one that second.
+    """
+    name = '%d.%d' % (now, os.getpid())
+    seq = 0
+    while True:
+        entry = os.path.join(trash, name)
+        try:
+            os.mkdir(entry, 0750)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            seq += 1
+            name = '%d.%d.%d' % (now, os.getpid(), seq)
+        else:
+            return entry
+
+def remove(config, topdir, repopath, _now=None):
+    """
+    Move a repository to the trash. Returns the trash entry.
+    """
+    repopath = _normalize(repopath)
+    fullpath = os.path.join(topdir, repopath)
+    if not os.path.isdir(fullpath):
+        raise TrashError('no such repository', repopath)
+    root = placement.find_root(config, fullpath)
+    if root is not None:
+        base = root
+    else:
+        base = topdir
+    if _now is None:
+        _now = time.time()
+
+    trash = trash_path(base)
+    util.mkdir(trash, 0750)
+    entry = _make_entry(trash, _now)
+    f = file(os.path.join(entry, 'origin'), 'w')
+    try:
+        print >>f, repopath
+    finally:
+        f.close()
+    # the one step that makes it disappear
+    os.rename(os.path.realpath(fullpath), os.path.join(entry, 'repo.git'))
+    if root is not None:
+        os.unlink(fullpath)
+    repoindex.record(config, 'remove', repopath)
+    log.info('Moved %r to the trash', repopath)
+    return entry
+
+def _read_origin(entry):
+    try:
+        f = file(os.path.join(entry, 'origin'))
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        return f.read().strip() or None
+    finally:
+        f.close()
+
+def entries(config):
+    """
+    List ``(when, base, entry, repopath)`` for everything in the
+    trash, oldest first. Entries being reaped are left out.
+    """
+    found = []
+    for base in _bases(config):
+        trash = trash_path(base)
+        try:
+            names = os.listdir(trash)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+        for name in names:
+            parts = name.split('.')
+            try:
+                parts = [int(n) for n in parts]
+            except ValueError:
+                continue
+            if len(parts) == 2:
+                parts.append(0)
+            if len(parts) != 3:
+                continue
+            (when, pid, seq) = parts
+            entry = os.path.join(trash, name)
+            found.append(((when, seq), (when, base, entry,
+                                        _read_origin(entry))))
+    found.sort()
+    return [item for (key, item) in found]
+
+def restore(config, topdir, repopath):
+    """
+    Bring back the repository most recently trashed as ``repopath``.
+    """
+    repopath = _normalize(repopath)
+    candidates = [(when, base, entry)
+                  for (when, base, entry, origin) in entries(config)
+                  if origin == repopath]
+    if not candidates:
+        raise TrashError('not in the trash', repopath)
+    (when, base, entry) = candidates[-1]
+    fullpath = os.path.join(topdir, repopath)
+    if os.path.lexists(fullpath):
+        raise TrashError('repository exists', repopath)
+
+    dest = os.path.join(base, repopath)
+    _mkdirs(base, repopath)
+    try:
+        os.rename(os.path.join(entry, 'repo.git'), dest)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            raise TrashError('already being reaped', repopath)
+        raise
+    root = None
+    if os.path.realpath(base) != os.path.realpath(topdir):
+        root = base
+        placement.link_placed(dest, topdir, repopath)
+    os.unlink(os.path.join(entry, 'origin'))
+    os.rmdir(entry)
+    repoindex.record(config, 'create', repopath, root)
+    log.info('Restored %r from the trash', repopath)
+
+class Throttle(object):
+    """
+    Keep spending at no more than ``rate`` per second, by sleeping.
+    """
+
+    def __init__(self, rate, _time=time.time, _sleep=time.sleep):
+        self.rate = rate
+        self.spent = 0
+        self._time = _time
+        self._sleep = _sleep
+        self._start = _time()
+
+    def spend(self, amount):
+        self.spent += amount
+        if self.rate <= 0:
+            return
+        ahead = self.spent / float(self.rate) - (self._time() - self._start)
+        if ahead > 0:
+            self._sleep(ahead)
+
+def delete(path, throttle):
+    """
+    Delete the tree ``path``, charging ``throttle`` for each file.
+
+    Returns the bytes freed.
+    """
+    freed = 0
+    for (dirpath, dirnames, filenames) in os.walk(path, topdown=False):
+        for name in filenames + [d for d in dirnames
+                                 if os.path.islink(os.path.join(dirpath, d))]:
+            p = os.path.join(dirpath, name)
+            size = os.lstat(p).st_blocks * 512
+            os.unlink(p)
+            freed += size
+            throttle.spend(max(size, MIN_COST))
+        for name in dirnames:
+            p = os.path.join(dirpath, name)
+            if not os.path.islink(p):
+                os.rmdir(p)
+    os.rmdir(path)
+    return freed
+
+def _lock(trash):
+    f = file(os.path.join(trash, '.lock'), 'a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+    except IOError, e:
+        f.close()
+        if e.errno in [errno.EAGAIN, errno.EACCES]:
+            return None
+        raise
+    return f
+
+def reap(config, _now=None, _throttle=None):
+    """
+    Delete what has been in the trash longer than the grace period.
+
+    Returns ``(count, freed)``.
+    """
+    if _now is None:
+        _now = time.time()
+    cutoff = _now - getGrace(config)
+    throttle = _throttle
+    if throttle is None:
+        throttle = Throttle(getReapRate(config))
+    count = 0
+    freed = 0
+    for base in _bases(config):
+        trash = trash_path(base)
+        if not os.path.isdir(trash):
+            continue
+        lock = _lock(trash)
+        if lock is None:
+            log.info('Another reaper is busy in %r', trash)
+            continue
+        try:
+            for name in sorted(os.listdir(trash)):
+                entry = os.path.join(trash, name)
+                if name.endswith('.reaping'):
+                    # an earlier reaper did not finish
+                    doomed = entry
+                else:
+                    try:
+                        (when, pid) = [int(n) for n in name.split('.')]
+                    except ValueError:
+                        continue
+                    if when > cutoff:
+                        continue
+                    # restore checks for this before taking it back
+                    doomed = '%s.reaping' % entry
+                    os.rename(entry, doomed)
+                log.info('Reaping %r', _read_origin(doomed) or doomed)
+                freed += delete(doomed, throttle)
+                count += 1
+        finally:
+            lock.close()
+    return (count, freed)
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] remove|restore REPO...\n'
+                         +'       %prog [OPTS] list|reap')
+        parser.set_description(
+            'Decommission repositories through the trash')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        os.umask(0022)
+        os.chdir(os.path.expanduser('~'))
+
+        if not args:
+            parser.error('Missing command.')
+        command = args[0]
+        repos = args[1:]
+        topdir = util.getRepositoryDir(cfg)
+
+        if command in ['remove', 'restore']:
+            if not repos:
+                parser.error('Missing argument REPO.')
+            for repopath in repos:
+                try:
+                    if command == 'remove':
+                        remove(cfg, topdir, repopath)
+                    else:
+                        restore(cfg, topdir, repopath)
+                except TrashError, e:
+                    log.error('%s', e)
+                    sys.exit(1)
+        elif repos:
+            parser.error('Unexpected arguments.')
+        elif command == 'list':
+            grace = getGrace(cfg)
+            for (when, base, entry, origin) in entries(cfg):
+                print '%s\t%s\treaped after %s' % (
+                    origin, time.ctime(when), time.ctime(when + grace))
+        elif command == 'reap':
+            (count, freed) = reap(cfg)
+            log.info('Reaped %d repositories, freed %d bytes', count, freed)
+        else:
+            parser.error('Unknown command %r.' % command)
@@ -12,6 +12,20 @@ def mkdir(*a, **kw):
         else:
             raise
 
+def diskUsage(path):
+    """
+    Bytes of disk used by everything under ``path``.
+    """
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            total += st.st_blocks * 512
+    return total
+
 def getRepositoryDir(config):
     repositories = os.path.expanduser('~')
     try:
@@ -36,6 +50,26 @@ def getSSHAuthorizedKeysPath(config):
         path = os.path.expanduser('~/.ssh/authorized_keys')
     return path
 
+def getSSHCAKeys(config):
+    try:
+        keys = config.get('gitosis', 'ssh-ca-keys')
+    except (NoSectionError, NoOptionError):
+        return []
+    return [line.strip() for line in keys.splitlines() if line.strip()]
+
+def getSSHCAPrincipal(config):
+    try:
+        return config.get('gitosis', 'ssh-ca-principal')
+    except (NoSectionError, NoOptionError):
+        return 'gitosis'
+
+def getSSHKeyIndexPath(config):
+    try:
+        path = config.get('gitosis', 'ssh-key-index-path')
+    except (NoSectionError, NoOptionError):
+        return None
+    return os.path.expanduser(path)
+
 
 def getConfigList(config, section, entry):
     try:
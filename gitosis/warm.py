@@ -0,0 +1,247 @@
+"""
+Preload the packfiles of busy repositories into the page cache.
+
+``gitosis-warm`` ranks repositories by the number of accesses in the
+``access-log`` over the last ``warm-window`` days, and asks the kernel
+to read ahead their pack indexes, bitmaps, commit-graphs and packs,
+busiest repository first, until ``warm-budget`` bytes are covered.
+It then reports what fraction of the working set (the pack data of
+every repository accessed in the window) is resident.
+
+Read-ahead uses ``posix_fadvise(POSIX_FADV_WILLNEED)`` and residency
+is measured with ``mincore``; where those are not available the
+files are read instead, and residency is not reported.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import time
+
+from gitosis import accesslog
+from gitosis import app
+from gitosis import limits
+from gitosis import util
+
+log = logging.getLogger('gitosis.warm')
+
+POSIX_FADV_WILLNEED = 3
+PROT_READ = 1
+MAP_SHARED = 1
+
+_libc = None
+
+def _getLibc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        if name is None:
+            _libc = False
+        else:
+            libc = ctypes.CDLL(name, use_errno=True)
+            libc.posix_fadvise.argtypes = [
+                ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong,
+                ctypes.c_int]
+            libc.mmap.restype = ctypes.c_void_p
+            libc.mmap.argtypes = [
+                ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                ctypes.c_int, ctypes.c_int, ctypes.c_longlong]
+            libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+            libc.mincore.argtypes = [
+                ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+            _libc = libc
+    return _libc
+
+def getWindow(config):
+    days = util.getConfigDefault(config, 'gitosis', 'warm-window', '7')
+    return float(days) * 24 * 60 * 60
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+def getBudget(config):
+    value = util.getConfigDefault(config, 'gitosis', 'warm-budget', None)
+    if value is None:
+        return DEFAULT_BUDGET
+    try:
+        return limits.parseSize(value)
+    except ValueError:
+        log.warning('Ignoring bad warm-budget %r', value)
+        return DEFAULT_BUDGET
+
+def rank_repos(config, _now=None):
+    """
+    List repositories accessed within the window, busiest first.
+    """
+    if _now is None:
+        _now = time.time()
+    counts = {}
+    since = _now - getWindow(config)
+    for (when, user, verb, repopath) in accesslog.read(config, since=since):
+        counts[repopath] = counts.get(repopath, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [repopath for (repopath, n) in ranked]
+
+# smaller and more often used files first
+_PRIORITY = ['.idx', '.bitmap', '.rev', '.graph', '.pack']
+
+def _priority(path):
+    if 'commit-graph' in path:
+        return _PRIORITY.index('.graph')
+    ext = os.path.splitext(path)[1]
+    if ext in _PRIORITY:
+        return _PRIORITY.index(ext)
+    return None
+
+def pack_files(fullpath):
+    """
+    Generate ``(path, size)`` for the files worth warming in a
+    repository, most valuable first.
+    """
+    found = []
+    for sub in ['objects/pack', 'objects/info',
+                'objects/info/commit-graphs']:
+        d = os.path.join(fullpath, sub)
+        try:
+            names = os.listdir(d)
+        except OSError, e:
+            if e.errno in [errno.ENOENT, errno.ENOTDIR]:
+                continue
+            raise
+        for name in names:
+            path = os.path.join(d, name)
+            prio = _priority(path)
+            if prio is None:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not st.st_size or not os.path.isfile(path):
+                continue
+            found.append((prio, path, st.st_size))
+    found.sort()
+    for (prio, path, size) in found:
+        yield (path, size)
+
+def preload(path, size):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        libc = _getLibc()
+        if libc:
+            ret = libc.posix_fadvise(fd, 0, size, POSIX_FADV_WILLNEED)
+            if ret == 0:
+                return
+        # no fadvise, read it through
+        while os.read(fd, 1024 * 1024):
+            pass
+    finally:
+        os.close(fd)
+
+def resident(path, size):
+    """
+    Number of bytes of ``path`` in the page cache, or ``None`` if
+    that cannot be told.
+    """
+    libc = _getLibc()
+    if not libc or not size:
+        return None
+    pagesize = os.sysconf('SC_PAGESIZE')
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        addr = libc.mmap(None, size, PROT_READ, MAP_SHARED, fd, 0)
+        if addr is None or addr == ctypes.c_void_p(-1).value:
+            return None
+        try:
+            pages = (size + pagesize - 1) // pagesize
+            vec = ctypes.create_string_buffer(pages)
+            if libc.mincore(addr, size, vec) != 0:
+                return None
+            count = sum(1 for c in vec.raw if ord(c) & 1)
+        finally:
+            libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+    return min(count * pagesize, size)
+
+def warm(config, budget=None, _now=None):
+    """
+    Preload the busiest repositories within ``budget`` bytes.
+
+    Returns ``(files, warmed, working_set, resident)``, where
+    ``resident`` is ``None`` if it cannot be measured.
+    """
+    if budget is None:
+        budget = getBudget(config)
+    topdir = util.getRepositoryDir(config)
+
+    files = 0
+    warmed = 0
+    working_set = 0
+    in_cache = 0
+    for repopath in rank_repos(config, _now=_now):
+        fullpath = os.path.join(topdir, repopath)
+        for (path, size) in pack_files(fullpath):
+            working_set += size
+            if warmed + size <= budget:
+                log.debug('Warming %r', path)
+                preload(path, size)
+                files += 1
+                warmed += size
+            if in_cache is not None:
+                got = resident(path, size)
+                if got is None:
+                    in_cache = None
+                else:
+                    in_cache += got
+    return (files, warmed, working_set, in_cache)
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Preload packfiles of busy repositories into the page cache')
+        parser.set_defaults(
+            budget=None,
+            interval=None,
+            )
+        parser.add_option('--budget',
+                          metavar='BYTES',
+                          help='warm at most BYTES of files'
+                          +' (with an optional k, m or g suffix)',
+                          )
+        parser.add_option('--interval',
+                          metavar='SECONDS',
+                          type='int',
+                          help='keep running, warming every SECONDS',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        os.chdir(os.path.expanduser('~'))
+
+        budget = None
+        if options.budget is not None:
+            try:
+                budget = limits.parseSize(options.budget)
+            except ValueError:
+                parser.error('Invalid budget %r.' % options.budget)
+
+        if accesslog.getAccessLogPath(cfg) is None:
+            log.error('No access-log configured.')
+            return
+
+        while True:
+            (files, warmed, working_set, in_cache) = warm(
+                cfg, budget=budget)
+            log.info('Warmed %d files, %d bytes', files, warmed)
+            if in_cache is not None and working_set:
+                log.info('Resident: %d of %d bytes of working set (%.1f%%)',
+                         in_cache, working_set,
+                         100.0 * in_cache / working_set)
+            if options.interval is None:
+                break
+            time.sleep(options.interval)
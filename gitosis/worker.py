@@ -0,0 +1,132 @@
+"""
+Apply admin pushes queued by the ``post-update`` hook in async mode.
+
+See ``gitosis.spool``.
+"""
+
+import logging
+import os
+import sys
+import time
+
+from gitosis import app
+from gitosis import repository
+from gitosis import run_hook
+from gitosis import spool
+from gitosis import util
+
+log = logging.getLogger('gitosis.worker')
+
+def drain(cfg, git_dir):
+    """
+    Apply everything queued. Returns the number of entries taken.
+
+    Entries stay in the spool until applied, so a failed run is
+    retried by the next worker.
+    """
+    entries = spool.pending(git_dir)
+    if not entries:
+        return 0
+    full = False
+    for (path, commit, entry_full) in entries:
+        full = full or entry_full
+    log.info('Applying %d queued pushes, up to %s',
+             len(entries), entries[-1][1])
+    # coalesces with any other run in progress
+    run_hook.run_post_update(cfg, git_dir, full=full)
+    for (path, commit, entry_full) in entries:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return len(entries)
+
+def drain_logged(cfg, git_dir):
+    """
+    Like ``drain``, for a worker that keeps running: a failure is
+    logged rather than raised, and its entries are left for the next
+    try. Returns the number of entries applied.
+    """
+    try:
+        return drain(cfg, git_dir)
+    except Exception:
+        log.exception('Applying queued pushes failed, will retry')
+        return 0
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] [--wait [COMMIT]]')
+        parser.set_description(
+            'Apply gitosis-admin pushes queued by the post-update hook')
+        parser.set_defaults(
+            git_dir=None,
+            interval=None,
+            status=False,
+            wait=False,
+            timeout=None,
+            )
+        parser.add_option('--git-dir',
+                          metavar='DIR',
+                          help='gitosis-admin repository'
+                          +' (default: GIT_DIR or repositories/gitosis-admin.git)',
+                          )
+        parser.add_option('--interval',
+                          metavar='SECONDS',
+                          type='float',
+                          help='keep running, checking every SECONDS',
+                          )
+        parser.add_option('--status',
+                          action='store_true',
+                          help='show the last applied and the queued commits',
+                          )
+        parser.add_option('--wait',
+                          action='store_true',
+                          help='wait until the admin HEAD (or COMMIT) is applied',
+                          )
+        parser.add_option('--timeout',
+                          metavar='SECONDS',
+                          type='float',
+                          help='give up waiting after SECONDS, exit 1',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        if options.wait:
+            if len(args) > 1:
+                parser.error('Unexpected arguments.')
+        elif args:
+            parser.error('Unexpected arguments.')
+        os.umask(0022)
+
+        git_dir = options.git_dir
+        if git_dir is None:
+            git_dir = os.environ.get('GIT_DIR')
+        if git_dir is None:
+            git_dir = os.path.join(util.getRepositoryDir(cfg),
+                                   'gitosis-admin.git')
+
+        if options.status:
+            (applied, queued) = spool.status(git_dir)
+            print 'applied %s' % (applied or '-')
+            for commit in queued:
+                print 'pending %s' % commit
+            return
+
+        if options.wait:
+            if args:
+                (rev,) = args
+            else:
+                rev = 'HEAD'
+            commit = repository.rev_parse(git_dir, rev)
+            if not spool.wait(git_dir, commit, timeout=options.timeout):
+                log.error('Timed out waiting for %s', commit)
+                sys.exit(1)
+            return
+
+        if options.interval is None:
+            drain(cfg, git_dir)
+            return
+        while True:
+            drain_logged(cfg, git_dir)
+            time.sleep(options.interval)
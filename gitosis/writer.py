@@ -0,0 +1,160 @@
+"""
+Write generated files only when they change.
+
+Rewriting a file with the same content still makes a new inode:
+``gitweb`` and Apache see a changed file and re-read it, and backups
+copy it again. A ``Writer`` compares with what is there first, and
+skips files that would not change, keeping count of both.
+
+Changed files are written to a temporary file and renamed into
+place, as before. The directories they are in are remembered, and
+``sync()`` makes the renames durable with one ``fsync`` per
+directory, not per file.
+
+A ``Writer`` made with ``dry_run`` does all the comparing and
+counting, and logs what it would change instead of changing it.
+"""
+
+import errno
+import logging
+import os
+import threading
+
+log = logging.getLogger('gitosis.writer')
+
+class Writer(object):
+    """
+    Write, create and remove files, skipping what is already done.
+
+    Safe to use from several threads, as long as each file has one
+    writer.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self.written = 0
+        self.skipped = 0
+
+    def _done(self, path, changed):
+        self._lock.acquire()
+        try:
+            if changed:
+                self.written += 1
+                if not self.dry_run:
+                    self._dirs.add(os.path.dirname(os.path.abspath(path)))
+            else:
+                self.skipped += 1
+        finally:
+            self._lock.release()
+        return changed
+
+    def _would(self, action, path):
+        log.info('Would %s %r', action, path)
+        return self._done(path, True)
+
+    def examined(self):
+        return self.written + self.skipped
+
+    def changed(self, path):
+        """
+        Count ``path`` as changed by the caller, or as one it would
+        change with ``dry_run``.
+        """
+        if self.dry_run:
+            return self._would('change', path)
+        return self._done(path, True)
+
+    def unchanged(self, path):
+        """
+        Count ``path`` as compared by the caller and left alone.
+        """
+        return self._done(path, False)
+
+    def write(self, path, data, mode=None, sync=False):
+        """
+        Make ``path`` contain ``data``. Returns whether it was written.
+
+        A new file gets ``mode`` if given; with ``sync``, its data is
+        on disk before it is renamed into place.
+        """
+        try:
+            f = file(path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            try:
+                # one byte more tells a longer file apart
+                current = f.read(len(data) + 1)
+            finally:
+                f.close()
+            if current == data:
+                return self._done(path, False)
+
+        if self.dry_run:
+            return self._would('write', path)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = file(tmp, 'w')
+        try:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.rename(tmp, path)
+        return self._done(path, True)
+
+    def touch(self, path):
+        """
+        Make sure ``path`` exists, without changing it if it does.
+        """
+        if os.path.exists(path):
+            return self._done(path, False)
+        if self.dry_run:
+            return self._would('create', path)
+        file(path, 'a').close()
+        return self._done(path, True)
+
+    def remove(self, path):
+        """
+        Make sure ``path`` does not exist.
+        """
+        if self.dry_run:
+            if os.path.lexists(path):
+                return self._would('remove', path)
+            return self._done(path, False)
+        try:
+            os.unlink(path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return self._done(path, False)
+            raise
+        return self._done(path, True)
+
+    def sync(self):
+        """
+        Flush the directory entries of everything changed so far.
+        """
+        self._lock.acquire()
+        try:
+            dirs = sorted(self._dirs)
+            self._dirs = set()
+        finally:
+            self._lock.release()
+        for path in dirs:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return len(dirs)
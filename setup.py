@@ -45,6 +45,15 @@ arbitrary commands.
             'gitosis-serve = gitosis.serve:Main.run',
             'gitosis-run-hook = gitosis.run_hook:Main.run',
             'gitosis-init = gitosis.init:Main.run',
+            'gitosis-rebalance = gitosis.placement:Main.run',
+            'gitosis-refill-pool = gitosis.pool:Main.run',
+            'gitosis-authorized-keys = gitosis.authorized_keys:Main.run',
+            'gitosis-archive = gitosis.tier:Main.run',
+            'gitosis-warm = gitosis.warm:Main.run',
+            'gitosis-reindex = gitosis.reindex:Main.run',
+            'gitosis-worker = gitosis.worker:Main.run',
+            'gitosis-trash = gitosis.trash:Main.run',
+            'gitosis-admin-batch = gitosis.batch:Main.run',
             ],
         },
 